@@ -0,0 +1,97 @@
+"""
+Measure inline search latency at different index sizes.
+
+Builds a SearchIndex from synthetic jokes and memes (no network needed) and
+runs a mix of queries against it: single words, multi-word queries, short
+and long prefixes as typed by a user, and the empty query. Reports per-query
+latency percentiles for each index size.
+
+Usage:
+    python benchmarks/inline_search.py --sizes 1000 10000 50000 --queries 2000
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from latency import LatencyStats  # noqa: E402
+from search_index import SearchIndex, tokenize  # noqa: E402
+
+CATEGORIES = ["Programming", "Misc", "Pun", "Spooky", "Christmas"]
+SUBREDDITS = ["memes", "dankmemes", "wholesomememes", "me_irl", "ProgrammerHumor"]
+
+
+def vocabulary(size: int, rng: random.Random) -> List[str]:
+    """Random lowercase words; earlier ones are sampled more often (see build_index)."""
+    letters = "abcdefghijklmnoprstuvwy"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def build_index(size: int, words: List[str], rng: random.Random) -> SearchIndex:
+    index = SearchIndex(max_items=size)
+    # Zipf-like word frequencies, like real text
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    for i in range(size):
+        text = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(8, 30)))
+        if i % 2:
+            meme = {"title": text[:80], "subreddit": rng.choice(SUBREDDITS), "url": f"https://i.redd.it/{i}.png"}
+            index.add("meme", f"https://redd.it/{i}", meme, f"{meme['title']} {meme['subreddit']}")
+        else:
+            joke = {"id": i, "type": "single", "joke": text, "category": rng.choice(CATEGORIES)}
+            index.add("joke", str(i), joke, f"{text} {joke['category']}")
+    return index
+
+
+def sample_query(words: List[str], rng: random.Random) -> str:
+    word = rng.choice(words[:2000])
+    roll = rng.random()
+    if roll < 0.1:
+        return ""
+    if roll < 0.4:
+        return word
+    if roll < 0.7:
+        # Typed so far: a prefix of the word
+        return word[:rng.randint(1, len(word))]
+    return f"{rng.choice(words[:2000])} {word}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="Index sizes to test")
+    parser.add_argument("--queries", type=int, default=2000, help="Queries per index size")
+    parser.add_argument("--limit", type=int, default=20, help="Results per page")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = vocabulary(20000, rng)
+
+    for size in args.sizes:
+        start = time.perf_counter()
+        index = build_index(size, words, rng)
+        build_time = time.perf_counter() - start
+
+        latency = LatencyStats(f"search_{size}", window=args.queries)
+        hits = 0
+        for _ in range(args.queries):
+            query = sample_query(words, rng)
+            start = time.perf_counter()
+            results, _ = index.search(query, offset=rng.choice([0, 0, 0, args.limit]), limit=args.limit)
+            latency.record(time.perf_counter() - start)
+            hits += bool(results) or not tokenize(query)
+
+        stats = latency.stats()
+        print(
+            f"{size:>7} items ({index.stats()['words']} words, built in {build_time:.2f}s): "
+            f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms "
+            f"max={stats['max_ms']}ms, {hits / args.queries:.0%} of queries with results"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+Offline load test: the bot against local stand-ins for all of its services.
+
+Starts the upstream stub and the fake Bot API from stub_servers.py, launches
+main.py against them in a subprocess (with its data files in a temporary
+directory), and then plays many simulated chats. Each chat sends /joke,
+/meme, /joke N or /meme N (the "jokes" and "memes" actions), or presses a
+get_joke/get_meme button on the bot's last answer, waits for the answer,
+thinks for a moment and goes again.
+
+An update counts as answered when the bot sends, or edits in, a message that
+is not a loading text, or answers the button press with an error or busy
+text.
+Counters are reset once the bot starts polling, so warm-up fetches are not
+counted, but pool refills during the run are.
+
+Reports:
+- updates/s and p50/p95/p99 latency (update queued -> answer received), per
+  kind and overall
+- upstream calls per delivered joke or meme (API calls and image downloads)
+- Bot API calls per update and per delivered item, and calls per method
+
+An album counts as one item per photo, a combined joke message as
+--batch-size items.
+
+Usage:
+    python benchmarks/load_test.py --chats 50 --duration 30
+    python benchmarks/load_test.py --latency 200 --error-rate 0.1 --mix joke=1,meme=1,callback=2
+    python benchmarks/load_test.py --mix memes=1 --batch-size 5
+
+Bot settings can be overridden through the environment as usual, e.g.
+JOKE_API_RATE=50 to take the upstream rate limits out of the picture. With
+a short --think, the bot's per-chat send pacing (SEND_PRIVATE_CHAT_RATE,
+one message per second) shows up in the tail latency.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_servers import FakeBotApi, UpstreamStub, add_stub_arguments, serve  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ANSWER_METHODS = {"sendMessage", "sendPhoto", "sendMediaGroup", "editMessageText", "editMessageMedia"}
+LOADING_PREFIX = "🔍"
+SORRY_PREFIX = "😅"
+BUSY_PREFIX = "⏳"
+
+
+class Pending:
+    """The update a chat is waiting on."""
+
+    def __init__(self, kind: str, items: int = 1):
+        self.kind = kind
+        self.items = items
+        self.sent_at = time.perf_counter()
+        self.calls = 0
+        self.answered = asyncio.get_running_loop().create_future()
+
+
+class LoadTest:
+    """Simulated chats driving the bot through the fake Bot API."""
+
+    def __init__(
+        self, bot_api: FakeBotApi, mix: Dict[str, float], think: float, timeout: float, seed: int, batch_size: int
+    ):
+        self.bot_api = bot_api
+        self.mix = mix
+        self.batch_size = batch_size
+        self.think = think
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self._update_ids = iter(range(1, 10 ** 9))
+        self._pending: Dict[int, Pending] = {}
+        bot_api.on_call = self.on_call
+
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.calls_per_update: Dict[str, List[int]] = defaultdict(list)
+        self.sent = 0
+        self.timed_out = 0
+        self.delivered = 0
+        self.items = 0
+        self.sorry = 0
+        self.busy = 0
+
+    def on_call(self, method: str, params: Dict[str, Any], received: float):
+        chat_id = params.get("chat_id")
+        if chat_id is None and method == "answerCallbackQuery":
+            # Callback query IDs are "<chat>:<n>"
+            chat_id = str(params.get("callback_query_id", "")).split(":")[0]
+        try:
+            pending = self._pending.get(int(chat_id))
+        except (TypeError, ValueError):
+            return
+        if pending is None:
+            return
+        pending.calls += 1
+        if pending.answered.done():
+            return
+
+        text = None
+        if method in ANSWER_METHODS:
+            media = params.get("media")
+            if isinstance(media, list):
+                pending.items = len(media)
+                media = media[0] if media else {}
+            text = params.get("text") or params.get("caption") or (media or {}).get("caption") or ""
+            if text.startswith(LOADING_PREFIX):
+                return
+        elif method == "answerCallbackQuery" and params.get("text"):
+            text = params["text"]
+        if text is not None:
+            if text.startswith(SORRY_PREFIX):
+                outcome = "sorry"
+            elif text.startswith(BUSY_PREFIX):
+                outcome = "busy"
+            else:
+                outcome = "delivered"
+            pending.answered.set_result((received, outcome))
+
+    def message_update(self, chat_id: int, text: str) -> Dict[str, Any]:
+        user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": self.rng.randrange(1, 10 ** 6),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": user,
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+            },
+        }
+
+    def callback_update(self, chat_id: int, data: str, photo: bool) -> Dict[str, Any]:
+        user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+        message = self.bot_api.message(chat_id, photo=self.bot_api.photo()) if photo else self.bot_api.message(
+            chat_id, text="😂 Random Joke"
+        )
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": f"{chat_id}:{self.rng.randrange(10 ** 9)}",
+                "from": user,
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": message,
+            },
+        }
+
+    async def run_chat(self, chat_id: int, deadline: float):
+        last_answer: Optional[str] = None
+        actions = list(self.mix)
+        weights = [self.mix[action] for action in actions]
+        while time.perf_counter() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            if action == "callback" and last_answer is None:
+                action = self.rng.choice(("joke", "meme"))
+
+            items = 1
+            if action == "callback":
+                data = self.rng.choice(("get_joke", "get_meme"))
+                kind = f"callback:{data}"
+                update = self.callback_update(chat_id, data, photo=last_answer == "meme")
+            elif action in ("jokes", "memes"):
+                kind = f"/{action[:-1]} N"
+                items = self.batch_size
+                update = self.message_update(chat_id, f"/{action[:-1]} {items}")
+            else:
+                kind = f"/{action}"
+                update = self.message_update(chat_id, kind)
+
+            pending = self._pending[chat_id] = Pending(kind, items)
+            self.bot_api.push_update(update)
+            self.sent += 1
+            try:
+                received, outcome = await asyncio.wait_for(asyncio.shield(pending.answered), self.timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                continue
+            self.latencies[kind].append(received - pending.sent_at)
+            if outcome == "delivered":
+                self.delivered += 1
+                self.items += pending.items
+                if kind != "/meme N":
+                    # Albums have no buttons to press
+                    last_answer = "meme" if "meme" in kind else "joke"
+            elif outcome == "busy":
+                self.busy += 1
+            else:
+                self.sorry += 1
+
+            # Calls made after the answer (e.g. the button answer) still count;
+            # the last pause is cut short so it does not pad the run time
+            pause = self.rng.expovariate(1 / self.think) if self.think > 0 else 0.01
+            await asyncio.sleep(min(pause, max(0.05, deadline - time.perf_counter())))
+            self.calls_per_update[kind].append(pending.calls)
+
+    async def run(self, chats: int, duration: float) -> float:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(self.run_chat(chat_id, deadline) for chat_id in range(1, chats + 1)))
+        return time.perf_counter() - started
+
+
+def percentile(ordered: List[float], share: float) -> float:
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {"joke", "meme", "jokes", "memes", "callback"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown actions in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def report(test: LoadTest, upstream: UpstreamStub, bot_api: FakeBotApi, elapsed: float):
+    answered = sum(len(values) for values in test.latencies.values())
+    print(
+        f"{test.sent} updates sent, {answered} answered, {test.timed_out} timed out in {elapsed:.1f}s "
+        f"-> {answered / elapsed:.1f} updates/s"
+    )
+
+    print("Latency ms:        count     p50     p95     p99     max")
+    rows = sorted(test.latencies.items()) + [("all", [v for values in test.latencies.values() for v in values])]
+    for kind, values in rows:
+        if not values:
+            continue
+        ordered = sorted(values)
+        print(
+            f"  {kind:<18}{len(ordered):>5} {statistics.median(ordered) * 1000:>7.1f} "
+            f"{percentile(ordered, 0.95) * 1000:>7.1f} {percentile(ordered, 0.99) * 1000:>7.1f} "
+            f"{ordered[-1] * 1000:>7.1f}"
+        )
+
+    requests = upstream.requests
+    api_calls = requests["joke"] + requests["gimme"]
+    print(
+        f"Delivered {test.items} items in {test.delivered} answers, "
+        f"{test.sorry} 'not found' and {test.busy} 'busy' answers"
+    )
+    if test.items:
+        print(
+            f"Upstream calls per delivered item: {api_calls / test.items:.3f} API "
+            f"(JokeAPI {requests['joke']}, meme-api {requests['gimme']}), "
+            f"{requests['images'] / test.items:.3f} image downloads"
+        )
+
+    all_calls = [calls for values in test.calls_per_update.values() for calls in values]
+    if all_calls:
+        per_kind = ", ".join(
+            f"{kind} {statistics.mean(values):.2f}" for kind, values in sorted(test.calls_per_update.items())
+        )
+        print(f"Bot API calls per update: {statistics.mean(all_calls):.2f} ({per_kind})")
+        if test.items:
+            print(f"Bot API calls per delivered item: {sum(all_calls) / test.items:.2f}")
+    methods = {method: count for method, count in bot_api.calls.most_common() if method != "getUpdates"}
+    print(f"Bot API calls by method: {methods}")
+
+
+async def main_async(args: argparse.Namespace) -> int:
+    upstream = UpstreamStub(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        error_rate=args.error_rate,
+        flagged_ratio=args.flagged_ratio,
+        seed=args.seed,
+    )
+    bot_api = FakeBotApi(latency=args.bot_api_latency / 1000)
+    upstream_server = await serve(upstream.handle, "127.0.0.1", args.upstream_port)
+    bot_api_server = await serve(bot_api.handle, "127.0.0.1", args.bot_api_port)
+    upstream_port = upstream_server.sockets[0].getsockname()[1]
+    bot_api_port = bot_api_server.sockets[0].getsockname()[1]
+    upstream.image_base_url = f"http://127.0.0.1:{upstream_port}"
+
+    bot = None
+    with tempfile.TemporaryDirectory(prefix="bot-load-test-") as data_dir:
+        if args.spawn:
+            env = dict(os.environ)
+            env.update(
+                BOT_TOKEN="123:load-test",
+                BOT_API_BASE_URL=f"http://127.0.0.1:{bot_api_port}",
+                JOKE_API_URL=f"http://127.0.0.1:{upstream_port}/joke/Any",
+                MEME_API_URL=f"http://localhost:{upstream_port}/gimme",
+            )
+            for name, value in (
+                ("CONTENT_STORE_PATH", "content.db"),
+                ("SNAPSHOT_PATH", "snapshot.json.gz"),
+                ("FILE_ID_CACHE_PATH", "file_id_cache.json"),
+                ("IMAGE_CACHE_DIR", "images"),
+                ("TRACE_PATH", "traces.jsonl"),
+            ):
+                env.setdefault(name, os.path.join(data_dir, value))
+            log_path = args.bot_log or os.path.join(data_dir, "bot.log")
+            log_file = open(log_path, "w", encoding="utf-8")
+            bot = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, "main.py")],
+                cwd=ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+            )
+        else:
+            print(
+                f"Waiting for a bot with BOT_API_BASE_URL=http://127.0.0.1:{bot_api_port} "
+                f"JOKE_API_URL=http://127.0.0.1:{upstream_port}/joke/Any "
+                f"MEME_API_URL=http://localhost:{upstream_port}/gimme"
+            )
+
+        try:
+            try:
+                await asyncio.wait_for(bot_api.polling.wait(), args.startup_timeout)
+            except asyncio.TimeoutError:
+                print(f"Bot did not start polling within {args.startup_timeout}s")
+                return 1
+
+            upstream.requests.clear()
+            bot_api.calls.clear()
+            test = LoadTest(bot_api, args.mix, args.think, args.timeout, args.seed, args.batch_size)
+            elapsed = await test.run(args.chats, args.duration)
+            report(test, upstream, bot_api, elapsed)
+        finally:
+            if bot is not None:
+                bot.terminate()
+                try:
+                    bot.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    bot.kill()
+                log_file.close()
+            upstream_server.close()
+            bot_api_server.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=20, help="Simulated chats")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to generate load for")
+    parser.add_argument("--think", type=float, default=0.5, help="Mean pause between a chat's requests in seconds")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("joke=1,meme=1,callback=2"),
+                        help="Relative weights of joke, meme, jokes, memes and callback actions")
+    parser.add_argument("--batch-size", type=int, default=5, help="N sent with the jokes and memes actions")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for an answer")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--upstream-port", type=int, default=0, help="Upstream stub port (0 picks a free one)")
+    parser.add_argument("--bot-api-port", type=int, default=0, help="Fake Bot API port (0 picks a free one)")
+    parser.add_argument("--no-spawn", dest="spawn", action="store_false",
+                        help="Do not start main.py; wait for a bot started by hand")
+    parser.add_argument("--startup-timeout", type=float, default=60.0, help="Seconds to wait for the bot to poll")
+    parser.add_argument("--bot-log", default="", help="Where to write the bot's output (default: temporary)")
+    add_stub_arguments(parser)
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
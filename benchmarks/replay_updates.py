@@ -0,0 +1,118 @@
+"""
+Replay recorded Telegram updates against the bot's webhook listener.
+
+Each line of the input file is one Update as JSON, e.g. copied from
+getUpdates output. Update IDs and message dates are rewritten so the bot
+treats every replayed update as new, then the updates are POSTed to the
+webhook with the configured secret token.
+
+Usage:
+    BOT_MODE=webhook WEBHOOK_URL=https://bot.example.com WEBHOOK_SECRET_TOKEN=test python main.py
+    python benchmarks/replay_updates.py updates.jsonl \\
+        --url http://127.0.0.1:8443/telegram --secret test --concurrency 20
+
+The bot logs update age and handling time in its periodic "Stats:" line
+(the "updates" entry; set STATS_LOG_INTERVAL to log it more often), so
+running the same replay with BOT_MODE=polling against a local Bot API
+server gives the latency comparison between the two modes.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+
+def load_updates(path: str) -> List[Dict[str, Any]]:
+    """Read one JSON update per line, skipping blank lines."""
+    updates = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                updates.append(json.loads(line))
+    return updates
+
+
+def refresh_update(update: Dict[str, Any], update_id: int) -> Dict[str, Any]:
+    """Give a recorded update a fresh ID and current timestamps."""
+    update = json.loads(json.dumps(update))
+    update["update_id"] = update_id
+    now = int(time.time())
+    for key in ("message", "edited_message"):
+        if key in update:
+            update[key]["date"] = now
+    if "callback_query" in update and "message" in update["callback_query"]:
+        update["callback_query"]["message"]["date"] = now
+    return update
+
+
+async def replay(args: argparse.Namespace) -> int:
+    updates = load_updates(args.file)
+    if not updates:
+        print("No updates to replay")
+        return 1
+
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = args.secret
+
+    base_id = int(time.time() * 1000)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+
+        async def post(index: int, update: Dict[str, Any]):
+            nonlocal failures
+            body = refresh_update(update, base_id + index)
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(args.url, json=body, headers=headers)
+                    if response.status_code != 200:
+                        failures += 1
+                except httpx.HTTPError:
+                    failures += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        jobs = [
+            post(index, updates[index % len(updates)])
+            for index in range(args.repeat * len(updates))
+        ]
+        await asyncio.gather(*jobs)
+        elapsed = time.perf_counter() - start
+
+    sent = len(jobs)
+    print(f"Replayed {sent} updates in {elapsed:.2f}s ({sent / elapsed:.1f} updates/s), {failures} failed")
+    if latencies:
+        ordered = sorted(latencies)
+        print(
+            "POST latency ms: "
+            f"p50={statistics.median(ordered) * 1000:.1f} "
+            f"p95={ordered[int(0.95 * (len(ordered) - 1))] * 1000:.1f} "
+            f"max={ordered[-1] * 1000:.1f}"
+        )
+    return 0 if failures == 0 else 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="JSONL file with one recorded update per line")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram", help="Webhook URL to POST to")
+    parser.add_argument("--secret", default="", help="Webhook secret token")
+    parser.add_argument("--concurrency", type=int, default=10, help="Parallel POSTs")
+    parser.add_argument("--repeat", type=int, default=1, help="How many times to replay the file")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout in seconds")
+    sys.exit(asyncio.run(replay(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Local stand-ins for JokeAPI, meme-api and the Telegram Bot API.
+
+- UpstreamStub answers /joke/Any (JokeAPI) and /gimme/<n> (meme-api), plus
+  the meme images, with configurable latency, error rate and share of
+  flagged content. Every request is counted per route.
+- FakeBotApi implements the Bot API methods the bot uses. Updates queued
+  with push_update() are handed out through getUpdates long polling, and
+  every other call is recorded with its parameters so a load generator can
+  see what the bot sent. Point the bot at it with
+  BOT_API_BASE_URL=http://127.0.0.1:<port>.
+
+Both run on a small keep-alive HTTP/1.1 server built on asyncio streams, so
+no extra dependencies are needed. Run this file to start them on their own:
+
+    python benchmarks/stub_servers.py --upstream-port 8081 --bot-api-port 8082
+
+then start the bot with
+    BOT_TOKEN=123:stub BOT_API_BASE_URL=http://127.0.0.1:8082 \\
+    JOKE_API_URL=http://127.0.0.1:8081/joke/Any \\
+    MEME_API_URL=http://localhost:8081/gimme python main.py
+
+The meme-api stand-in is addressed as "localhost" so the bot keeps separate
+connection pools, rate limits and circuit breakers for the two upstreams,
+as it does for the real hosts.
+"""
+import argparse
+import asyncio
+import base64
+import email.parser
+import email.policy
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+# (status, content type, body)
+Response = Tuple[int, str, bytes]
+RequestHandler = Callable[[str, str, Dict[str, str], bytes], Awaitable[Response]]
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+# 32x32 JPEG; each meme gets its own copy with the meme ID appended after the
+# end-of-image marker, so images differ by hash but still decode
+JPEG_BYTES = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9PDkzODdASFxOQERXRTc4UG1RV19i"
+    "Z2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhCY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2Nj"
+    "Y2NjY2NjY2P/wAARCAAgACADASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUF"
+    "BAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVW"
+    "V1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi"
+    "4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAEC"
+    "AxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVm"
+    "Z2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq"
+    "8vP09fb3+Pn6/9oADAMBAAIRAxEAPwCSiiivGPWCiiigAooooAKKKKAP/9k="
+)
+
+JOKE_FLAGS = ("nsfw", "religious", "political", "racist", "sexist", "explicit")
+JOKE_CATEGORIES = ("Programming", "Misc", "Pun", "Spooky", "Christmas")
+WORDS = (
+    "cat", "dog", "printer", "monday", "coffee", "bug", "deploy", "keyboard",
+    "pizza", "cloud", "robot", "meeting", "wifi", "banana", "compiler", "sock",
+)
+
+
+def _json(payload: Any, status: int = 200) -> Response:
+    return status, "application/json", json.dumps(payload).encode("utf-8")
+
+
+async def _handle_connection(handler: RequestHandler, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers: Dict[str, str] = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", "0") or 0))
+
+            status, content_type, payload = await handler(method, target, headers, body)
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    except asyncio.CancelledError:
+        # Keep-alive connections are still open when the event loop shuts down
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(handler: RequestHandler, host: str, port: int) -> asyncio.AbstractServer:
+    """Start a keep-alive HTTP/1.1 server passing (method, target, headers, body) to handler."""
+    return await asyncio.start_server(
+        lambda reader, writer: _handle_connection(handler, reader, writer), host, port
+    )
+
+
+class UpstreamStub:
+    """JokeAPI and meme-api imitation with tunable latency, errors and flagged content."""
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        error_rate: float = 0.0,
+        flagged_ratio: float = 0.2,
+        catalog_size: int = 5000,
+        image_base_url: str = "",
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.flagged_ratio = flagged_ratio
+        self.catalog_size = catalog_size
+        self.image_base_url = image_base_url
+        self.rng = random.Random(seed)
+        self.requests: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    def _text(self, words: int) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(words))
+
+    def joke(self) -> Dict[str, Any]:
+        """A random joke; flagged_ratio of them carry an inappropriate flag."""
+        joke_id = self.rng.randrange(self.catalog_size)
+        flagged = self.rng.random() < self.flagged_ratio
+        flags = {flag: False for flag in JOKE_FLAGS}
+        if flagged:
+            flags[self.rng.choice(JOKE_FLAGS)] = True
+        joke = {
+            "error": False,
+            "category": JOKE_CATEGORIES[joke_id % len(JOKE_CATEGORIES)],
+            "flags": flags,
+            "id": joke_id,
+            "safe": not flagged,
+            "lang": "en",
+        }
+        if joke_id % 2:
+            joke.update(type="twopart", setup=f"Why did the {self._text(3)}?", delivery=f"Because {self._text(4)}.")
+        else:
+            joke.update(type="single", joke=f"My {self._text(6)}.")
+        return joke
+
+    def meme(self) -> Dict[str, Any]:
+        """A random meme; flagged_ratio of them are NSFW or spoilers."""
+        meme_id = self.rng.randrange(self.catalog_size)
+        flagged = self.rng.random() < self.flagged_ratio
+        url = f"{self.image_base_url}/images/{meme_id}.jpg"
+        return {
+            "postLink": f"https://redd.it/stub{meme_id}",
+            "subreddit": self.rng.choice(("memes", "dankmemes", "wholesomememes")),
+            "title": self._text(5),
+            "url": url,
+            "nsfw": flagged and self.rng.random() < 0.5,
+            "spoiler": flagged,
+            "author": f"user{meme_id % 97}",
+            "ups": self.rng.randrange(10000),
+            "preview": [url],
+        }
+
+    async def handle(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Response:
+        parts = urlsplit(target)
+        path = parts.path.rstrip("/")
+        route = path.split("/")[1] if path.count("/") >= 1 else ""
+        self.requests[route] += 1
+
+        if route == "images":
+            image_id = path.rsplit("/", 1)[-1].split(".")[0]
+            return 200, "image/jpeg", JPEG_BYTES + image_id.encode("ascii")
+
+        delay = max(0.0, self.rng.gauss(self.latency, self.jitter))
+        await asyncio.sleep(delay)
+        if self.rng.random() < self.error_rate:
+            self.errors[route] += 1
+            return _json({"error": True, "message": "stub error"}, status=500)
+
+        if route == "joke":
+            amount = int(dict(parse_qsl(parts.query)).get("amount", 1))
+            if amount == 1:
+                return _json(self.joke())
+            jokes = [self.joke() for _ in range(amount)]
+            return _json({"error": False, "amount": amount, "jokes": jokes})
+        if route == "gimme":
+            tail = path.rsplit("/", 1)[-1]
+            if not tail.isdigit():
+                return _json(self.meme())
+            memes = [self.meme() for _ in range(int(tail))]
+            count = len(memes)
+            return _json({"count": count, "memes": memes})
+        return _json({"error": True, "message": "not found"}, status=404)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": dict(self.requests), "errors": dict(self.errors)}
+
+
+def parse_form(headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+    """Decode a Bot API request body (urlencoded or multipart); JSON values are decoded."""
+    content_type = headers.get("content-type", "")
+    params: Dict[str, Any] = {}
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename() is None and name:
+                params[name] = part.get_content()
+            elif name:
+                params[name] = "<file>"
+    elif body:
+        params.update(parse_qsl(body.decode("utf-8")))
+
+    for name, value in params.items():
+        if isinstance(value, str) and (value[:1] in ("{", "[") or value in ("true", "false")):
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+
+class FakeBotApi:
+    """Bot API stand-in serving queued updates and recording every call."""
+
+    def __init__(self, latency: float = 0.0, bot_id: int = 123):
+        self.latency = latency
+        self.bot_id = bot_id
+        self._updates: List[Dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count()
+        self.polling = asyncio.Event()
+        self.calls: Counter = Counter()
+        # Called with (method, params, time received) for every non-polling call
+        self.on_call: Optional[Callable[[str, Dict[str, Any], float], None]] = None
+
+    def push_update(self, update: Dict[str, Any]):
+        """Queue an update for the next getUpdates call."""
+        self._updates.append(update)
+        self._new_updates.set()
+
+    def message(self, chat_id: Any, **fields: Any) -> Dict[str, Any]:
+        """A message from the bot, as the Bot API would return it."""
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 else "group"
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": chat_type},
+            "from": {"id": self.bot_id, "is_bot": True, "first_name": "Bot", "username": "stub_bot"},
+        }
+        message.update(fields)
+        return message
+
+    def photo(self) -> List[Dict[str, Any]]:
+        file_id = f"stub-photo-{next(self._file_ids)}"
+        return [{"file_id": file_id, "file_unique_id": file_id, "width": 32, "height": 32}]
+
+    async def get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.polling.set()
+        offset = int(params.get("offset", 0) or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=float(params.get("timeout", 0) or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit", 100) or 100)
+        return self._updates[:limit]
+
+    def result(self, method: str, params: Dict[str, Any]) -> Any:
+        chat_id = params.get("chat_id")
+        if method == "getMe":
+            return {"id": self.bot_id, "is_bot": True, "first_name": "Bot", "username": "stub_bot"}
+        if method == "sendMessage":
+            return self.message(chat_id, text=params.get("text", ""))
+        if method == "sendPhoto":
+            return self.message(chat_id, photo=self.photo(), caption=params.get("caption", ""))
+        if method == "sendMediaGroup":
+            media = params.get("media") or []
+            return [
+                self.message(chat_id, photo=self.photo(), caption=item.get("caption", ""), media_group_id="stub")
+                for item in media
+            ]
+        if method == "editMessageText":
+            return self.message(chat_id, text=params.get("text", "")) if chat_id else True
+        if method == "editMessageMedia":
+            media = params.get("media") or {}
+            return self.message(chat_id, photo=self.photo(), caption=media.get("caption", "")) if chat_id else True
+        return True
+
+    async def handle(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Response:
+        received = time.perf_counter()
+        # /bot<token>/<method>
+        api_method = urlsplit(target).path.rsplit("/", 1)[-1]
+        params = parse_form(headers, body)
+        self.calls[api_method] += 1
+
+        if api_method == "getUpdates":
+            return _json({"ok": True, "result": await self.get_updates(params)})
+
+        if self.on_call is not None:
+            self.on_call(api_method, params, received)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return _json({"ok": True, "result": self.result(api_method, params)})
+
+
+async def run_standalone(args: argparse.Namespace):
+    upstream = UpstreamStub(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        error_rate=args.error_rate,
+        flagged_ratio=args.flagged_ratio,
+        image_base_url=f"http://127.0.0.1:{args.upstream_port}",
+    )
+    bot_api = FakeBotApi(latency=args.bot_api_latency / 1000)
+    servers = [
+        await serve(upstream.handle, args.host, args.upstream_port),
+        await serve(bot_api.handle, args.host, args.bot_api_port),
+    ]
+    print(f"Upstream stub on http://{args.host}:{args.upstream_port}, fake Bot API on http://{args.host}:{args.bot_api_port}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"upstream {upstream.stats()} | bot api {dict(bot_api.calls)}")
+    finally:
+        for server in servers:
+            server.close()
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    """Options shared by the standalone stubs and the load test."""
+    parser.add_argument("--latency", type=float, default=50.0, help="Mean upstream latency in ms")
+    parser.add_argument("--jitter", type=float, default=20.0, help="Upstream latency standard deviation in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of upstream requests answered with 500")
+    parser.add_argument("--flagged-ratio", type=float, default=0.2, help="Share of jokes/memes that should be filtered")
+    parser.add_argument("--bot-api-latency", type=float, default=0.0, help="Fake Bot API latency in ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--upstream-port", type=int, default=8081)
+    parser.add_argument("--bot-api-port", type=int, default=8082)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_standalone(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
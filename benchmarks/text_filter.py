@@ -0,0 +1,87 @@
+"""
+Compare batch text filtering with item-by-item checks.
+
+Generates synthetic meme titles and a blocklist (no network needed), then
+times three ways of finding the titles that break a rule:
+
+- naive: every rule checked against every title on its own (one regex per
+  word, as a hand-written filter loop would)
+- per-item: the compiled TextFilter pattern, one search per title
+- batch: TextFilter.check_batch, as the bot calls it per fetched batch
+
+Usage:
+    python benchmarks/text_filter.py --words 500 --batch 20 --batches 2000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_filter import TextFilter, parse_rules  # noqa: E402
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice("abcdefghijklmnoprstuvwy") for _ in range(rng.randint(3, 9)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=500, help="Blocked words in the rule set")
+    parser.add_argument("--regexes", type=int, default=10, help="Regex rules in the rule set")
+    parser.add_argument("--batch", type=int, default=20, help="Titles per batch (MEME_BATCH_SIZE)")
+    parser.add_argument("--batches", type=int, default=2000, help="Number of batches")
+    parser.add_argument("--hit-rate", type=float, default=0.05, help="Share of titles containing a blocked word")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    blocked = [random_word(rng) for _ in range(args.words)]
+    lines = blocked + [f"re:\\b{random_word(rng)}\\d+\\b" for _ in range(args.regexes)]
+    common = [random_word(rng) for _ in range(5000)]
+
+    batches = []
+    for _ in range(args.batches):
+        batch = []
+        for _ in range(args.batch):
+            title = [rng.choice(common) for _ in range(rng.randint(4, 14))]
+            if rng.random() < args.hit_rate:
+                title.insert(rng.randrange(len(title)), rng.choice(blocked))
+            batch.append(" ".join(title))
+        batches.append(batch)
+    items = args.batch * args.batches
+
+    text_filter = TextFilter(None)
+    text_filter.compile(lines)
+
+    words, regexes = parse_rules(lines)
+    naive_rules = [re.compile(rf"(?<!\w){re.escape(word)}(?!\w)", re.IGNORECASE) for word in words]
+    naive_rules += [re.compile(regex, re.IGNORECASE) for regex in regexes]
+
+    def naive(batch):
+        return [next((rule.pattern for rule in naive_rules if rule.search(title)), None) for title in batch]
+
+    def per_item(batch):
+        return [text_filter.match(title) for title in batch]
+
+    timings = {}
+    results = {}
+    for name, check in (("naive", naive), ("per-item", per_item), ("batch", text_filter.check_batch)):
+        start = time.perf_counter()
+        results[name] = [check(batch) for batch in batches]
+        timings[name] = time.perf_counter() - start
+
+    flagged = {name: sum(rule is not None for batch in result for rule in batch) for name, result in results.items()}
+    print(f"{items} titles in batches of {args.batch}, {len(words)} words + {len(regexes)} regexes")
+    for name, seconds in timings.items():
+        print(
+            f"{name:>9}: {seconds:.3f}s, {items / seconds:,.0f} titles/s, "
+            f"{flagged[name]} flagged, {timings['naive'] / seconds:.1f}x naive"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Circuit breakers for upstream APIs.
+
+After a run of consecutive failures a breaker opens and rejects calls
+immediately, so handlers fail fast instead of waiting on a dead service.
+Once the reset timeout has passed it lets a few probe calls through
+(half-open); a successful probe closes it again, a failed one re-opens it.
+"""
+import logging
+import time
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuit for {name} is open, retry in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker for one upstream."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probes_in_flight = 0
+
+        self.rejected = 0
+        self.transitions: Dict[str, int] = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit for {self.name}: {self.state} -> {state}")
+        self.state = state
+        self.transitions[state] += 1
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self._probes_in_flight = 0
+
+    @property
+    def retry_in(self) -> float:
+        """Seconds until an open circuit lets a probe through."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN and self.retry_in > 0
+
+    def before_call(self):
+        """
+        Check whether a call may proceed.
+
+        Raises:
+            CircuitOpenError: If the circuit is open or out of half-open probes
+        """
+        if self.state == OPEN:
+            if self.retry_in > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.retry_in)
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_max_calls:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, 0.0)
+            self._probes_in_flight += 1
+
+    def release_call(self):
+        """Forget a call that ended without a verdict (e.g. it was cancelled)."""
+        if self.state == HALF_OPEN and self._probes_in_flight > 0:
+            self._probes_in_flight -= 1
+
+    def record_success(self):
+        """Record a successful call."""
+        self.consecutive_failures = 0
+        self._transition(CLOSED)
+
+    def record_failure(self):
+        """Record a failed call, opening the circuit if needed."""
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._transition(OPEN)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the breaker state and transition counters."""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in": round(self.retry_in, 2),
+            "rejected": self.rejected,
+            "opened": self.transitions[OPEN],
+            "half_opened": self.transitions[HALF_OPEN],
+            "closed": self.transitions[CLOSED],
+        }
@@ -0,0 +1,227 @@
+"""
+Request coalescing ("singleflight") for live upstream fetches.
+
+When the content pools are empty, many handlers may ask for the same kind of
+content at once. A Coalescer lets them share one in-flight upstream batch:
+each waiter gets a distinct item from the batch, further batches are only
+requested while waiters remain, and leftover items are handed back (usually
+to the content pool). A batch fetcher that finishes items one by one can
+hand each to a waiter as soon as it is ready with deliver(). Failed batches are retried with jittered exponential
+backoff, and each caller waits no longer than its own deadline.
+"""
+import asyncio
+import logging
+import random
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from circuit import CircuitOpenError
+from metrics import FETCH_ATTEMPTS, FETCH_FAILURES
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+BatchFetcher = Callable[[], Awaitable[List[Dict[str, Any]]]]
+SurplusHandler = Callable[[Dict[str, Any]], Any]
+
+
+class Coalescer:
+    """Shares in-flight upstream batches between concurrent callers."""
+
+    def __init__(
+        self,
+        name: str,
+        fetch_batch: BatchFetcher,
+        on_surplus: Optional[SurplusHandler] = None,
+        max_attempts: int = 10,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+    ):
+        self.name = name
+        self.fetch_batch = fetch_batch
+        self.on_surplus = on_surplus
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._task: Optional[asyncio.Task] = None
+        # Items handed out with deliver() during the current batch
+        self._delivered = 0
+
+        self.calls = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.fanned_out = 0
+        self.surplus = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.fast_failures = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def get(self, deadline: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Wait for one item, joining the in-flight fetch if there is one.
+
+        Args:
+            deadline: Maximum seconds to wait, None to wait for the fetch to give up
+
+        Returns:
+            A content item, or None if the deadline passed, the upstream circuit
+            is open, or max_attempts batches in a row came back empty
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self._join([waiter])
+
+        try:
+            return await asyncio.wait_for(waiter, deadline)
+        except asyncio.TimeoutError:
+            # wait_for cancelled the waiter, so the fetch loop skips it
+            self.timeouts += 1
+            FETCH_FAILURES.inc(self.name, "deadline")
+            logger.warning(f"Gave up waiting for {self.name} after {deadline:.1f}s")
+            return None
+
+    async def get_many(self, count: int, deadline: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Wait for up to count items at once.
+
+        The items queue up together, so a single batch usually serves all of
+        them; only the shortfall of a batch is fetched again.
+
+        Args:
+            count: Number of items wanted
+            deadline: Maximum seconds to wait, None to wait for the fetch to give up
+
+        Returns:
+            The items found, fewer than count if the fetch gave up or the
+            deadline passed first
+        """
+        if count <= 0:
+            return []
+        loop = asyncio.get_running_loop()
+        waiters = [loop.create_future() for _ in range(count)]
+        self._join(waiters)
+
+        _, pending = await asyncio.wait(waiters, timeout=deadline)
+        if pending:
+            # Cancelled waiters are skipped by the fetch loop
+            for waiter in pending:
+                waiter.cancel()
+            self.timeouts += len(pending)
+            FETCH_FAILURES.inc(self.name, "deadline", amount=len(pending))
+            logger.warning(f"Gave up waiting for {len(pending)} {self.name} item(s) after {deadline:.1f}s")
+        return [
+            waiter.result() for waiter in waiters
+            if not waiter.cancelled() and waiter.result() is not None
+        ]
+
+    def _join(self, waiters: List[asyncio.Future]):
+        """Queue waiters, starting a fetch unless one is in flight."""
+        self._waiters.extend(waiters)
+        self.calls += len(waiters)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"{self.name}-coalescer")
+        else:
+            self.coalesced += len(waiters)
+
+    def deliver(self, item: Dict[str, Any]) -> bool:
+        """
+        Hand an item to the next waiting caller before its batch is complete.
+
+        Returns:
+            False if nobody is waiting; the fetcher then returns the item
+            with the rest of its batch
+        """
+        waiter = self._next_waiter()
+        if waiter is None:
+            return False
+        waiter.set_result(item)
+        self.fanned_out += 1
+        self._delivered += 1
+        return True
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before the next attempt."""
+        cap = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            # Skip callers that were cancelled while waiting
+            if not waiter.done():
+                return waiter
+        return None
+
+    async def _run(self):
+        attempt = 0
+        try:
+            while self.waiting and attempt < self.max_attempts:
+                attempt += 1
+                self.batches += 1
+                self._delivered = 0
+                try:
+                    with span(f"fetch_batch:{self.name}", attempt=attempt) as batch_span:
+                        items = await self.fetch_batch()
+                        if batch_span is not None:
+                            batch_span.set(items=len(items))
+                except asyncio.CancelledError:
+                    raise
+                except CircuitOpenError as e:
+                    # Upstream is known to be down: fail fast instead of retrying
+                    logger.info(f"Not fetching {self.name}: {e}")
+                    self.fast_failures += self.waiting
+                    FETCH_FAILURES.inc(self.name, "circuit_open", amount=self.waiting)
+                    return
+                except Exception as e:
+                    logger.error(f"Error fetching {self.name} (attempt {attempt}): {e}")
+                    items = []
+
+                if not items and not self._delivered:
+                    logger.info(f"No usable {self.name} in batch (attempt {attempt})")
+                    if attempt < self.max_attempts and self.waiting:
+                        await asyncio.sleep(self._backoff(attempt))
+                    continue
+
+                logger.info(f"Found {len(items) + self._delivered} {self.name} item(s) after {attempt} attempts")
+                FETCH_ATTEMPTS.observe(attempt, self.name)
+                # Consecutive empty batches are what gives up, not total batches
+                attempt = 0
+                for item in items:
+                    waiter = self._next_waiter()
+                    if waiter is not None:
+                        waiter.set_result(item)
+                        self.fanned_out += 1
+                    elif self.on_surplus is not None:
+                        self.on_surplus(item)
+                        self.surplus += 1
+
+            if self.waiting:
+                logger.warning(f"Failed to find {self.name} after {self.max_attempts} attempts")
+                self.failures += self.waiting
+                FETCH_FAILURES.inc(self.name, "attempts_exhausted", amount=self.waiting)
+        finally:
+            # Nothing left to hand out: release anyone still waiting
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        """Return coalescing counters."""
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "fanned_out": self.fanned_out,
+            "surplus": self.surplus,
+            "failures": self.failures,
+            "fast_failures": self.fast_failures,
+            "timeouts": self.timeouts,
+            "waiting": self.waiting,
+        }
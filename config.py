@@ -0,0 +1,208 @@
+"""
+Runtime configuration for the Entertainment Bot.
+
+Every setting can be overridden with an environment variable of the same
+name, so the bot can be tuned per deployment without code changes.
+"""
+import os
+from typing import Set
+
+
+def _env_str(name: str, default: str) -> str:
+    """Read a string setting from the environment."""
+    return os.getenv(name, default)
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+
+def _env_int_set(name: str) -> Set[int]:
+    """Read a comma-separated set of integers from the environment."""
+    value = os.getenv(name, "")
+    return {int(part) for part in value.split(",") if part.strip()}
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean setting (1/true/yes/on) from the environment."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Upstream HTTP client
+HTTP_CONNECT_TIMEOUT = _env_float("HTTP_CONNECT_TIMEOUT", 3.0)
+HTTP_READ_TIMEOUT = _env_float("HTTP_READ_TIMEOUT", 5.0)
+HTTP_MAX_CONNECTIONS_PER_HOST = _env_int("HTTP_MAX_CONNECTIONS_PER_HOST", 10)
+HTTP_KEEPALIVE_CONNECTIONS_PER_HOST = _env_int("HTTP_KEEPALIVE_CONNECTIONS_PER_HOST", 5)
+HTTP_KEEPALIVE_EXPIRY = _env_float("HTTP_KEEPALIVE_EXPIRY", 30.0)
+
+# Pre-filtered content pools
+JOKE_POOL_LOW_WATERMARK = _env_int("JOKE_POOL_LOW_WATERMARK", 5)
+JOKE_POOL_HIGH_WATERMARK = _env_int("JOKE_POOL_HIGH_WATERMARK", 25)
+MEME_POOL_LOW_WATERMARK = _env_int("MEME_POOL_LOW_WATERMARK", 5)
+MEME_POOL_HIGH_WATERMARK = _env_int("MEME_POOL_HIGH_WATERMARK", 25)
+POOL_MAX_AGE = _env_float("POOL_MAX_AGE", 1800.0)
+POOL_REFILL_INTERVAL = _env_float("POOL_REFILL_INTERVAL", 10.0)
+
+# Batch upstream fetching
+JOKE_BATCH_SIZE = _env_int("JOKE_BATCH_SIZE", 10)
+MEME_BATCH_SIZE = _env_int("MEME_BATCH_SIZE", 20)
+
+# Telegram file_id cache for meme photos
+FILE_ID_CACHE_PATH = _env_str("FILE_ID_CACHE_PATH", "data/file_id_cache.json")
+FILE_ID_CACHE_SIZE = _env_int("FILE_ID_CACHE_SIZE", 5000)
+# Seconds between writes of new file_ids to disk
+FILE_ID_SAVE_INTERVAL = _env_float("FILE_ID_SAVE_INTERVAL", 30.0)
+# Private chat/channel the bot pre-uploads prefetched memes to (0 disables it)
+MEME_CACHE_CHAT_ID = _env_int("MEME_CACHE_CHAT_ID", 0)
+MEME_PREUPLOAD_CONCURRENCY = _env_int("MEME_PREUPLOAD_CONCURRENCY", 3)
+
+# Meme images are downloaded, validated and cached here before they are sent
+# (empty disables the pipeline and memes are sent by URL)
+IMAGE_CACHE_DIR = _env_str("IMAGE_CACHE_DIR", "data/images")
+IMAGE_CACHE_MAX_BYTES = _env_int("IMAGE_CACHE_MAX_BYTES", 200 * 1024 * 1024)
+# Downloads larger than this are abandoned
+IMAGE_MAX_DOWNLOAD_BYTES = _env_int("IMAGE_MAX_DOWNLOAD_BYTES", 20 * 1024 * 1024)
+# Larger images are downscaled/recompressed (needs Pillow)
+IMAGE_MAX_BYTES = _env_int("IMAGE_MAX_BYTES", 5 * 1024 * 1024)
+IMAGE_MAX_SIDE = _env_int("IMAGE_MAX_SIDE", 2560)
+IMAGE_WORKERS = _env_int("IMAGE_WORKERS", 2)
+IMAGE_DOWNLOAD_CONCURRENCY = _env_int("IMAGE_DOWNLOAD_CONCURRENCY", 5)
+
+# Local SQLite store of filtered content, used when upstreams are down (empty disables it)
+CONTENT_STORE_PATH = _env_str("CONTENT_STORE_PATH", "data/content.db")
+# Per-chat "already seen" Bloom filters: size in bits, hash count, items
+# added before a filter is reset, and seconds changed filters are held in
+# memory before they are written out together
+SEEN_FILTER_BITS = _env_int("SEEN_FILTER_BITS", 8192)
+SEEN_FILTER_HASHES = _env_int("SEEN_FILTER_HASHES", 4)
+SEEN_FILTER_CAPACITY = _env_int("SEEN_FILTER_CAPACITY", 800)
+SEEN_FLUSH_INTERVAL = _env_float("SEEN_FLUSH_INTERVAL", 5.0)
+
+# Warm-start snapshot of pooled content, written on shutdown (empty disables it)
+SNAPSHOT_PATH = _env_str("SNAPSHOT_PATH", "data/snapshot.json.gz")
+# Longest startup may spend topping up the pools before accepting updates
+WARMUP_TIMEOUT = _env_float("WARMUP_TIMEOUT", 10.0)
+
+# Text filter rules (blocked words and "re:" regexes), re-read when the file changes
+FILTER_RULES_PATH = _env_str("FILTER_RULES_PATH", "filter_rules.txt")
+FILTER_RULES_CHECK_INTERVAL = _env_float("FILTER_RULES_CHECK_INTERVAL", 5.0)
+
+# Prometheus metrics endpoint, served at /metrics (port 0 disables it)
+METRICS_LISTEN = _env_str("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = _env_int("METRICS_PORT", 0)
+
+# Per-update tracing: share of updates traced (0 disables it) and the JSONL
+# file span trees are written to, rotated at TRACE_MAX_BYTES
+TRACE_SAMPLE_RATE = _env_float("TRACE_SAMPLE_RATE", 0.0)
+TRACE_PATH = _env_str("TRACE_PATH", "data/traces.jsonl")
+TRACE_MAX_BYTES = _env_int("TRACE_MAX_BYTES", 10 * 1024 * 1024)
+TRACE_BACKUP_COUNT = _env_int("TRACE_BACKUP_COUNT", 3)
+
+# Telegram user IDs allowed to use admin commands such as /profile and /stats
+ADMIN_USER_IDS = _env_int_set("ADMIN_USER_IDS")
+# Seconds between "Stats:" log lines holding the internal counters as JSON
+# (0 disables them)
+STATS_LOG_INTERVAL = _env_float("STATS_LOG_INTERVAL", 300.0)
+# Sampling profiler toggled with /profile: sampling interval (seconds) and
+# where collapsed-stack files are written
+PROFILE_INTERVAL = _env_float("PROFILE_INTERVAL", 0.01)
+PROFILE_DIR = _env_str("PROFILE_DIR", "data/profiles")
+
+# Inline mode: items kept in the search index, results per page, and how long
+# Telegram may cache an answer (seconds)
+SEARCH_INDEX_MAX_ITEMS = _env_int("SEARCH_INDEX_MAX_ITEMS", 50000)
+INLINE_RESULTS_PER_PAGE = _env_int("INLINE_RESULTS_PER_PAGE", 20)
+INLINE_CACHE_TIME = _env_int("INLINE_CACHE_TIME", 60)
+
+# Live fetches: consecutive empty or failed batches before giving up
+FETCH_MAX_ATTEMPTS = _env_int("FETCH_MAX_ATTEMPTS", 5)
+# Jittered exponential backoff between attempts
+FETCH_BACKOFF_BASE = _env_float("FETCH_BACKOFF_BASE", 0.25)
+FETCH_BACKOFF_MAX = _env_float("FETCH_BACKOFF_MAX", 4.0)
+# Total time a user request may spend waiting on upstream fetches
+FETCH_DEADLINE = _env_float("FETCH_DEADLINE", 8.0)
+
+# Upstream endpoints, overridable to point at local stand-ins (see benchmarks/)
+JOKE_API_URL = _env_str("JOKE_API_URL", "https://v2.jokeapi.dev/joke/Any")
+MEME_API_URL = _env_str("MEME_API_URL", "https://meme-api.com/gimme")
+
+# Upstream request budgets (requests per second and burst size)
+JOKE_API_RATE = _env_float("JOKE_API_RATE", 1.5)
+JOKE_API_BURST = _env_int("JOKE_API_BURST", 5)
+MEME_API_RATE = _env_float("MEME_API_RATE", 2.0)
+MEME_API_BURST = _env_int("MEME_API_BURST", 5)
+
+# Upstream circuit breakers
+CIRCUIT_FAILURE_THRESHOLD = _env_int("CIRCUIT_FAILURE_THRESHOLD", 5)
+CIRCUIT_RESET_TIMEOUT = _env_float("CIRCUIT_RESET_TIMEOUT", 30.0)
+
+# Serving mode: "polling" (default) or "webhook"
+BOT_MODE = _env_str("BOT_MODE", "polling").strip().lower()
+WEBHOOK_LISTEN = _env_str("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = _env_int("WEBHOOK_PORT", 8443)
+WEBHOOK_PATH = _env_str("WEBHOOK_PATH", "telegram")
+# Public base URL Telegram should call, e.g. https://bot.example.com
+WEBHOOK_URL = _env_str("WEBHOOK_URL", "")
+# 1-256 characters of A-Z, a-z, 0-9, _ and -; random per start if unset
+WEBHOOK_SECRET_TOKEN = _env_str("WEBHOOK_SECRET_TOKEN", "")
+# Alternative Bot API server, e.g. http://localhost:8081 (empty uses Telegram's)
+BOT_API_BASE_URL = _env_str("BOT_API_BASE_URL", "")
+
+# Concurrent update processing
+UPDATE_WORKERS = _env_int("UPDATE_WORKERS", 16)
+# Updates admitted at once (running or waiting for a worker or their chat)
+UPDATE_MAX_IN_FLIGHT = _env_int("UPDATE_MAX_IN_FLIGHT", 1000)
+# Updates one chat may have queued before further ones are dropped
+UPDATE_MAX_PENDING_PER_CHAT = _env_int("UPDATE_MAX_PENDING_PER_CHAT", 5)
+
+# Overload control: load thresholds (event loop lag in seconds, updates
+# running or waiting for a worker; 0 ignores a signal) at which content is
+# served from memory only, 1.5x of which memes are swapped for jokes and 2x
+# of which requests get a "busy" reply; how often load is checked, and how
+# long it must stay lower before the bot steps back up one level
+OVERLOAD_CONTROL = _env_bool("OVERLOAD_CONTROL", True)
+OVERLOAD_LAG_THRESHOLD = _env_float("OVERLOAD_LAG_THRESHOLD", 0.1)
+OVERLOAD_IN_FLIGHT_THRESHOLD = _env_int("OVERLOAD_IN_FLIGHT_THRESHOLD", 2 * UPDATE_WORKERS)
+OVERLOAD_CHECK_INTERVAL = _env_float("OVERLOAD_CHECK_INTERVAL", 0.5)
+OVERLOAD_RECOVERY_TIME = _env_float("OVERLOAD_RECOVERY_TIME", 10.0)
+
+# Outbound Bot API pacing (messages per second)
+SEND_GLOBAL_RATE = _env_float("SEND_GLOBAL_RATE", 30.0)
+SEND_PRIVATE_CHAT_RATE = _env_float("SEND_PRIVATE_CHAT_RATE", 1.0)
+SEND_GROUP_CHAT_RATE = _env_float("SEND_GROUP_CHAT_RATE", 20 / 60)
+SEND_CHAT_BURST = _env_int("SEND_CHAT_BURST", 4)
+# Retries after a RetryAfter flood-control error
+SEND_MAX_RETRIES = _env_int("SEND_MAX_RETRIES", 2)
+
+# Multi-process mode: worker processes (1 runs everything in one process),
+# items each worker keeps in its local pools, updates buffered for a worker
+# that is restarting, delay before a crashed worker is restarted (doubling
+# while it keeps crashing) and how long workers get to stop
+WORKERS = _env_int("WORKERS", 1)
+WORKER_POOL_SIZE = _env_int("WORKER_POOL_SIZE", 4)
+WORKER_BUFFER_SIZE = _env_int("WORKER_BUFFER_SIZE", 1000)
+WORKER_RESTART_DELAY = _env_float("WORKER_RESTART_DELAY", 1.0)
+WORKER_STOP_TIMEOUT = _env_float("WORKER_STOP_TIMEOUT", 10.0)
+
+# Most items /joke N and /meme N deliver at once (memes also at most 10,
+# Telegram's album limit)
+BATCH_MAX_ITEMS = _env_int("BATCH_MAX_ITEMS", 5)
+
+# How progress is shown while content is fetched:
+# "chat_action" (typing/upload_photo, one result call) or "loading_message"
+DELIVERY_MODE = _env_str("DELIVERY_MODE", "chat_action").strip().lower()
@@ -0,0 +1,268 @@
+"""
+In-memory pools of pre-filtered content.
+
+Each ContentPool holds jokes or memes that already passed the content
+filters, so handlers can answer straight from memory. A PoolRefiller task
+keeps every pool between its low and high watermarks in the background and
+evicts items that have been sitting in the pool for too long.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Returns a (possibly empty) list of items that already passed filtering
+PoolFetcher = Callable[[], Awaitable[List[Dict[str, Any]]]]
+KeyFunc = Callable[[Dict[str, Any]], str]
+
+
+class ContentPool:
+    """Bounded FIFO of filtered content items with age-based eviction."""
+
+    def __init__(
+        self,
+        name: str,
+        fetcher: PoolFetcher,
+        key_func: KeyFunc,
+        low_watermark: int,
+        high_watermark: int,
+        max_age: float,
+        is_upstream_available: Optional[Callable[[], bool]] = None,
+    ):
+        if not 0 <= low_watermark < high_watermark:
+            raise ValueError("low_watermark must be >= 0 and below high_watermark")
+
+        self.name = name
+        self.fetcher = fetcher
+        self.key_func = key_func
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.max_age = max_age
+        self.is_upstream_available = is_upstream_available
+
+        self._items: Deque[Tuple[float, Dict[str, Any]]] = deque()
+        self._keys: Set[str] = set()
+        # Set whenever the pool drops to its low watermark
+        self.low_event = asyncio.Event()
+        self.low_event.set()
+
+        self.served = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def needs_refill(self) -> bool:
+        return len(self._items) <= self.low_watermark
+
+    def put(self, item: Dict[str, Any]) -> bool:
+        """
+        Add an item to the pool.
+
+        Args:
+            item: A content item that already passed filtering
+
+        Returns:
+            True if the item was added, False if it was a duplicate or the pool is full
+        """
+        if len(self._items) >= self.high_watermark:
+            return False
+
+        key = self.key_func(item)
+        if key in self._keys:
+            return False
+
+        self._items.append((time.monotonic(), item))
+        self._keys.add(key)
+        if not self.needs_refill:
+            self.low_event.clear()
+        return True
+
+    def pop(self, prefer: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Take the oldest fresh item from the pool.
+
+        Args:
+            prefer: Optional predicate; the oldest item it accepts is taken
+                instead, falling back to the oldest item if it accepts none
+
+        Returns:
+            A content item, or None if the pool is empty
+        """
+        self.evict_stale()
+
+        if not self._items:
+            self.misses += 1
+            self.low_event.set()
+            return None
+
+        index = 0
+        if prefer is not None:
+            index = next((i for i, (_, item) in enumerate(self._items) if prefer(item)), 0)
+        _, item = self._items[index]
+        del self._items[index]
+        self._keys.discard(self.key_func(item))
+        self.served += 1
+        if self.needs_refill:
+            self.low_event.set()
+        return item
+
+    def evict_stale(self) -> int:
+        """
+        Drop items older than max_age.
+
+        Stale items are kept while the upstream is unavailable, since they
+        are then the only content we can serve.
+
+        Returns:
+            Number of evicted items
+        """
+        if self.is_upstream_available is not None and not self.is_upstream_available():
+            return 0
+
+        cutoff = time.monotonic() - self.max_age
+        evicted = 0
+        while self._items and self._items[0][0] < cutoff:
+            _, item = self._items.popleft()
+            self._keys.discard(self.key_func(item))
+            evicted += 1
+
+        if evicted:
+            self.evicted += evicted
+            logger.info(f"Evicted {evicted} stale item(s) from {self.name} pool")
+            if self.needs_refill:
+                self.low_event.set()
+        return evicted
+
+    async def refill(self) -> int:
+        """
+        Fetch content until the pool reaches its high watermark.
+
+        Returns:
+            Number of items added
+        """
+        added = 0
+        while len(self._items) < self.high_watermark:
+            items = await self.fetcher()
+            if not items:
+                break
+
+            new = sum(1 for item in items if self.put(item))
+            if new == 0:
+                # Upstream keeps returning items we already hold
+                break
+            added += new
+
+        if added:
+            logger.info(f"Refilled {self.name} pool with {added} item(s), size now {len(self._items)}")
+        return added
+
+    def snapshot(self) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Return the pooled items for a warm-start snapshot.
+
+        Returns:
+            (age in seconds, item) pairs, oldest first
+        """
+        now = time.monotonic()
+        return [(round(now - added_at, 1), item) for added_at, item in self._items]
+
+    def restore(self, entries: List[Any], extra_age: float = 0.0) -> int:
+        """
+        Put items from a snapshot back into the pool, keeping their age.
+
+        Args:
+            entries: (age in seconds, item) pairs as returned by snapshot()
+            extra_age: Time that passed since the snapshot was taken
+
+        Returns:
+            Number of items restored
+        """
+        now = time.monotonic()
+        restored = 0
+        for entry in entries:
+            try:
+                age, item = entry
+                age = float(age) + extra_age
+                key = self.key_func(item)
+            except (TypeError, ValueError, AttributeError):
+                continue
+            if age > self.max_age or key in self._keys or len(self._items) >= self.high_watermark:
+                continue
+            self._items.append((now - age, item))
+            self._keys.add(key)
+            restored += 1
+
+        if not self.needs_refill:
+            self.low_event.clear()
+        return restored
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters describing the pool."""
+        return {
+            "size": len(self._items),
+            "low_watermark": self.low_watermark,
+            "high_watermark": self.high_watermark,
+            "served": self.served,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
+
+
+class PoolRefiller:
+    """Background task that keeps a set of ContentPools topped up."""
+
+    def __init__(self, pools: List[ContentPool], interval: float):
+        self.pools = pools
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the refill loop on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="content-pool-refiller")
+
+    async def stop(self):
+        """Cancel the refill loop and wait for it to finish."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            for pool in self.pools:
+                pool.evict_stale()
+                if pool.needs_refill:
+                    try:
+                        await pool.refill()
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error refilling {pool.name} pool: {e}")
+
+            # Sleep until the interval elapses or a healthy pool runs low.
+            # Pools still below their low watermark (upstream failing) are
+            # retried on the next interval instead of in a tight loop.
+            waiters = [
+                asyncio.create_task(pool.low_event.wait())
+                for pool in self.pools
+                if not pool.needs_refill
+            ]
+            if not waiters:
+                await asyncio.sleep(self.interval)
+                continue
+            try:
+                await asyncio.wait(waiters, timeout=self.interval, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
@@ -0,0 +1,321 @@
+"""
+Persistent local store of filtered content and per-chat "already seen" sets.
+
+Every joke and meme that passes the filters is kept in SQLite, indexed by
+content ID and category, so the bot can keep answering from local content
+when both upstream APIs are down. Each chat has a small Bloom filter over the
+IDs it has been sent, which lets the bot skip repeats without scanning any
+history. Seen filters are updated in memory and written out in one
+transaction shortly after they change (and on close), so sending an item
+does not wait for the disk; a crash loses at most the last few seconds of
+seen marks, which only means a possible repeat.
+
+SQLite calls run on a dedicated worker thread so they never block the event
+loop.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS content (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    content_id TEXT NOT NULL,
+    category TEXT,
+    payload TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS content_kind_id ON content (kind, content_id);
+CREATE INDEX IF NOT EXISTS content_kind_category ON content (kind, category);
+CREATE TABLE IF NOT EXISTS seen (
+    chat_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    bits BLOB NOT NULL,
+    items INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, kind)
+);
+"""
+
+
+class SeenFilter:
+    """Fixed-size Bloom filter over content IDs."""
+
+    __slots__ = ("bits", "num_bits", "num_hashes", "items")
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: Optional[bytes] = None, items: int = 0):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray((num_bits + 7) // 8)
+        self.items = items
+
+    def _positions(self, content_id: str) -> Iterable[int]:
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(content_id.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, content_id: str):
+        for position in self._positions(content_id):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.items += 1
+
+    def __contains__(self, content_id: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(content_id))
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.items = 0
+
+
+class ContentStore:
+    """SQLite-backed content archive with per-chat seen tracking."""
+
+    def __init__(
+        self,
+        path: str,
+        seen_bits: int = 8192,
+        seen_hashes: int = 4,
+        seen_capacity: int = 800,
+        seen_cache_size: int = 10000,
+        seen_flush_interval: float = 5.0,
+    ):
+        self.path = path
+        self.seen_bits = seen_bits
+        self.seen_hashes = seen_hashes
+        # Past this many items the false-positive rate climbs, so start over
+        self.seen_capacity = seen_capacity
+        self.seen_cache_size = seen_cache_size
+        self.seen_flush_interval = seen_flush_interval
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="content-store")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._seen: "OrderedDict[Tuple[int, str], SeenFilter]" = OrderedDict()
+        # Filters changed since the last flush; they stay here even if the
+        # cache above evicts them
+        self._dirty: Dict[Tuple[int, str], SeenFilter] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.stored = 0
+        self.fallback_served = 0
+        self.seen_flushes = 0
+
+    async def _call(self, func: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    async def open(self):
+        """Open the database and create the schema if needed."""
+        count = await self._call(self._open_sync)
+        logger.info(f"Content store at {self.path} holds {count} items")
+
+    def _open_sync(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM content").fetchone()[0]
+
+    async def close(self):
+        """Write unsaved seen filters, close the database and stop the worker thread."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush_seen()
+        await self._call(self._close_sync)
+        self._executor.shutdown(wait=True)
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def add_many(self, kind: str, items: List[Tuple[str, Optional[str], Dict[str, Any]]]):
+        """
+        Store filtered content, ignoring items already stored.
+
+        Args:
+            kind: "joke" or "meme"
+            items: (content_id, category, payload) tuples
+        """
+        if items:
+            self.stored += await self._call(self._add_many_sync, kind, items)
+
+    def _add_many_sync(self, kind: str, items: List[Tuple[str, Optional[str], Dict[str, Any]]]) -> int:
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO content (kind, content_id, category, payload, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(kind, content_id, category, json.dumps(payload), now) for content_id, category, payload in items],
+            )
+        return cursor.rowcount
+
+    async def random_unseen(self, kind: str, chat_id: Optional[int], sample_size: int = 50) -> Optional[Dict[str, Any]]:
+        """
+        Pick a stored item the chat has not been sent yet.
+
+        Args:
+            kind: "joke" or "meme"
+            chat_id: Chat to pick for, None to ignore seen tracking
+            sample_size: Number of random candidates to check against the seen set
+
+        Returns:
+            A stored item (an already seen one if every candidate was seen), or None if the store is empty
+        """
+        candidates = await self._call(self._sample_sync, kind, sample_size)
+        if not candidates:
+            return None
+
+        seen = await self.seen_filter(chat_id, kind) if chat_id is not None else None
+        for content_id, payload in candidates:
+            if seen is None or content_id not in seen:
+                self.fallback_served += 1
+                return json.loads(payload)
+
+        self.fallback_served += 1
+        return json.loads(candidates[0][1])
+
+    def _sample_sync(self, kind: str, sample_size: int) -> List[Tuple[str, str]]:
+        conn = self._connect()
+        row = conn.execute("SELECT MAX(id) FROM content").fetchone()
+        if not row or row[0] is None:
+            return []
+        # Start at a random row instead of ORDER BY random(), which scans the table
+        start = int.from_bytes(os.urandom(4), "little") % row[0]
+        rows = conn.execute(
+            "SELECT content_id, payload FROM content WHERE kind = ? AND id > ? ORDER BY id LIMIT ?",
+            (kind, start, sample_size),
+        ).fetchall()
+        if len(rows) < sample_size:
+            rows += conn.execute(
+                "SELECT content_id, payload FROM content WHERE kind = ? AND id <= ? ORDER BY id LIMIT ?",
+                (kind, start, sample_size - len(rows)),
+            ).fetchall()
+        return rows
+
+    async def recent(self, kind: str, limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Return the most recently stored items of a kind.
+
+        Args:
+            kind: "joke" or "meme"
+            limit: Maximum number of items
+
+        Returns:
+            (content_id, item) pairs, oldest first
+        """
+        rows = await self._call(self._recent_sync, kind, limit)
+        return [(content_id, json.loads(payload)) for content_id, payload in reversed(rows)]
+
+    def _recent_sync(self, kind: str, limit: int) -> List[Tuple[str, str]]:
+        return self._connect().execute(
+            "SELECT content_id, payload FROM content WHERE kind = ? ORDER BY id DESC LIMIT ?",
+            (kind, limit),
+        ).fetchall()
+
+    async def seen_filter(self, chat_id: int, kind: str) -> SeenFilter:
+        """Return the chat's seen filter, loading it from disk if needed."""
+        key = (chat_id, kind)
+        # A filter evicted from the cache may still have unsaved marks
+        seen = self._seen.get(key) or self._dirty.get(key)
+        if seen is None:
+            row = await self._call(self._load_seen_sync, chat_id, kind)
+            seen = self._seen.get(key) or self._dirty.get(key)
+            if seen is None:
+                if row is not None and len(row[0]) * 8 >= self.seen_bits:
+                    seen = SeenFilter(self.seen_bits, self.seen_hashes, bits=row[0], items=row[1])
+                else:
+                    seen = SeenFilter(self.seen_bits, self.seen_hashes)
+        self._seen[key] = seen
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.seen_cache_size:
+            self._seen.popitem(last=False)
+        return seen
+
+    def _load_seen_sync(self, chat_id: int, kind: str) -> Optional[Tuple[bytes, int]]:
+        return self._connect().execute(
+            "SELECT bits, items FROM seen WHERE chat_id = ? AND kind = ?", (chat_id, kind)
+        ).fetchone()
+
+    async def has_seen(self, chat_id: int, kind: str, content_id: str) -> bool:
+        """Return True if the chat was (probably) already sent this item."""
+        return content_id in await self.seen_filter(chat_id, kind)
+
+    def has_seen_cached(self, chat_id: int, kind: str, content_id: str) -> bool:
+        """Like has_seen, but only consults filters already in memory."""
+        seen = self._seen.get((chat_id, kind))
+        return seen is not None and content_id in seen
+
+    async def mark_seen(self, chat_id: int, kind: str, content_id: str):
+        """Record that the chat was sent an item; the filter is persisted by the next flush."""
+        seen = await self.seen_filter(chat_id, kind)
+        if seen.items >= self.seen_capacity:
+            seen.clear()
+        seen.add(content_id)
+        self._dirty[(chat_id, kind)] = seen
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later(), name="seen-flush")
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.seen_flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush_seen()
+        except Exception as e:
+            logger.error(f"Error saving seen filters: {e}")
+
+    async def flush_seen(self):
+        """Write all changed seen filters in one transaction."""
+        if not self._dirty:
+            return
+        # Copied on the event loop, so later marks cannot tear a row
+        rows = [(chat_id, kind, bytes(seen.bits), seen.items) for (chat_id, kind), seen in self._dirty.items()]
+        self._dirty.clear()
+        try:
+            await self._call(self._save_seen_sync, rows)
+        except Exception:
+            # Keep the rows for the next flush unless newer marks replaced them
+            for chat_id, kind, bits, items in rows:
+                key = (chat_id, kind)
+                if key not in self._dirty:
+                    self._dirty[key] = SeenFilter(self.seen_bits, self.seen_hashes, bits=bits, items=items)
+            raise
+        self.seen_flushes += 1
+
+    def _save_seen_sync(self, rows: List[Tuple[int, str, bytes, int]]):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO seen (chat_id, kind, bits, items) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (chat_id, kind) DO UPDATE SET bits = excluded.bits, items = excluded.items",
+                rows,
+            )
+
+    def stats(self) -> Dict[str, int]:
+        """Return store counters."""
+        return {
+            "stored": self.stored,
+            "fallback_served": self.fallback_served,
+            "seen_filters_cached": len(self._seen),
+            "seen_filters_unsaved": len(self._dirty),
+            "seen_flushes": self.seen_flushes,
+        }
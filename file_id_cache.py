@@ -0,0 +1,163 @@
+"""
+Cache of Telegram file_ids for meme images.
+
+Once Telegram has downloaded a meme image, the file_id from that upload can
+be reused for every later send, which skips the re-download from Reddit.
+Entries are evicted least-recently-used first and persisted to a JSON file so
+the cache survives restarts. Changes are written out every save_interval
+seconds in a worker thread, so a crash loses at most one interval's worth.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """Size-bounded LRU mapping from meme key to Telegram file_id."""
+
+    def __init__(self, path: Optional[str], max_entries: int, save_interval: float = 30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._dirty = False
+        # One thread, so saves reach the disk in the order they were taken
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-id-cache")
+        self._save_task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+
+        if self.path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up the file_id for a meme and mark it as recently used.
+
+        Args:
+            key: Meme key (post link or image URL)
+
+        Returns:
+            The cached file_id, or None if not cached
+        """
+        file_id = self._entries.get(key)
+        if file_id is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return file_id
+
+    def put(self, key: str, file_id: str):
+        """Store a file_id, evicting the least recently used entries if full."""
+        if self._entries.get(key) == file_id:
+            self._entries.move_to_end(key)
+            return
+
+        self._entries[key] = file_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def discard(self, key: str):
+        """Forget a file_id, e.g. after Telegram rejected it."""
+        if self._entries.pop(key, None) is not None:
+            self._dirty = True
+
+    def load(self):
+        """Load entries from disk, ignoring a missing or unreadable file."""
+        if not self.path or not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load file_id cache from {self.path}: {e}")
+            return
+
+        if not isinstance(data, dict):
+            logger.error(f"Ignoring malformed file_id cache at {self.path}")
+            return
+
+        # Oldest entries first, so the most recent ones survive trimming
+        for key, file_id in data.items():
+            if isinstance(key, str) and isinstance(file_id, str):
+                self._entries[key] = file_id
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        logger.info(f"Loaded {len(self._entries)} cached file_ids from {self.path}")
+
+    def _write(self, entries: Dict[str, str]) -> bool:
+        """Write entries to disk atomically; runs in the worker thread."""
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".file_id_cache.")
+        except OSError as e:
+            logger.error(f"Could not save file_id cache to {self.path}: {e}")
+            return False
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Could not save file_id cache to {self.path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    async def save_if_dirty(self):
+        """Write entries to disk, without blocking the event loop, if they changed since the last save."""
+        if not self._dirty or not self.path:
+            return
+        # Copied on the event loop, so later puts cannot change it mid-write
+        entries = dict(self._entries)
+        self._dirty = False
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(self._executor, self._write, entries):
+            self.saves += 1
+        else:
+            self._dirty = True
+
+    def start(self):
+        """Start saving changes every save_interval seconds."""
+        if self.path and self._save_task is None:
+            self._save_task = asyncio.create_task(self._save_periodically(), name="file-id-cache-save")
+
+    async def _save_periodically(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            await self.save_if_dirty()
+
+    async def close(self):
+        """Stop the periodic saves and write any unsaved changes."""
+        if self._save_task is not None:
+            self._save_task.cancel()
+            self._save_task = None
+        await self.save_if_dirty()
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters, the current size and completed saves."""
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "saves": self.saves}
@@ -0,0 +1,387 @@
+"""
+Meme image pipeline: download, validate, downscale and cache on disk.
+
+Sending a meme by URL makes Telegram fetch the image itself, which fails for
+oversized images, GIFs and dead links, and the user only sees a generic
+error. Instead, every meme image is downloaded up front, checked, downscaled
+or recompressed if it breaks Telegram's photo limits, and stored in a
+content-addressed disk cache. Memes are then uploaded from that cache, and
+memes whose image cannot be made valid are dropped before anyone sees them.
+
+Image processing runs in a worker thread pool (Pillow releases the GIL while
+decoding and resizing). Pillow is a pinned requirement; should it be missing
+anyway, images are only checked by content type and size, and memes that
+would need downscaling or conversion are dropped.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from upstream import DownloadTooLarge, UpstreamClient
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Telegram's limits for uploaded photos
+TELEGRAM_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+TELEGRAM_PHOTO_MAX_DIMENSIONS = 10000  # width + height
+TELEGRAM_PHOTO_MAX_RATIO = 20
+
+# Formats Telegram accepts as photos as they are; others are re-encoded
+PHOTO_FORMATS = {"JPEG": ".jpg", "PNG": ".png"}
+CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp"}
+# JPEG qualities tried, in order, when recompressing
+JPEG_QUALITIES = (85, 75, 60)
+
+
+class ImageRejected(Exception):
+    """Raised when an image cannot be turned into a valid Telegram photo."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _encode_jpeg(image: Any, max_bytes: int) -> bytes:
+    for quality in JPEG_QUALITIES:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes:
+            return buffer.getvalue()
+    raise ImageRejected("too large after recompression")
+
+
+def process_image(data: bytes, content_type: str, max_bytes: int, max_side: int) -> Tuple[bytes, str, bool]:
+    """
+    Make an image fit Telegram's photo limits.
+
+    Args:
+        data: Downloaded image bytes
+        content_type: Content type the server declared
+        max_bytes: Images larger than this are recompressed
+        max_side: Images with a longer side are downscaled
+
+    Returns:
+        (image bytes, file extension, whether the image was re-encoded)
+
+    Raises:
+        ImageRejected: If the image is not usable
+    """
+    if Image is None:
+        if content_type not in ("image/jpeg", "image/png"):
+            raise ImageRejected("needs conversion")
+        if len(data) > min(max_bytes, TELEGRAM_PHOTO_MAX_BYTES):
+            raise ImageRejected("too large")
+        return data, ".jpg" if content_type == "image/jpeg" else ".png", False
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            if min(width, height) < 1 or max(width, height) / min(width, height) > TELEGRAM_PHOTO_MAX_RATIO:
+                raise ImageRejected("aspect ratio")
+
+            fits = (
+                image.format in PHOTO_FORMATS
+                and len(data) <= max_bytes
+                and max(width, height) <= max_side
+                and width + height <= TELEGRAM_PHOTO_MAX_DIMENSIONS
+            )
+            if fits:
+                # Decode fully so truncated files are caught here, not by Telegram
+                image.load()
+                return data, PHOTO_FORMATS[image.format], False
+
+            # Shrink first, so the conversions below work on the small image
+            image.draft("RGB", (max_side, max_side))
+            image = image.convert("RGBA") if image.mode in ("LA", "P") else image
+            image.thumbnail((max_side, max_side), reducing_gap=2.0)
+            if image.mode == "RGBA":
+                # Flatten transparency onto white rather than JPEG's black
+                converted = Image.new("RGB", image.size, (255, 255, 255))
+                converted.paste(image, mask=image.getchannel("A"))
+            else:
+                converted = image.convert("RGB")
+            return _encode_jpeg(converted, max_bytes), ".jpg", True
+    except ImageRejected:
+        raise
+    except Exception as e:
+        # Unidentified or truncated images, decompression bombs, ...
+        raise ImageRejected(f"undecodable ({type(e).__name__})")
+
+
+class ImageCache:
+    """Size-bounded, content-addressed directory of prepared images."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        # File name -> size, least recently used first
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.evicted = 0
+        self.load()
+
+    def load(self):
+        """Index the files already in the cache directory, oldest first."""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            entries = [
+                (entry.stat().st_mtime, entry.name, entry.stat().st_size)
+                for entry in os.scandir(self.directory)
+                if entry.is_file() and not entry.name.startswith(".")
+            ]
+        except OSError as e:
+            logger.error(f"Could not read image cache at {self.directory}: {e}")
+            return
+
+        with self._lock:
+            for _, name, size in sorted(entries):
+                self._files[name] = size
+                self.total_bytes += size
+            self._evict()
+        logger.info(f"Image cache at {self.directory} holds {len(self._files)} files ({self.total_bytes} bytes)")
+
+    def path(self, name: str) -> Optional[Path]:
+        """Return the path of a cached file, or None if it is not cached."""
+        path = self.directory / name
+        # Other processes sharing the directory add and evict files too
+        try:
+            size = path.stat().st_size
+        except OSError:
+            size = None
+        with self._lock:
+            if size is None:
+                if name in self._files:
+                    self.total_bytes -= self._files.pop(name)
+                return None
+            if name in self._files:
+                self._files.move_to_end(name)
+            else:
+                self._files[name] = size
+                self.total_bytes += size
+                self._evict()
+        return path
+
+    def put(self, data: bytes, extension: str) -> str:
+        """
+        Store image bytes under their SHA-256 digest.
+
+        Returns:
+            The cached file name
+        """
+        name = hashlib.sha256(data).hexdigest() + extension
+        with self._lock:
+            if name in self._files:
+                self._files.move_to_end(name)
+                return name
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".image.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.directory / name)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            if name not in self._files:
+                self._files[name] = len(data)
+                self.total_bytes += len(data)
+            self._evict()
+        return name
+
+    def _evict(self):
+        # Keep the newest file even if it alone is over the limit
+        while self.total_bytes > self.max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self.total_bytes -= size
+            self.evicted += 1
+            try:
+                os.remove(self.directory / name)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        """Return file count, size and evictions."""
+        return {"files": len(self._files), "bytes": self.total_bytes, "evicted": self.evicted}
+
+
+class ImagePipeline:
+    """Downloads, validates and caches meme images before they are served."""
+
+    def __init__(
+        self,
+        upstream: UpstreamClient,
+        cache: ImageCache,
+        max_download_bytes: int,
+        max_bytes: int,
+        max_side: int,
+        workers: int = 2,
+        concurrency: int = 5,
+        memo_size: int = 10000,
+    ):
+        self.upstream = upstream
+        self.cache = cache
+        self.max_download_bytes = max_download_bytes
+        self.max_bytes = min(max_bytes, TELEGRAM_PHOTO_MAX_BYTES)
+        self.max_side = max_side
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+        # Image URL or source digest -> (cached file name, whether it was
+        # re-encoded), so reposts are neither downloaded nor processed again
+        self._prepared: "OrderedDict[str, Tuple[str, bool]]" = OrderedDict()
+        self.memo_size = memo_size
+
+        self.prepared = 0
+        self.reused = 0
+        self.reencoded = 0
+        self.rejected: Counter = Counter()
+
+        if Image is None:
+            logger.warning("Pillow is not installed; oversized meme images will be rejected, not downscaled")
+
+    async def prepare(self, url: str) -> Tuple[str, bool]:
+        """
+        Download and validate an image, downscaling it if needed.
+
+        Args:
+            url: Image URL
+
+        Returns:
+            Name of the prepared file in the image cache, and whether it had
+            to be re-encoded (if not, Telegram can also fetch it by URL)
+
+        Raises:
+            ImageRejected: If the image is unreachable or not usable
+        """
+        prepared = self._reuse(url)
+        if prepared is not None:
+            return prepared
+
+        try:
+            headers, data = await self.upstream.download(url, self.max_download_bytes)
+        except DownloadTooLarge:
+            raise ImageRejected("download too large")
+        except httpx.HTTPStatusError as e:
+            raise ImageRejected(f"HTTP {e.response.status_code}")
+        except Exception as e:
+            # Transport errors, but also e.g. httpx.InvalidURL, which is not
+            # an HTTPError: one bad meme must not fail the whole batch
+            raise ImageRejected(f"download failed ({type(e).__name__})")
+
+        content_type = headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type not in CONTENT_TYPES:
+            raise ImageRejected(f"content type {content_type or 'missing'}")
+
+        source = hashlib.sha256(data).hexdigest()
+        prepared = self._reuse(source)
+        if prepared is None:
+            loop = asyncio.get_running_loop()
+            prepared = await loop.run_in_executor(
+                self._executor, self._process_and_store, data, content_type
+            )
+            self.prepared += 1
+            self.reencoded += prepared[1]
+            self._remember(source, prepared)
+        self._remember(url, prepared)
+        return prepared
+
+    def _reuse(self, key: str) -> Optional[Tuple[str, bool]]:
+        prepared = self._prepared.get(key)
+        if prepared is None or self.cache.path(prepared[0]) is None:
+            return None
+        self._prepared.move_to_end(key)
+        self.reused += 1
+        return prepared
+
+    def _remember(self, key: str, prepared: Tuple[str, bool]):
+        self._prepared[key] = prepared
+        while len(self._prepared) > self.memo_size:
+            self._prepared.popitem(last=False)
+
+    def _process_and_store(self, data: bytes, content_type: str) -> Tuple[str, bool]:
+        image, extension, reencoded = process_image(data, content_type, self.max_bytes, self.max_side)
+        try:
+            return self.cache.put(image, extension), reencoded
+        except OSError as e:
+            raise ImageRejected(f"cache write failed ({e})")
+
+    async def filter_memes(
+        self,
+        memes: List[Dict[str, Any]],
+        skip: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        on_ready: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Prepare the images of a batch of memes, dropping memes whose image is unusable.
+
+        Prepared memes get the cached file name under "image_file", and
+        "image_unchanged" if the original image at their URL is usable as is.
+
+        Args:
+            memes: Memes that already passed the content filters
+            skip: Returns True for memes that need no preparation, e.g. ones
+                Telegram already has a file_id for
+            on_ready: Called with each usable meme as soon as it is prepared,
+                so callers need not wait for the slowest download
+
+        Returns:
+            The memes that can be sent, in their original order
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(meme_data: Dict[str, Any]) -> bool:
+            if skip is None or not skip(meme_data):
+                async with semaphore:
+                    try:
+                        name, reencoded = await self.prepare(meme_data.get("url") or "")
+                    except ImageRejected as e:
+                        self.rejected[e.reason.split(" (")[0]] += 1
+                        logger.info(f"Dropping meme {meme_data.get('postLink')}: {e.reason}")
+                        return False
+                meme_data["image_file"] = name
+                meme_data["image_unchanged"] = not reencoded
+            if on_ready is not None:
+                on_ready(meme_data)
+            return True
+
+        results = await asyncio.gather(*(check(meme) for meme in memes))
+        return [meme for meme, ok in zip(memes, results) if ok]
+
+    def local_file(self, meme_data: Dict[str, Any]) -> Optional[Path]:
+        """Return the cached image for a prepared meme, if it is still cached."""
+        name = meme_data.get("image_file")
+        return self.cache.path(name) if name else None
+
+    def close(self):
+        """Stop the worker threads."""
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pipeline counters and cache usage."""
+        return {
+            "prepared": self.prepared,
+            "reused": self.reused,
+            "reencoded": self.reencoded,
+            "rejected": dict(self.rejected),
+            "cache": self.cache.stats(),
+        }
@@ -0,0 +1,55 @@
+"""
+Lightweight latency tracking.
+
+LatencyStats keeps a sliding window of recent samples and reports
+percentiles over it, which is enough to compare serving modes or spot
+regressions without an external metrics system.
+"""
+from collections import deque
+from typing import Deque, Dict
+
+
+class LatencyStats:
+    """Sliding-window latency samples with percentile summaries."""
+
+    def __init__(self, name: str, window: int = 1000):
+        self.name = name
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """Record one latency sample, in seconds."""
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """
+        Return the q-th percentile of the recent samples.
+
+        Args:
+            q: Percentile between 0 and 100
+
+        Returns:
+            Latency in seconds, 0.0 when there are no samples
+        """
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self) -> Dict[str, float]:
+        """Return count, mean, p50/p95/p99 and max, in milliseconds."""
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p95_ms": round(self.percentile(95) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
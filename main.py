@@ -1,18 +1,78 @@
+import hashlib
+import json
 import logging
 import os
-import requests
-from typing import Optional, Dict, Any
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import secrets
+import time
+from functools import partial
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, Union
+from telegram import (
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InlineQueryResultGif,
+    InlineQueryResultPhoto,
+    InputMediaPhoto,
+    InputTextMessageContent,
+    Message,
+    Update,
+)
+from telegram.constants import ChatAction, MediaGroupLimit, MessageLimit
+from telegram.error import BadRequest, RetryAfter, TelegramError
 import asyncio
 from telegram.ext import (
     Application, 
     CommandHandler, 
     CallbackQueryHandler, 
     ContextTypes,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters
 )
 
+import config
+from circuit import CircuitOpenError
+from coalesce import Coalescer
+from content_pool import ContentPool, PoolRefiller
+from content_store import ContentStore
+from file_id_cache import FileIdCache
+from image_pipeline import ImageCache, ImagePipeline
+from latency import LatencyStats
+from metrics import (
+    BATCH_ITEMS,
+    CIRCUIT_OPEN,
+    EVENT_LOOP_LAG,
+    FILTER_CHECKED,
+    FILTER_REJECTIONS,
+    HANDLER_SECONDS,
+    OVERLOAD_LEVEL,
+    POOL_SIZE,
+    REGISTRY,
+    SEND_QUEUE_LENGTH,
+    UPDATE_API_CALLS,
+    UPDATES_IN_FLIGHT,
+    MetricsServer,
+)
+from overload import OverloadController
+from profiler import SamplingProfiler
+from search_index import SearchIndex
+from send_scheduler import (
+    PRIORITY_COSMETIC,
+    ApiCallStats,
+    SendScheduler,
+    send_priority,
+    start_call_count,
+)
+from snapshot import load_snapshot, save_snapshot
+from text_filter import TextFilter
+from tracing import Span, Tracer, span
+from update_processor import ChatOrderedUpdateProcessor
+from upstream import BatchStats, UpstreamClient
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -20,15 +80,283 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # API URLs
-JOKE_API_URL = "https://v2.jokeapi.dev/joke/Any"
-MEME_API_URL = "https://meme-api.com/gimme"
+JOKE_API_URL = config.JOKE_API_URL
+MEME_API_URL = config.MEME_API_URL.rstrip("/")
+UPSTREAM_URLS = {"joke": JOKE_API_URL, "meme": MEME_API_URL}
+
+# Update types each handler class consumes, used to narrow allowed_updates
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: [Update.MESSAGE],
+    MessageHandler: [Update.MESSAGE],
+    CallbackQueryHandler: [Update.CALLBACK_QUERY],
+    InlineQueryHandler: [Update.INLINE_QUERY],
+}
+
+# Update kinds used as metric labels and API call stats keys; anything else is
+# counted as "other" so arbitrary user input cannot create new series
+METRIC_UPDATE_KINDS = {
+    "/start", "/help", "/joke", "/meme", "/joke N", "/meme N",
+    "callback:get_joke", "callback:get_meme", "callback:help",
+    "inline",
+}
+
+# Flags JokeAPI should filter out server-side (mirrors is_joke_clean)
+JOKE_BLACKLIST_FLAGS = "nsfw,religious,political,racist,sexist,explicit"
+
+# Answer to content requests while the bot is shedding load
+BUSY_TEXT = "⏳ I'm a bit busy right now, please try again in a few seconds!"
+
+
+# Awaited before a live fetch to show the user something is happening
+ProgressCallback = Callable[[], Awaitable[Any]]
+# In a worker process: takes a batch of filtered items of a kind from the supervisor,
+# along with the seconds the supervisor's circuit for that kind stays open (0 if closed)
+ContentSupply = Callable[[str], Awaitable[Tuple[List[Dict[str, Any]], float]]]
+
+
+def update_kind(update: Update) -> str:
+    """Short label for an update, e.g. "/joke" or "callback:get_meme"."""
+    if update.callback_query:
+        return f"callback:{update.callback_query.data}"
+    if update.inline_query:
+        return "inline"
+    message = update.effective_message
+    if message and message.text and message.text.startswith("/"):
+        parts = message.text.split()
+        command = parts[0].split("@")[0]
+        if command in ("/joke", "/meme") and requested_count(parts[1:], 2) > 1:
+            return f"{command} N"
+        return command
+    return "other"
+
+
+def requested_count(args: Optional[List[str]], limit: int) -> int:
+    """
+    Number of items asked for with e.g. "/meme 3".
+    
+    Args:
+        args: Command arguments
+        limit: Most items to hand out at once
+        
+    Returns:
+        The requested number capped at limit, 1 without a valid number
+    """
+    if not args:
+        return 1
+    try:
+        count = int(args[0])
+    except ValueError:
+        return 1
+    return max(1, min(count, limit))
+
+
+def joke_key(joke_data: Dict[str, Any]) -> str:
+    """Stable identifier for a joke: its JokeAPI ID."""
+    return str(joke_data.get("id"))
+
+
+def joke_search_text(joke_data: Dict[str, Any]) -> str:
+    """Text a joke is searched and filtered by: its wording and category."""
+    parts = (joke_data.get("joke"), joke_data.get("setup"), joke_data.get("delivery"), joke_data.get("category"))
+    return " ".join(part for part in parts if part)
+
+
+def meme_search_text(meme_data: Dict[str, Any]) -> str:
+    """Text a meme is searched and filtered by: its title and subreddit."""
+    return f"{meme_data.get('title', '')} {meme_data.get('subreddit', '')}"
+
+
+def inline_result_id(kind: str, key: str) -> str:
+    """Short, stable inline result ID (Telegram allows at most 64 bytes)."""
+    return hashlib.blake2b(f"{kind}:{key}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def meme_key(meme_data: Dict[str, Any]) -> str:
+    """Stable identifier for a meme: its post link, or the image URL."""
+    return meme_data.get("postLink") or meme_data.get("url", "")
 
 class TelegramEntertainmentBot:
     
-    def __init__(self, token: str):
+    def __init__(self, token: str, supply: Optional[ContentSupply] = None):
 
         self.token = token
-        self.application = Application.builder().token(token).build()
+        # Set in worker processes, which take content from the supervisor
+        # instead of fetching it themselves
+        self.supply = supply
+        # Worker processes only: when the supervisor's circuit per kind closes again
+        self._supply_open_until: Dict[str, float] = {}
+        if supply is not None:
+            fetch_jokes = partial(self.supplied_batch, "joke")
+            fetch_memes = prefetch_memes = partial(self.supplied_batch, "meme")
+        else:
+            fetch_jokes, fetch_memes, prefetch_memes = self.fetch_joke_batch, self.fetch_live_memes, self.prefetch_memes
+        # Shared keep-alive pools for the joke and meme APIs
+        self.upstream = UpstreamClient()
+        # Shared per-upstream request budgets, adapted on 429 responses
+        self.upstream.set_rate_limit(JOKE_API_URL, config.JOKE_API_RATE, config.JOKE_API_BURST)
+        self.upstream.set_rate_limit(MEME_API_URL, config.MEME_API_RATE, config.MEME_API_BURST)
+        # Fail fast while an upstream is down
+        for url in (JOKE_API_URL, MEME_API_URL):
+            self.upstream.set_circuit_breaker(
+                url, config.CIRCUIT_FAILURE_THRESHOLD, config.CIRCUIT_RESET_TIMEOUT
+            )
+        self.joke_batch_stats = BatchStats("joke")
+        self.meme_batch_stats = BatchStats("meme")
+        
+        # Pre-filtered content served straight from memory
+        self.joke_pool = ContentPool(
+            "joke",
+            fetcher=fetch_jokes,
+            key_func=joke_key,
+            low_watermark=config.JOKE_POOL_LOW_WATERMARK,
+            high_watermark=config.JOKE_POOL_HIGH_WATERMARK,
+            max_age=config.POOL_MAX_AGE,
+            is_upstream_available=partial(self.is_upstream_available, "joke"),
+        )
+        self.meme_pool = ContentPool(
+            "meme",
+            fetcher=prefetch_memes,
+            key_func=meme_key,
+            low_watermark=config.MEME_POOL_LOW_WATERMARK,
+            high_watermark=config.MEME_POOL_HIGH_WATERMARK,
+            max_age=config.POOL_MAX_AGE,
+            is_upstream_available=partial(self.is_upstream_available, "meme"),
+        )
+        # Every filtered item, plus what each chat has already seen
+        self.content_store = None
+        if config.CONTENT_STORE_PATH:
+            self.content_store = ContentStore(
+                config.CONTENT_STORE_PATH,
+                seen_bits=config.SEEN_FILTER_BITS,
+                seen_hashes=config.SEEN_FILTER_HASHES,
+                seen_capacity=config.SEEN_FILTER_CAPACITY,
+                seen_flush_interval=config.SEEN_FLUSH_INTERVAL,
+            )
+        
+        # Blocked words and patterns, checked on top of the upstream flags
+        self.text_filter = TextFilter(
+            config.FILTER_RULES_PATH, check_interval=config.FILTER_RULES_CHECK_INTERVAL
+        )
+        
+        # Keyword index over filtered content, for inline queries
+        self.search_index = SearchIndex(max_items=config.SEARCH_INDEX_MAX_ITEMS)
+        self.inline_search = LatencyStats("inline_search")
+        
+        # Live fetches share in-flight upstream batches
+        self.joke_coalescer = Coalescer(
+            "joke",
+            fetch_batch=fetch_jokes,
+            on_surplus=self.joke_pool.put,
+            max_attempts=config.FETCH_MAX_ATTEMPTS,
+            backoff_base=config.FETCH_BACKOFF_BASE,
+            backoff_max=config.FETCH_BACKOFF_MAX,
+        )
+        self.meme_coalescer = Coalescer(
+            "meme",
+            fetch_batch=fetch_memes,
+            on_surplus=self.meme_pool.put,
+            max_attempts=config.FETCH_MAX_ATTEMPTS,
+            backoff_base=config.FETCH_BACKOFF_BASE,
+            backoff_max=config.FETCH_BACKOFF_MAX,
+        )
+        
+        # Telegram file_ids of meme images that were already uploaded once
+        self.file_id_cache = FileIdCache(
+            config.FILE_ID_CACHE_PATH, config.FILE_ID_CACHE_SIZE, save_interval=config.FILE_ID_SAVE_INTERVAL
+        )
+        
+        # Meme images are checked and uploaded from a local cache, not sent by URL
+        self.image_pipeline = None
+        if config.IMAGE_CACHE_DIR:
+            self.image_pipeline = ImagePipeline(
+                self.upstream,
+                ImageCache(config.IMAGE_CACHE_DIR, config.IMAGE_CACHE_MAX_BYTES),
+                max_download_bytes=config.IMAGE_MAX_DOWNLOAD_BYTES,
+                max_bytes=config.IMAGE_MAX_BYTES,
+                max_side=config.IMAGE_MAX_SIDE,
+                workers=config.IMAGE_WORKERS,
+                concurrency=config.IMAGE_DOWNLOAD_CONCURRENCY,
+            )
+        
+        self.pool_refiller = PoolRefiller(
+            [self.joke_pool, self.meme_pool], interval=config.POOL_REFILL_INTERVAL
+        )
+        
+        # Time from process start to the first answered update
+        self.started_at = time.monotonic()
+        self.first_response_logged = False
+        
+        # Time from Telegram receiving an update to our handler finishing with it
+        self.update_age = LatencyStats("update_age")
+        self.update_handling = LatencyStats("update_handling")
+        self._update_started: Dict[int, Tuple[float, List[int], Optional[Span]]] = {}
+        self.api_calls = ApiCallStats()
+        
+        # Sampled span trees per update, and the /profile sampling profiler
+        self.tracer = Tracer(
+            config.TRACE_PATH,
+            config.TRACE_SAMPLE_RATE,
+            max_bytes=config.TRACE_MAX_BYTES,
+            backup_count=config.TRACE_BACKUP_COUNT,
+        )
+        self.profiler = SamplingProfiler(interval=config.PROFILE_INTERVAL, focus=__file__)
+        # Periodic "Stats:" log line with get_stats()
+        self._stats_task: Optional[asyncio.Task] = None
+        # Set in the supervisor process: per-worker routing and restart counters
+        self.worker_stats: Optional[Callable[[], Dict[int, Dict[str, Any]]]] = None
+        
+        # Steps service down while the bot falls behind, and back up after
+        self.overload = OverloadController(
+            in_flight=lambda: self.update_processor.running + self.update_processor.waiting,
+            circuits_open=self.circuits_open,
+            lag_threshold=config.OVERLOAD_LAG_THRESHOLD,
+            in_flight_threshold=config.OVERLOAD_IN_FLIGHT_THRESHOLD,
+            interval=config.OVERLOAD_CHECK_INTERVAL,
+            recovery_time=config.OVERLOAD_RECOVERY_TIME,
+        )
+        
+        # Parallel across chats, in order within a chat
+        self.update_processor = ChatOrderedUpdateProcessor(
+            max_workers=config.UPDATE_WORKERS,
+            max_in_flight=config.UPDATE_MAX_IN_FLIGHT,
+            max_pending_per_chat=config.UPDATE_MAX_PENDING_PER_CHAT,
+            shed_queued=self.shed_repeated_press,
+        )
+        
+        # All Bot API calls are paced to Telegram's flood limits
+        self.send_scheduler = SendScheduler(
+            global_rate=config.SEND_GLOBAL_RATE,
+            private_chat_rate=config.SEND_PRIVATE_CHAT_RATE,
+            group_chat_rate=config.SEND_GROUP_CHAT_RATE,
+            chat_burst=config.SEND_CHAT_BURST,
+            max_retries=config.SEND_MAX_RETRIES,
+        )
+        
+        # Prometheus endpoint; gauges are only read when it is scraped
+        self.metrics_server = None
+        if config.METRICS_PORT:
+            self.metrics_server = MetricsServer(REGISTRY, config.METRICS_LISTEN, config.METRICS_PORT)
+        self.register_gauges()
+        
+        builder = Application.builder().token(token)
+        if config.BOT_API_BASE_URL:
+            # e.g. a local Bot API server or a test double
+            builder = (
+                builder
+                .base_url(f"{config.BOT_API_BASE_URL.rstrip('/')}/bot")
+                .base_file_url(f"{config.BOT_API_BASE_URL.rstrip('/')}/file/bot")
+            )
+        if supply is not None:
+            # Updates arrive from the supervisor
+            builder = builder.updater(None)
+        self.application = (
+            builder
+            .concurrent_updates(self.update_processor)
+            .rate_limiter(self.send_scheduler)
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
         self.setup_handlers()
     
     def setup_handlers(self):
@@ -38,12 +366,72 @@ class TelegramEntertainmentBot:
         self.application.add_handler(CommandHandler("joke", self.joke_command))
         self.application.add_handler(CommandHandler("meme", self.meme_command))
         
+        # Admin-only, not listed in /help
+        self.application.add_handler(CommandHandler("profile", self.profile_command))
+        self.application.add_handler(CommandHandler("stats", self.stats_command))
+        
         # Callback query handler for inline buttons
         self.application.add_handler(CallbackQueryHandler(self.button_callback))
         
+        # Inline mode: @bot <keyword>
+        self.application.add_handler(InlineQueryHandler(self.inline_query))
+        
+        # Update timing: runs before (group -1) and after (group 1) the handlers above
+        self.application.add_handler(TypeHandler(Update, self.mark_update_start), group=-1)
+        self.application.add_handler(TypeHandler(Update, self.mark_update_done), group=1)
+        
         # Error handler
         self.application.add_error_handler(self.error_handler)
     
+    def allowed_update_types(self) -> List[str]:
+        """
+        Work out which update types the registered handlers consume.
+        
+        Returns:
+            Update types to request from Telegram, or Update.ALL_TYPES if a
+            handler of unknown type is registered
+        """
+        allowed = set()
+        for handlers in self.application.handlers.values():
+            for handler in handlers:
+                if isinstance(handler, TypeHandler):
+                    # Timing hooks see whatever the other handlers see
+                    continue
+                for handler_type, update_types in HANDLER_UPDATE_TYPES.items():
+                    if isinstance(handler, handler_type):
+                        allowed.update(update_types)
+                        break
+                else:
+                    logger.warning(f"Unknown handler {handler!r}, requesting all update types")
+                    return Update.ALL_TYPES
+        return sorted(allowed)
+    
+    async def mark_update_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Note when an update starts processing and how old it already is."""
+        root = self.tracer.start_trace("update", update_id=update.update_id, kind=update_kind(update))
+        self._update_started[update.update_id] = (time.monotonic(), start_call_count(), root)
+        message = update.message or update.edited_message
+        if message and message.date:
+            # Telegram timestamps have one-second resolution
+            self.update_age.record(max(0.0, time.time() - message.date.timestamp()))
+    
+    async def mark_update_done(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Record how long the handlers took for an update and how many Bot API calls they made."""
+        started = self._update_started.pop(update.update_id, None)
+        if started is not None:
+            started_at, calls, root = started
+            self.tracer.finish_trace(root)
+            elapsed = time.monotonic() - started_at
+            self.update_handling.record(elapsed)
+            kind = update_kind(update)
+            kind = kind if kind in METRIC_UPDATE_KINDS else "other"
+            self.api_calls.record(kind, calls[0])
+            HANDLER_SECONDS.observe(elapsed, kind)
+            UPDATE_API_CALLS.inc(kind, amount=calls[0])
+        if not self.first_response_logged:
+            self.first_response_logged = True
+            logger.info(f"First update handled {time.monotonic() - self.started_at:.2f}s after startup")
+    
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /start command."""
         welcome_message = (
@@ -52,6 +440,7 @@ class TelegramEntertainmentBot:
             "Available commands:\n"
             "• /joke - Get a random clean joke\n"
             "• /meme - Get a random safe meme\n"
+            f"• /joke 3, /meme 3 - Get up to {config.BATCH_MAX_ITEMS} at once\n"
             "• /help - Show this help message\n\n"
             "All content is filtered to be appropriate! 📚✨"
         )
@@ -76,6 +465,7 @@ class TelegramEntertainmentBot:
             "• /start - Start the bot and see welcome message\n"
             "• /joke - Get a random clean joke\n"
             "• /meme - Get a random safe meme\n"
+            f"• /joke N, /meme N - Get up to {config.BATCH_MAX_ITEMS} jokes or memes in one message\n"
             "• /help - Show this help message\n\n"
             "Content Filtering:\n"
             "• All jokes are filtered for NSFW, religious, political, racist, sexist, and explicit content\n"
@@ -86,10 +476,24 @@ class TelegramEntertainmentBot:
         await update.message.reply_text(help_message)
     
     async def joke_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle the /joke command."""
-        await update.message.reply_text("🔍 Searching for a clean joke... Please wait!")
-        await asyncio.sleep(2)
-        joke_data = await self.fetch_clean_joke()
+        """Handle the /joke command, or /joke N for several jokes in one message."""
+        if await self.reply_busy(update):
+            return
+        count = requested_count(context.args, config.BATCH_MAX_ITEMS)
+        if count > 1:
+            await self.send_joke_batch(update, count)
+            return
+        
+        if config.DELIVERY_MODE == "loading_message":
+            with send_priority(PRIORITY_COSMETIC):
+                await update.message.reply_text("🔍 Searching for a clean joke... Please wait!")
+            joke_data = await self.next_clean_joke(chat_id=update.effective_chat.id)
+        else:
+            # Only show progress when the joke is not already in memory
+            joke_data = await self.next_clean_joke(
+                progress=lambda: self.show_chat_action(update.effective_chat.id, ChatAction.TYPING),
+                chat_id=update.effective_chat.id,
+            )
         
         if joke_data:
             await self.send_joke(update, joke_data)
@@ -100,12 +504,29 @@ class TelegramEntertainmentBot:
             )
     
     async def meme_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle the /meme command."""
-        await update.message.reply_text("🔍 Searching for a safe meme... Please wait!")
-        # to simulate loading and prevent hitting API too quickly
-        await asyncio.sleep(2)
-
-        meme_data = await self.fetch_safe_meme()
+        """Handle the /meme command, or /meme N for an album of several memes."""
+        if await self.reply_busy(update):
+            return
+        if self.overload.memes_as_jokes:
+            # Photos cost far more to fetch and send than a text joke
+            self.overload.record_shed("meme_as_joke")
+            await self.joke_command(update, context)
+            return
+        count = requested_count(context.args, min(config.BATCH_MAX_ITEMS, MediaGroupLimit.MAX_MEDIA_LENGTH))
+        if count > 1:
+            await self.send_meme_batch(update, count)
+            return
+        
+        if config.DELIVERY_MODE == "loading_message":
+            with send_priority(PRIORITY_COSMETIC):
+                await update.message.reply_text("🔍 Searching for a safe meme... Please wait!")
+            meme_data = await self.next_safe_meme(chat_id=update.effective_chat.id)
+        else:
+            # Only show progress when the meme is not already in memory
+            meme_data = await self.next_safe_meme(
+                progress=lambda: self.show_chat_action(update.effective_chat.id, ChatAction.UPLOAD_PHOTO),
+                chat_id=update.effective_chat.id,
+            )
         
         if meme_data:
             await self.send_meme(update, meme_data)
@@ -115,26 +536,83 @@ class TelegramEntertainmentBot:
                 "Please try again in a moment!"
             )
     
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /profile: start the sampling profiler, or stop it and write the stacks."""
+        user = update.effective_user
+        if user is None or user.id not in config.ADMIN_USER_IDS:
+            logger.info(f"Ignoring /profile from non-admin {user.id if user else None}")
+            return
+        
+        if not self.profiler.running:
+            self.profiler.start()
+            await update.message.reply_text(
+                f"🔬 Profiler started ({config.PROFILE_INTERVAL * 1000:.0f}ms interval). "
+                "Send /profile again to stop it."
+            )
+            return
+        
+        samples = self.profiler.stop()
+        path = os.path.join(config.PROFILE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        try:
+            stacks = self.profiler.dump(path)
+        except OSError as e:
+            logger.error(f"Could not write profile to {path}: {e}")
+            await update.message.reply_text(f"❌ Could not write the profile: {e}")
+            return
+        in_focus = self.profiler.stats()["in_focus"]
+        await update.message.reply_text(
+            f"🔬 Profiler stopped: {samples} samples ({in_focus} in bot code), "
+            f"{stacks} distinct stacks written to {path}"
+        )
+    
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /stats: send the internal counters as a JSON file."""
+        user = update.effective_user
+        if user is None or user.id not in config.ADMIN_USER_IDS:
+            logger.info(f"Ignoring /stats from non-admin {user.id if user else None}")
+            return
+        
+        # Too long for a message, so it goes out as a document
+        stats = json.dumps(self.get_stats(), indent=2, default=str, ensure_ascii=False)
+        await update.message.reply_document(
+            document=stats.encode("utf-8"),
+            filename=f"stats-{time.strftime('%Y%m%d-%H%M%S')}.json",
+        )
+    
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle inline button callbacks."""
         query = update.callback_query
+        data = query.data
+        if data in ("get_joke", "get_meme"):
+            if await self.reply_busy(update):
+                return
+            if data == "get_meme" and self.overload.memes_as_jokes:
+                self.overload.record_shed("meme_as_joke")
+                data = "get_joke"
+        
+        if config.DELIVERY_MODE != "loading_message" and data in ("get_joke", "get_meme"):
+            await self.deliver_callback(query, data)
+            return
+        
         await query.answer()
         
         # Check if current message has text or is a photo
         is_photo_message = bool(query.message.photo)
         
-        if query.data == "get_joke":
-            if is_photo_message:
-                # If current message is a photo, send a new loading message
-                loading_msg = await query.message.reply_text("🔍 Searching for a clean joke... Please wait!")
-                # Delete the old meme message
-                await query.message.delete()
-            else:
-                # If current message is text, edit it
-                await query.edit_message_text("🔍 Searching for a clean joke... Please wait!")
-                loading_msg = None
+        if data == "get_joke":
+            # Loading texts are cosmetic: results to other chats go first
+            with send_priority(PRIORITY_COSMETIC):
+                if is_photo_message:
+                    # If current message is a photo, send a new loading message
+                    loading_msg = await query.message.reply_text("🔍 Searching for a clean joke... Please wait!")
+                    # Delete the old meme message
+                    await query.message.delete()
+                else:
+                    # If current message is text, edit it
+                    await query.edit_message_text("🔍 Searching for a clean joke... Please wait!")
+                    loading_msg = None
             
-            joke_data = await self.fetch_clean_joke()
+            joke_data = await self.next_clean_joke(chat_id=query.message.chat_id)
             if joke_data:
                 if loading_msg:
                     await self.send_joke_new_message(loading_msg, joke_data)
@@ -148,18 +626,20 @@ class TelegramEntertainmentBot:
                 else:
                     await query.edit_message_text(error_message)
         
-        elif query.data == "get_meme":
-            if is_photo_message:
-                # If current message is a photo, send a new loading message
-                loading_msg = await query.message.reply_text("🔍 Searching for a safe meme... Please wait!")
-                # Delete the old meme message
-                await query.message.delete()
-            else:
-                # If current message is text, edit it
-                await query.edit_message_text("🔍 Searching for a safe meme... Please wait!")
-                loading_msg = None
+        elif data == "get_meme":
+            # Loading texts are cosmetic: results to other chats go first
+            with send_priority(PRIORITY_COSMETIC):
+                if is_photo_message:
+                    # If current message is a photo, send a new loading message
+                    loading_msg = await query.message.reply_text("🔍 Searching for a safe meme... Please wait!")
+                    # Delete the old meme message
+                    await query.message.delete()
+                else:
+                    # If current message is text, edit it
+                    await query.edit_message_text("🔍 Searching for a safe meme... Please wait!")
+                    loading_msg = None
             
-            meme_data = await self.fetch_safe_meme()
+            meme_data = await self.next_safe_meme(chat_id=query.message.chat_id)
             if meme_data:
                 if loading_msg:
                     await self.send_meme_new_message(loading_msg, meme_data)
@@ -173,7 +653,7 @@ class TelegramEntertainmentBot:
                 else:
                     await query.edit_message_text(error_message)
         
-        elif query.data == "help":
+        elif data == "help":
             help_message = (
                 "🤖 Entertainment Bot Help\n\n"
                 "Commands:\n"
@@ -190,74 +670,584 @@ class TelegramEntertainmentBot:
             else:
                 await query.edit_message_text(help_message)
     
-    async def fetch_clean_joke(self, max_attempts: int = 10) -> Optional[Dict[str, Any]]:
+    async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Answer an inline query from the search index; never fetches live."""
+        query = update.inline_query
+        started = time.perf_counter()
+        try:
+            offset = int(query.offset or 0)
+        except ValueError:
+            offset = 0
+        
+        matches, next_offset = self.search_index.search(
+            query.query, offset=offset, limit=config.INLINE_RESULTS_PER_PAGE
+        )
+        results = [self.inline_result(kind, key, item) for kind, key, item in matches]
+        results = [result for result in results if result is not None]
+        self.inline_search.record(time.perf_counter() - started)
+        
+        await query.answer(
+            results,
+            cache_time=config.INLINE_CACHE_TIME,
+            next_offset=str(next_offset) if next_offset is not None else "",
+        )
+    
+    def inline_result(self, kind: str, key: str, item: Dict[str, Any]):
         """
-        Fetch a clean joke from the JokeAPI.
+        Build the inline query result for an indexed joke or meme.
+        
+        Memes use their Telegram file_id when there is one. Otherwise
+        Telegram fetches the image by URL, so with the image pipeline on,
+        only memes whose original image passed it unchanged are offered;
+        the others are left out (None).
+        """
+        result_id = inline_result_id(kind, key)
+        if kind == "joke":
+            # Inline messages have no chat, so they are sent without the follow-up keyboard
+            joke_text, _ = self.format_joke(item)
+            title = item.get("joke") or item.get("setup") or "Joke"
+            return InlineQueryResultArticle(
+                id=result_id,
+                title=title[:100],
+                description=item.get("category"),
+                input_message_content=InputTextMessageContent(joke_text, parse_mode='Markdown'),
+            )
+        
+        caption, _ = self.format_meme(item)
+        file_id = self.file_id_cache.get(key)
+        if file_id:
+            return InlineQueryResultCachedPhoto(
+                id=result_id, photo_file_id=file_id, caption=caption, parse_mode='Markdown'
+            )
+        
+        if self.image_pipeline is not None and not item.get("image_unchanged"):
+            return None
+        url = item["url"]
+        previews = item.get("preview") or []
+        thumbnail_url = previews[0] if previews else url
+        if url.lower().endswith(".gif"):
+            return InlineQueryResultGif(
+                id=result_id, gif_url=url, thumbnail_url=thumbnail_url, caption=caption, parse_mode='Markdown'
+            )
+        return InlineQueryResultPhoto(
+            id=result_id, photo_url=url, thumbnail_url=thumbnail_url, caption=caption, parse_mode='Markdown'
+        )
+    
+    def index_content(self, kind: str, items: List[Dict[str, Any]]):
+        """Add filtered content to the inline search index."""
+        for item in items:
+            if kind == "joke":
+                self.search_index.add(kind, joke_key(item), item, joke_search_text(item))
+            else:
+                self.search_index.add(kind, meme_key(item), item, meme_search_text(item))
+    
+    async def next_clean_joke(
+        self, progress: Optional[ProgressCallback] = None, chat_id: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return a clean joke from the pool, fetching live only if it is empty.
         
         Args:
-            max_attempts: Maximum number of API calls to find a clean joke
+            progress: Awaited before a live fetch, e.g. to show a chat action
+            chat_id: Chat the joke is for; jokes it has already seen are avoided
             
         Returns:
             Dictionary containing joke data if found, None otherwise
         """
-        for attempt in range(max_attempts):
-            try:
-                response = requests.get(JOKE_API_URL, timeout=10)
-                response.raise_for_status()
-                
-                joke_data = response.json()
-                # Check if the joke is clean (all flags should be False for appropriate content)
-                if self.is_joke_clean(joke_data):
-                    logger.info(f"Found clean joke after {attempt + 1} attempts")
-                    return joke_data
-                else:
-                    logger.info(f"Joke filtered out (attempt {attempt + 1}): inappropriate content")
-                    continue
-                    
-            except requests.RequestException as e:
-                logger.error(f"Error fetching joke (attempt {attempt + 1}): {e}")
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error fetching joke (attempt {attempt + 1}): {e}")
-                continue
+        jokes = await self.next_clean_jokes(1, progress, chat_id)
+        return jokes[0] if jokes else None
+    
+    async def next_clean_jokes(
+        self, count: int, progress: Optional[ProgressCallback] = None, chat_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Return up to count clean jokes, from the pool first and one live fetch for the rest.
         
-        logger.warning(f"Failed to find clean joke after {max_attempts} attempts")
-        return None
+        Args:
+            count: Number of jokes wanted
+            progress: Awaited before a live fetch, e.g. to show a chat action
+            chat_id: Chat the jokes are for; jokes it has already seen are avoided
+            
+        Returns:
+            List of distinct jokes, empty if none were found
+        """
+        return await self.next_content(
+            "joke", self.joke_pool, self.joke_coalescer, joke_key, count, progress, chat_id
+        )
     
-    async def fetch_safe_meme(self, max_attempts: int = 10) -> Optional[Dict[str, Any]]:
+    async def next_safe_meme(
+        self, progress: Optional[ProgressCallback] = None, chat_id: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
         """
-        Fetch a safe meme from the Meme API.
+        Return a safe meme from the pool, fetching live only if it is empty.
         
         Args:
-            max_attempts: Maximum number of API calls to find a safe meme
+            progress: Awaited before a live fetch, e.g. to show a chat action
+            chat_id: Chat the meme is for; memes it has already seen are avoided
             
         Returns:
             Dictionary containing meme data if found, None otherwise
         """
-        for attempt in range(max_attempts):
+        memes = await self.next_safe_memes(1, progress, chat_id)
+        return memes[0] if memes else None
+    
+    async def next_safe_memes(
+        self, count: int, progress: Optional[ProgressCallback] = None, chat_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Return up to count safe memes, from the pool first and one live fetch for the rest.
+        
+        Args:
+            count: Number of memes wanted
+            progress: Awaited before a live fetch, e.g. to show a chat action
+            chat_id: Chat the memes are for; memes it has already seen are avoided
+            
+        Returns:
+            List of distinct memes, empty if none were found
+        """
+        return await self.next_content(
+            "meme", self.meme_pool, self.meme_coalescer, meme_key, count, progress, chat_id
+        )
+    
+    async def next_content(
+        self,
+        kind: str,
+        pool: ContentPool,
+        coalescer: Coalescer,
+        key_func: Callable[[Dict[str, Any]], str],
+        count: int,
+        progress: Optional[ProgressCallback],
+        chat_id: Optional[int],
+    ) -> List[Dict[str, Any]]:
+        """Pool first, then a live fetch for what is missing, then the local content store."""
+        store = self.content_store
+        prefer = None
+        if store is not None and chat_id is not None:
+            # Load the chat's seen set so the pool can skip repeats
+            await store.seen_filter(chat_id, kind)
+            prefer = lambda item: not store.has_seen_cached(chat_id, kind, key_func(item))
+        
+        items = []
+        while len(items) < count:
+            content = pool.pop(prefer)
+            if content is None:
+                break
+            items.append(content)
+        
+        missing = count - len(items)
+        if missing and not self.overload.allows_live_fetch:
+            # Overloaded: leave the upstream alone and answer from the store
+            self.overload.record_shed("live_fetch")
+        elif missing:
+            logger.info(f"{kind.capitalize()} pool empty, fetching live")
+            if progress is not None:
+                await progress()
+            with span(f"fetch_live:{kind}", wanted=missing) as fetch_span:
+                # Queued together, so one upstream batch usually covers them all
+                fetched = await coalescer.get_many(missing, deadline=config.FETCH_DEADLINE)
+                if fetch_span is not None:
+                    fetch_span.set(found=len(fetched))
+            items.extend(fetched)
+        
+        # Marked as seen below; stored fallbacks are marked as they are picked
+        fresh = len(items)
+        if fresh < count and store is not None:
+            # Upstream unreachable or empty-handed: answer from local content
+            keys = {key_func(item) for item in items}
+            with span(f"store_fallback:{kind}"):
+                while len(items) < count:
+                    content = await store.random_unseen(kind, chat_id)
+                    if content is None or key_func(content) in keys:
+                        break
+                    keys.add(key_func(content))
+                    items.append(content)
+                    if chat_id is not None:
+                        await store.mark_seen(chat_id, kind, key_func(content))
+            if len(items) > fresh:
+                logger.info(f"Serving {len(items) - fresh} {kind}(s) from the local content store")
+        
+        if store is not None and chat_id is not None:
+            for content in items[:fresh]:
+                await store.mark_seen(chat_id, kind, key_func(content))
+        return items
+    
+    async def archive(
+        self,
+        kind: str,
+        items: List[Dict[str, Any]],
+        key_func: Callable[[Dict[str, Any]], str],
+        category_func: Callable[[Dict[str, Any]], Optional[str]],
+    ):
+        """Keep filtered content in the local store; failures are only logged."""
+        if self.content_store is None or not items:
+            return
+        try:
+            with span(f"archive:{kind}", items=len(items)):
+                await self.content_store.add_many(
+                    kind, [(key_func(item), category_func(item), item) for item in items]
+                )
+        except Exception as e:
+            logger.error(f"Error storing {kind} content: {e}")
+    
+    async def reply_busy(self, update: Update) -> bool:
+        """
+        While shedding load, answer a content request with a short busy notice.
+        
+        Returns:
+            True if the update was answered and needs nothing more
+        """
+        if not self.overload.shedding:
+            return False
+        self.overload.record_shed("busy")
+        if update.callback_query is not None:
+            await update.callback_query.answer(BUSY_TEXT)
+        else:
+            await update.message.reply_text(BUSY_TEXT)
+        return True
+    
+    def shed_repeated_press(self, update: object) -> bool:
+        """While shedding load, drop button presses from chats that already have an update pending."""
+        if isinstance(update, Update) and update.callback_query is not None and self.overload.shedding:
+            self.overload.record_shed("repeated_press")
+            return True
+        return False
+    
+    async def show_chat_action(self, chat_id: int, action: str):
+        """Show a chat action such as "typing"; failures are only logged."""
+        try:
+            with send_priority(PRIORITY_COSMETIC):
+                await self.application.bot.send_chat_action(chat_id=chat_id, action=action)
+        except TelegramError as e:
+            logger.info(f"Could not send chat action to {chat_id}: {e}")
+    
+    async def deliver_callback(self, query: CallbackQuery, data: str):
+        """
+        Answer a get_joke/get_meme button with a single result call.
+        
+        Progress is shown with a chat action (only when the pool is empty)
+        and the button spinner; failures are reported in the callback
+        answer rather than in an extra message.
+        
+        Args:
+            query: The button press
+            data: What to deliver, "get_joke" or "get_meme"
+        """
+        chat_id = query.message.chat_id
+        is_photo_message = bool(query.message.photo)
+        
+        if data == "get_joke":
+            joke_data = await self.next_clean_joke(
+                progress=lambda: self.show_chat_action(chat_id, ChatAction.TYPING),
+                chat_id=chat_id,
+            )
+            if not joke_data:
+                await query.answer("😅 Sorry, I couldn't find a clean joke right now. Please try again in a moment!")
+                return
+            
+            joke_text, reply_markup = self.format_joke(joke_data)
+            if is_photo_message:
+                # A photo cannot be edited into text, so reply without deleting it
+                send = query.message.reply_text(joke_text, reply_markup=reply_markup, parse_mode='Markdown')
+            else:
+                send = query.edit_message_text(joke_text, reply_markup=reply_markup, parse_mode='Markdown')
+            await self.finish_callback(query, send, "joke")
+        
+        else:
+            meme_data = await self.next_safe_meme(
+                progress=lambda: self.show_chat_action(chat_id, ChatAction.UPLOAD_PHOTO),
+                chat_id=chat_id,
+            )
+            if not meme_data:
+                await query.answer("😅 Sorry, I couldn't find a safe meme right now. Please try again in a moment!")
+                return
+            
+            caption, reply_markup = self.format_meme(meme_data)
+            if is_photo_message:
+                # Swap the photo in place
+                send = self.send_meme_photo(
+                    lambda photo: query.edit_message_media(
+                        InputMediaPhoto(photo, caption=caption, parse_mode='Markdown'),
+                        reply_markup=reply_markup,
+                    ),
+                    meme_data,
+                )
+            else:
+                # A text message cannot be edited into a photo
+                send = self.reply_meme_photo(
+                    query.message, meme_data, caption=caption, reply_markup=reply_markup, parse_mode='Markdown'
+                )
+            await self.finish_callback(query, send, "meme")
+    
+    async def finish_callback(self, query: CallbackQuery, send: Awaitable[Any], what: str):
+        """Answer the callback query while the result is being sent."""
+        _, sent = await asyncio.gather(query.answer(), send, return_exceptions=True)
+        if isinstance(sent, Exception):
+            logger.error(f"Error sending {what} callback: {sent}")
+            await query.message.reply_text(f"Sorry, there was an error sending the {what}. Please try again!")
+    
+    async def fetch_joke_batch(self, batch_size: int = config.JOKE_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """
+        Fetch a batch of jokes in one JokeAPI call and keep the clean ones.
+        
+        JokeAPI already drops flagged jokes server-side (blacklistFlags and
+        safe-mode), every item is still checked with is_joke_clean, and the
+        whole batch against the text filter rules.
+        
+        Args:
+            batch_size: Number of jokes to request (JokeAPI allows up to 10)
+            
+        Returns:
+            List of clean jokes, possibly empty
+        """
+        params = {
+            "amount": batch_size,
+            "blacklistFlags": JOKE_BLACKLIST_FLAGS,
+            "safe-mode": "",
+        }
+        payload = await self.upstream.get_json(JOKE_API_URL, params=params)
+        
+        # amount=1 returns a bare joke, larger amounts wrap them in "jokes"
+        if isinstance(payload, dict) and "jokes" in payload:
+            jokes = payload.get("jokes") or []
+            for joke in jokes:
+                if isinstance(joke, dict):
+                    joke.setdefault("error", payload.get("error", True))
+        else:
+            jokes = [payload]
+        
+        FILTER_CHECKED.inc("joke", amount=len(jokes))
+        with span("filter:joke", items=len(jokes)) as filter_span:
+            clean_jokes = [joke for joke in jokes if self.is_joke_clean(joke)]
+            flag_checked = len(clean_jokes)
+            clean_jokes = self.text_filter.filter_items(clean_jokes, joke_search_text)
+            if filter_span is not None:
+                filter_span.set(flags_passed=flag_checked, clean=len(clean_jokes))
+        FILTER_REJECTIONS.inc("joke", "text_rule", amount=flag_checked - len(clean_jokes))
+        self.joke_batch_stats.record(len(jokes), len(clean_jokes))
+        await self.archive("joke", clean_jokes, joke_key, lambda joke: joke.get("category"))
+        self.index_content("joke", clean_jokes)
+        logger.info(f"Joke batch yielded {len(clean_jokes)}/{len(jokes)} clean jokes")
+        return clean_jokes
+    
+    async def fetch_meme_batch(
+        self,
+        batch_size: int = config.MEME_BATCH_SIZE,
+        on_ready: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Fetch a batch of memes in one meme-api call and keep the safe ones.
+        
+        Memes are checked with is_meme_safe, then the whole batch against
+        the text filter rules, then their images are downloaded and
+        validated (memes Telegram already has a file_id for are skipped).
+        
+        Args:
+            batch_size: Number of memes to request (meme-api allows up to 50)
+            on_ready: Offered each safe meme as soon as its image is ready;
+                memes it takes (returns True for) are not returned again
+            
+        Returns:
+            List of safe memes, possibly empty
+        """
+        payload = await self.upstream.get_json(f"{MEME_API_URL}/{batch_size}")
+        
+        if isinstance(payload, dict) and "memes" in payload:
+            memes = payload.get("memes") or []
+        else:
+            memes = [payload]
+        
+        FILTER_CHECKED.inc("meme", amount=len(memes))
+        with span("filter:meme", items=len(memes)) as filter_span:
+            safe_memes = [meme for meme in memes if self.is_meme_safe(meme)]
+            flag_checked = len(safe_memes)
+            safe_memes = self.text_filter.filter_items(safe_memes, meme_search_text)
+            if filter_span is not None:
+                filter_span.set(flags_passed=flag_checked, clean=len(safe_memes))
+        FILTER_REJECTIONS.inc("meme", "text_rule", amount=flag_checked - len(safe_memes))
+        taken = set()
+        if self.image_pipeline is not None:
+            text_checked = len(safe_memes)
+            
+            def ready(meme_data: Dict[str, Any]):
+                if on_ready is not None and on_ready(meme_data):
+                    taken.add(id(meme_data))
+            
+            with span("images", items=text_checked):
+                safe_memes = await self.image_pipeline.filter_memes(
+                    safe_memes, skip=lambda meme: meme_key(meme) in self.file_id_cache, on_ready=ready
+                )
+            FILTER_REJECTIONS.inc("meme", "image", amount=text_checked - len(safe_memes))
+        self.meme_batch_stats.record(len(memes), len(safe_memes))
+        await self.archive("meme", safe_memes, meme_key, lambda meme: meme.get("subreddit"))
+        self.index_content("meme", safe_memes)
+        logger.info(f"Meme batch yielded {len(safe_memes)}/{len(memes)} safe memes")
+        return [meme for meme in safe_memes if id(meme) not in taken]
+    
+    async def fetch_live_memes(self) -> List[Dict[str, Any]]:
+        """
+        Fetch a batch of memes for callers waiting on the meme coalescer.
+        
+        Each meme goes to a waiting caller as soon as its image is ready,
+        rather than after the slowest download of the batch; the rest is
+        returned as usual.
+        """
+        return await self.fetch_meme_batch(on_ready=self.meme_coalescer.deliver)
+    
+    async def prefetch_memes(self) -> List[Dict[str, Any]]:
+        """
+        Fetch a batch of safe memes for the meme pool.
+        
+        When a cache chat is configured, memes without a cached file_id are
+        uploaded there first, and memes Telegram cannot fetch are dropped.
+        
+        Returns:
+            List of safe memes, possibly empty
+        """
+        memes = await self.fetch_meme_batch()
+        if not config.MEME_CACHE_CHAT_ID or not memes:
+            return memes
+        
+        semaphore = asyncio.Semaphore(config.MEME_PREUPLOAD_CONCURRENCY)
+        
+        async def preupload(meme_data: Dict[str, Any]) -> bool:
+            key = meme_key(meme_data)
+            if key in self.file_id_cache:
+                return True
+            async with semaphore:
+                try:
+                    sent = await self.application.bot.send_photo(
+                        chat_id=config.MEME_CACHE_CHAT_ID,
+                        photo=self.meme_photo_input(meme_data),
+                        disable_notification=True,
+                    )
+                except Exception as e:
+                    logger.info(f"Pre-upload failed for {key}, dropping meme: {e}")
+                    return False
+            if sent.photo:
+                self.file_id_cache.put(key, sent.photo[-1].file_id)
+            return True
+        
+        results = await asyncio.gather(*(preupload(meme) for meme in memes))
+        return [meme for meme, ok in zip(memes, results) if ok]
+    
+    async def supplied_batch(self, kind: str) -> List[Dict[str, Any]]:
+        """
+        Take a batch of filtered jokes or memes from the supervisor (worker processes only).
+        
+        The supervisor already filtered and archived the items; they are only
+        indexed for inline search here, and meme file_ids it sent along are
+        cached.
+        
+        Raises:
+            CircuitOpenError: If nothing came back because the supervisor's
+                circuit for the kind is open
+        """
+        items, retry_in = await self.supply(kind)
+        self._supply_open_until[kind] = time.monotonic() + retry_in
+        if retry_in > 0 and not items:
+            raise CircuitOpenError(f"supervisor {kind}", retry_in)
+        for item in items:
+            file_id = item.pop("file_id", None)
+            if file_id:
+                self.file_id_cache.put(meme_key(item), file_id)
+        self.index_content(kind, items)
+        return items
+    
+    def is_upstream_available(self, kind: str) -> bool:
+        """
+        Return False while the circuit for the upstream of a kind is open.
+        
+        Worker processes never call the upstreams themselves, so they go by
+        the supervisor's circuit state sent along with its last batch.
+        """
+        if self.supply is not None:
+            return time.monotonic() >= self._supply_open_until.get(kind, 0.0)
+        return self.upstream.is_available(UPSTREAM_URLS[kind])
+    
+    def circuits_open(self) -> int:
+        """Number of content kinds whose upstream circuit is open."""
+        return sum(not self.is_upstream_available(kind) for kind in UPSTREAM_URLS)
+    
+    async def reply_meme_photo(self, message: Message, meme_data: Dict[str, Any], **kwargs) -> Message:
+        """
+        Reply with a meme photo, reusing a cached Telegram file_id when possible.
+        
+        Args:
+            message: Message to reply to
+            meme_data: Meme to send
+            **kwargs: Extra arguments for reply_photo (caption, markup, ...)
+            
+        Returns:
+            The sent message
+        """
+        return await self.send_meme_photo(
+            lambda photo: message.reply_photo(photo=photo, **kwargs), meme_data
+        )
+    
+    def meme_photo_input(self, meme_data: Dict[str, Any]) -> Union[str, Path]:
+        """Return the prepared local image for a meme if there is one, else its URL."""
+        if self.image_pipeline is not None:
+            local_file = self.image_pipeline.local_file(meme_data)
+            if local_file is not None:
+                return local_file
+        return meme_data['url']
+    
+    async def send_meme_photo(
+        self, send: Callable[[Union[str, Path]], Awaitable[Any]], meme_data: Dict[str, Any]
+    ) -> Any:
+        """
+        Send a meme photo through the given call, preferring a cached file_id.
+        
+        Without a file_id the photo is uploaded from the image cache, or
+        sent by URL if the meme has no prepared image.
+        
+        Args:
+            send: Makes the Bot API call for a photo file_id, local file or URL
+            meme_data: Meme to send
+            
+        Returns:
+            Whatever send returned
+        """
+        key = meme_key(meme_data)
+        file_id = self.file_id_cache.get(key)
+        if file_id:
             try:
-                response = requests.get(MEME_API_URL, timeout=10)
-                response.raise_for_status()
-                
-                meme_data = response.json()
-                
-                # Check if the meme is safe (not NSFW and not spoiler)
-                if self.is_meme_safe(meme_data):
-                    logger.info(f"Found safe meme after {attempt + 1} attempts")
-                    return meme_data
-                else:
-                    logger.info(f"Meme filtered out (attempt {attempt + 1}): inappropriate content")
-                    continue
-                    
-            except requests.RequestException as e:
-                logger.error(f"Error fetching meme (attempt {attempt + 1}): {e}")
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error fetching meme (attempt {attempt + 1}): {e}")
-                continue
+                return await send(file_id)
+            except BadRequest as e:
+                logger.warning(f"Cached file_id for {key} rejected, resending by URL: {e}")
+                self.file_id_cache.discard(key)
+        
+        sent = await send(self.meme_photo_input(meme_data))
+        if isinstance(sent, Message) and sent.photo:
+            # The largest size carries the full-resolution file_id
+            self.file_id_cache.put(key, sent.photo[-1].file_id)
+        return sent
+    
+    async def fetch_clean_joke(self) -> Optional[Dict[str, Any]]:
+        """
+        Fetch a clean joke from the JokeAPI.
+        
+        Concurrent callers share in-flight batches; surplus clean jokes go to
+        the joke pool. Gives up after FETCH_DEADLINE seconds, or at once while
+        the JokeAPI circuit is open.
+        
+        Returns:
+            Dictionary containing joke data if found, None otherwise
+        """
+        return await self.joke_coalescer.get(deadline=config.FETCH_DEADLINE)
+    
+    async def fetch_safe_meme(self) -> Optional[Dict[str, Any]]:
+        """
+        Fetch a safe meme from the Meme API.
         
-        logger.warning(f"Failed to find safe meme after {max_attempts} attempts")
-        return None
+        Concurrent callers share in-flight batches; surplus safe memes go to
+        the meme pool. Gives up after FETCH_DEADLINE seconds, or at once while
+        the meme-api circuit is open.
+        
+        Returns:
+            Dictionary containing meme data if found, None otherwise
+        """
+        return await self.meme_coalescer.get(deadline=config.FETCH_DEADLINE)
     
     def is_joke_clean(self, joke_data: Dict[str, Any]) -> bool:
         """
@@ -270,10 +1260,12 @@ class TelegramEntertainmentBot:
             True if joke is clean, False otherwise
         """
         if not isinstance(joke_data, dict):
+            FILTER_REJECTIONS.inc("joke", "malformed")
             return False
         
         # Check for error in API response
         if joke_data.get("error", True):
+            FILTER_REJECTIONS.inc("joke", "error")
             return False
         
         # Get flags - all should be False for clean content
@@ -287,10 +1279,12 @@ class TelegramEntertainmentBot:
         # Check if any inappropriate flag is True
         for flag in inappropriate_flags:
             if flags.get(flag, True):  # Default to True (unsafe) if flag is missing
+                FILTER_REJECTIONS.inc("joke", flag)
                 return False
         
         # Additional check: the joke should be marked as safe
         if not joke_data.get("safe", False):
+            FILTER_REJECTIONS.inc("joke", "unsafe")
             return False
         
         return True
@@ -306,47 +1300,96 @@ class TelegramEntertainmentBot:
             True if meme is safe, False otherwise
         """
         if not isinstance(meme_data, dict):
+            FILTER_REJECTIONS.inc("meme", "malformed")
             return False
         
         # Check if meme is NSFW or spoiler
         if meme_data.get("nsfw", True):  # Default to True (unsafe) if missing
+            FILTER_REJECTIONS.inc("meme", "nsfw")
             return False
         
         if meme_data.get("spoiler", True):  # Default to True (unsafe) if missing
+            FILTER_REJECTIONS.inc("meme", "spoiler")
             return False
         
         # Check if required fields are present
         required_fields = ["title", "url", "author"]
         for field in required_fields:
             if field not in meme_data:
+                FILTER_REJECTIONS.inc("meme", "missing_field")
                 return False
         
         return True
     
+    def format_joke(self, joke_data: Dict[str, Any]) -> Tuple[str, InlineKeyboardMarkup]:
+        """Build the Markdown text and follow-up keyboard for a joke."""
+        joke_text = f"😂 **Random Joke**\n\n{self.joke_body(joke_data)}"
+        
+        # Create inline keyboard for more actions
+        keyboard = [
+            [
+                InlineKeyboardButton("😂 Another Joke", callback_data="get_joke"),
+                InlineKeyboardButton("🤣 Get Meme", callback_data="get_meme")
+            ]
+        ]
+        return joke_text, InlineKeyboardMarkup(keyboard)
+    
+    def joke_body(self, joke_data: Dict[str, Any]) -> str:
+        """Markdown text of a joke with its category and ID, without a heading."""
+        if joke_data["type"] == "single":
+            joke_text = joke_data['joke']
+        else:  # two-part joke
+            joke_text = (
+                f"**Setup:** {joke_data['setup']}\n\n"
+                f"**Punchline:** {joke_data['delivery']}"
+            )
+        
+        # Add category and ID for reference
+        joke_text += f"\n\n📁 Category: {joke_data.get('category', 'Unknown')}"
+        joke_text += f"\n🔢 ID: {joke_data.get('id', 'Unknown')}"
+        return joke_text
+    
+    def format_jokes(self, jokes: List[Dict[str, Any]]) -> Tuple[str, InlineKeyboardMarkup]:
+        """
+        Build one Markdown message holding several jokes, and the follow-up keyboard.
+        
+        Jokes that would push the message past Telegram's length limit are left out.
+        """
+        parts = []
+        length = 0
+        for number, joke_data in enumerate(jokes, 1):
+            part = f"😂 **Joke {number}**\n\n{self.joke_body(joke_data)}"
+            length += len(part) + 2
+            if parts and length > MessageLimit.MAX_TEXT_LENGTH:
+                logger.info(f"Left {len(jokes) - len(parts)} joke(s) out of a combined message")
+                break
+            parts.append(part)
+        _, reply_markup = self.format_joke(jokes[0])
+        return "\n\n".join(parts), reply_markup
+    
+    def format_meme(self, meme_data: Dict[str, Any]) -> Tuple[str, InlineKeyboardMarkup]:
+        """Build the Markdown caption and follow-up keyboard for a meme."""
+        # Format caption with title in bold and author info
+        caption = (
+            f"**{meme_data['title']}**\n\n"
+            f"👤 Author: {meme_data['author']}\n"
+            f"📱 Subreddit: r/{meme_data['subreddit']}\n"
+            f"🔗 [Original Post]({meme_data['postLink']})"
+        )
+        
+        # Create inline keyboard for more actions
+        keyboard = [
+            [
+                InlineKeyboardButton("🤣 Another Meme", callback_data="get_meme"),
+                InlineKeyboardButton("😂 Get Joke", callback_data="get_joke")
+            ]
+        ]
+        return caption, InlineKeyboardMarkup(keyboard)
+    
     async def send_joke_new_message(self, loading_msg, joke_data: Dict[str, Any]):
         """Send a joke by editing the loading message."""
         try:
-            if joke_data["type"] == "single":
-                joke_text = f"😂 **Random Joke**\n\n{joke_data['joke']}"
-            else:  # two-part joke
-                joke_text = (
-                    f"😂 **Random Joke**\n\n"
-                    f"**Setup:** {joke_data['setup']}\n\n"
-                    f"**Punchline:** {joke_data['delivery']}"
-                )
-            
-            # Add category and ID for reference
-            joke_text += f"\n\n📁 Category: {joke_data.get('category', 'Unknown')}"
-            joke_text += f"\n🔢 ID: {joke_data.get('id', 'Unknown')}"
-            
-            # Create inline keyboard for more actions
-            keyboard = [
-                [
-                    InlineKeyboardButton("😂 Another Joke", callback_data="get_joke"),
-                    InlineKeyboardButton("🤣 Get Meme", callback_data="get_meme")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            joke_text, reply_markup = self.format_joke(joke_data)
             
             await loading_msg.edit_text(joke_text, reply_markup=reply_markup, parse_mode='Markdown')
             
@@ -357,27 +1400,13 @@ class TelegramEntertainmentBot:
     async def send_meme_new_message(self, loading_msg, meme_data: Dict[str, Any]):
         """Send a meme by deleting the loading message and sending a photo."""
         try:
-            # Format caption with title in bold and author info
-            caption = (
-                f"**{meme_data['title']}**\n\n"
-                f"👤 Author: {meme_data['author']}\n"
-                f"📱 Subreddit: r/{meme_data['subreddit']}\n"
-                f"🔗 [Original Post]({meme_data['postLink']})"
-            )
-            
-            # Create inline keyboard for more actions
-            keyboard = [
-                [
-                    InlineKeyboardButton("🤣 Another Meme", callback_data="get_meme"),
-                    InlineKeyboardButton("😂 Get Joke", callback_data="get_joke")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            caption, reply_markup = self.format_meme(meme_data)
             
             # Delete the loading message and send photo
             await loading_msg.delete()
-            await loading_msg.reply_photo(
-                photo=meme_data['url'],
+            await self.reply_meme_photo(
+                loading_msg,
+                meme_data,
                 caption=caption,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
@@ -390,27 +1419,7 @@ class TelegramEntertainmentBot:
     async def send_joke(self, update: Update, joke_data: Dict[str, Any]):
         """Send a joke as a text message."""
         try:
-            if joke_data["type"] == "single":
-                joke_text = f"😂 **Random Joke**\n\n{joke_data['joke']}"
-            else:  # two-part joke
-                joke_text = (
-                    f"😂 **Random Joke**\n\n"
-                    f"**Setup:** {joke_data['setup']}\n\n"
-                    f"**Punchline:** {joke_data['delivery']}"
-                )
-            
-            # Add category and ID for reference
-            joke_text += f"\n\n📁 Category: {joke_data.get('category', 'Unknown')}"
-            joke_text += f"\n🔢 ID: {joke_data.get('id', 'Unknown')}"
-            
-            # Create inline keyboard for more actions
-            keyboard = [
-                [
-                    InlineKeyboardButton("😂 Another Joke", callback_data="get_joke"),
-                    InlineKeyboardButton("🤣 Get Meme", callback_data="get_meme")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            joke_text, reply_markup = self.format_joke(joke_data)
             
             await update.message.reply_text(joke_text, reply_markup=reply_markup, parse_mode='Markdown')
             
@@ -418,30 +1427,35 @@ class TelegramEntertainmentBot:
             logger.error(f"Error sending joke: {e}")
             await update.message.reply_text("Sorry, there was an error sending the joke. Please try again!")
     
-    async def send_joke_callback(self, query, joke_data: Dict[str, Any]):
-        """Send a joke as response to callback query."""
+    async def send_joke_batch(self, update: Update, count: int):
+        """Answer /joke N with up to N jokes in a single message."""
+        chat_id = update.effective_chat.id
+        jokes = await self.next_clean_jokes(
+            count,
+            progress=lambda: self.show_chat_action(chat_id, ChatAction.TYPING),
+            chat_id=chat_id,
+        )
+        if not jokes:
+            await update.message.reply_text(
+                "😅 Sorry, I couldn't find clean jokes right now. "
+                "Please try again in a moment!"
+            )
+            return
+        
         try:
-            if joke_data["type"] == "single":
-                joke_text = f"😂 **Random Joke**\n\n{joke_data['joke']}"
-            else:  # two-part joke
-                joke_text = (
-                    f"😂 **Random Joke**\n\n"
-                    f"**Setup:** {joke_data['setup']}\n\n"
-                    f"**Punchline:** {joke_data['delivery']}"
-                )
+            joke_text, reply_markup = self.format_jokes(jokes)
             
-            # Add category and ID for reference
-            joke_text += f"\n\n📁 Category: {joke_data.get('category', 'Unknown')}"
-            joke_text += f"\n🔢 ID: {joke_data.get('id', 'Unknown')}"
+            await update.message.reply_text(joke_text, reply_markup=reply_markup, parse_mode='Markdown')
+            BATCH_ITEMS.inc("joke", amount=len(jokes))
             
-            # Create inline keyboard for more actions
-            keyboard = [
-                [
-                    InlineKeyboardButton("😂 Another Joke", callback_data="get_joke"),
-                    InlineKeyboardButton("🤣 Get Meme", callback_data="get_meme")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        except Exception as e:
+            logger.error(f"Error sending jokes: {e}")
+            await update.message.reply_text("Sorry, there was an error sending the jokes. Please try again!")
+    
+    async def send_joke_callback(self, query, joke_data: Dict[str, Any]):
+        """Send a joke as response to callback query."""
+        try:
+            joke_text, reply_markup = self.format_joke(joke_data)
             
             await query.edit_message_text(joke_text, reply_markup=reply_markup, parse_mode='Markdown')
             
@@ -452,26 +1466,12 @@ class TelegramEntertainmentBot:
     async def send_meme(self, update: Update, meme_data: Dict[str, Any]):
         """Send a meme as a photo with caption."""
         try:
-            # Format caption with title in bold and author info
-            caption = (
-                f"**{meme_data['title']}**\n\n"
-                f"👤 Author: {meme_data['author']}\n"
-                f"📱 Subreddit: r/{meme_data['subreddit']}\n"
-                f"🔗 [Original Post]({meme_data['postLink']})"
-            )
-            
-            # Create inline keyboard for more actions
-            keyboard = [
-                [
-                    InlineKeyboardButton("🤣 Another Meme", callback_data="get_meme"),
-                    InlineKeyboardButton("😂 Get Joke", callback_data="get_joke")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            caption, reply_markup = self.format_meme(meme_data)
             
             # Send photo with caption
-            await update.message.reply_photo(
-                photo=meme_data['url'],
+            await self.reply_meme_photo(
+                update.message,
+                meme_data,
                 caption=caption,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
@@ -481,30 +1481,86 @@ class TelegramEntertainmentBot:
             logger.error(f"Error sending meme: {e}")
             await update.message.reply_text("Sorry, there was an error sending the meme. Please try again!")
     
+    async def send_meme_batch(self, update: Update, count: int):
+        """Answer /meme N with up to N memes in a single album."""
+        chat_id = update.effective_chat.id
+        memes = await self.next_safe_memes(
+            count,
+            progress=lambda: self.show_chat_action(chat_id, ChatAction.UPLOAD_PHOTO),
+            chat_id=chat_id,
+        )
+        if not memes:
+            await update.message.reply_text(
+                "😅 Sorry, I couldn't find safe memes right now. "
+                "Please try again in a moment!"
+            )
+            return
+        if len(memes) < MediaGroupLimit.MIN_MEDIA_LENGTH:
+            # An album needs at least two photos
+            await self.send_meme(update, memes[0])
+            return
+        
+        try:
+            await self.reply_meme_album(update.message, memes)
+            BATCH_ITEMS.inc("meme", amount=len(memes))
+            
+        except Exception as e:
+            logger.error(f"Error sending meme album: {e}")
+            await update.message.reply_text("Sorry, there was an error sending the memes. Please try again!")
+    
+    async def reply_meme_album(self, message: Message, memes: List[Dict[str, Any]]) -> Tuple[Message, ...]:
+        """
+        Reply with memes as one album, reusing cached Telegram file_ids.
+        
+        Albums carry no keyboard, so each photo only gets its caption. If
+        Telegram rejects a cached file_id, the album is sent again without
+        any cached file_ids.
+        
+        Args:
+            message: Message to reply to
+            memes: Two to ten memes
+            
+        Returns:
+            The sent messages, one per meme
+        """
+        keys = [meme_key(meme_data) for meme_data in memes]
+        file_ids = [self.file_id_cache.get(key) for key in keys]
+        
+        def album(use_file_ids: bool) -> List[InputMediaPhoto]:
+            media = []
+            for meme_data, file_id in zip(memes, file_ids):
+                caption, _ = self.format_meme(meme_data)
+                photo = file_id if use_file_ids and file_id else self.meme_photo_input(meme_data)
+                media.append(InputMediaPhoto(photo, caption=caption, parse_mode='Markdown'))
+            return media
+        
+        try:
+            sent = await message.reply_media_group(album(use_file_ids=True))
+        except BadRequest as e:
+            if not any(file_ids):
+                raise
+            logger.warning(f"Cached file_ids rejected in an album, resending without them: {e}")
+            for key, file_id in zip(keys, file_ids):
+                if file_id:
+                    self.file_id_cache.discard(key)
+            sent = await message.reply_media_group(album(use_file_ids=False))
+        
+        for key, sent_message in zip(keys, sent):
+            if sent_message.photo:
+                # The largest size carries the full-resolution file_id
+                self.file_id_cache.put(key, sent_message.photo[-1].file_id)
+        return sent
+    
     async def send_meme_callback(self, query, meme_data: Dict[str, Any]):
         """Send a meme as response to callback query."""
         try:
-            # Format caption with title in bold and author info
-            caption = (
-                f"**{meme_data['title']}**\n\n"
-                f"👤 Author: {meme_data['author']}\n"
-                f"📱 Subreddit: r/{meme_data['subreddit']}\n"
-                f"🔗 [Original Post]({meme_data['postLink']})"
-            )
-            
-            # Create inline keyboard for more actions
-            keyboard = [
-                [
-                    InlineKeyboardButton("🤣 Another Meme", callback_data="get_meme"),
-                    InlineKeyboardButton("😂 Get Joke", callback_data="get_joke")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            caption, reply_markup = self.format_meme(meme_data)
             
             # Delete the previous message and send new photo
             await query.message.delete()
-            await query.message.reply_photo(
-                photo=meme_data['url'],
+            await self.reply_meme_photo(
+                query.message,
+                meme_data,
                 caption=caption,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
@@ -518,11 +1574,170 @@ class TelegramEntertainmentBot:
         """Handle errors that occur during bot operation."""
         logger.error(f"Update {update} caused error {context.error}")
         
+        # Replying to a flood-control error would only make the flood worse
+        if isinstance(context.error, RetryAfter):
+            return
+        # Nor does an apology help while the bot is shedding load
+        if self.overload.shedding:
+            return
+        
         # Notify user of error if possible
-        if update and update.effective_message:
-            await update.effective_message.reply_text(
-                "🔧 Sorry, something went wrong! Please try again later."
-            )
+        if isinstance(update, Update) and update.effective_message:
+            with send_priority(PRIORITY_COSMETIC):
+                await update.effective_message.reply_text(
+                    "🔧 Sorry, something went wrong! Please try again later."
+                )
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Collect the internal counters of the content pipeline."""
+        return {
+            "pools": {pool.name: pool.stats() for pool in (self.joke_pool, self.meme_pool)},
+            "batches": {
+                "joke": self.joke_batch_stats.stats(),
+                "meme": self.meme_batch_stats.stats(),
+            },
+            "coalescing": {
+                "joke": self.joke_coalescer.stats(),
+                "meme": self.meme_coalescer.stats(),
+            },
+            "rate_limits": self.upstream.limiter_stats(),
+            "circuits": self.upstream.breaker_stats(),
+            "file_id_cache": self.file_id_cache.stats(),
+            "images": self.image_pipeline.stats() if self.image_pipeline else None,
+            "content_store": self.content_store.stats() if self.content_store else None,
+            "text_filter": self.text_filter.stats(),
+            "inline": {
+                "index": self.search_index.stats(),
+                "search": self.inline_search.stats(),
+            },
+            "updates": {
+                "age": self.update_age.stats(),
+                "handling": self.update_handling.stats(),
+                "queue_depth": self.application.update_queue.qsize(),
+                "processor": self.update_processor.stats(),
+            },
+            "sends": self.send_scheduler.stats(),
+            "api_calls_per_update": self.api_calls.stats(),
+            "tracing": self.tracer.stats(),
+            "profiler": self.profiler.stats(),
+            "overload": self.overload.stats(),
+            "workers": self.worker_stats() if self.worker_stats else None,
+        }
+    
+    async def log_stats(self, interval: float):
+        """Log get_stats() as one JSON line every interval seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                logger.info(f"Stats: {json.dumps(self.get_stats(), default=str, ensure_ascii=False)}")
+            except Exception as e:
+                logger.error(f"Error collecting stats: {e}")
+    
+    def register_gauges(self):
+        """Point the metrics gauges at the live pool, queue and circuit state."""
+        POOL_SIZE.set_function(lambda: {
+            (pool.name,): len(pool) for pool in (self.joke_pool, self.meme_pool)
+        })
+        
+        def updates_in_flight() -> Dict[Tuple[str, ...], int]:
+            processor = self.update_processor.stats()
+            return {
+                ("running",): processor["running"],
+                ("waiting_for_worker",): processor["waiting_for_worker"],
+                ("queued_in_chats",): processor["queued_in_chats"],
+                ("update_queue",): self.application.update_queue.qsize(),
+            }
+        
+        UPDATES_IN_FLIGHT.set_function(updates_in_flight)
+        SEND_QUEUE_LENGTH.set_function(lambda: {
+            (name,): queued for name, queued in self.send_scheduler.stats()["queued"].items()
+        })
+        CIRCUIT_OPEN.set_function(lambda: {
+            (host,): int(breaker.is_open) for host, breaker in self.upstream.breakers.items()
+        })
+        OVERLOAD_LEVEL.set_function(lambda: self.overload.level)
+        EVENT_LOOP_LAG.set_function(lambda: self.overload.lag)
+    
+    async def on_startup(self, application: Application):
+        """Start background tasks once the application is initialized."""
+        if self.content_store is not None:
+            await self.content_store.open()
+        await self.warm_start()
+        self.file_id_cache.start()
+        self.pool_refiller.start()
+        if config.OVERLOAD_CONTROL:
+            self.overload.start()
+        if config.STATS_LOG_INTERVAL > 0:
+            self._stats_task = asyncio.create_task(self.log_stats(config.STATS_LOG_INTERVAL), name="stats-logger")
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+    
+    async def warm_start(self):
+        """
+        Fill the pools before updates are accepted.
+        
+        Pools are first restored from the shutdown snapshot and the inline
+        search index is rebuilt from the content store, then whatever is
+        still below its low watermark is fetched, for at most WARMUP_TIMEOUT.
+        """
+        started = time.monotonic()
+        pools = [self.joke_pool, self.meme_pool]
+        
+        snapshot = load_snapshot(config.SNAPSHOT_PATH, config.POOL_MAX_AGE) if config.SNAPSHOT_PATH else None
+        if snapshot is not None:
+            pooled = snapshot.get("pools")
+            for pool in pools:
+                entries = pooled.get(pool.name) if isinstance(pooled, dict) else None
+                if isinstance(entries, list):
+                    restored = pool.restore(entries, extra_age=snapshot["age"])
+                    logger.info(f"Restored {restored} {pool.name}(s) from snapshot")
+        
+        # Inline search covers everything stored, not just what is pooled
+        if self.content_store is not None:
+            for kind in ("joke", "meme"):
+                stored = await self.content_store.recent(kind, config.SEARCH_INDEX_MAX_ITEMS // 2)
+                self.index_content(kind, [item for _, item in stored])
+        for pool in pools:
+            self.index_content(pool.name, [item for _, item in pool.snapshot()])
+        
+        low = [pool for pool in pools if pool.needs_refill]
+        if low:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(pool.refill() for pool in low), return_exceptions=True),
+                    timeout=config.WARMUP_TIMEOUT,
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Warm-up fetch still running after {config.WARMUP_TIMEOUT}s, starting anyway")
+        
+        sizes = ", ".join(f"{pool.name}: {len(pool)}" for pool in pools)
+        logger.info(f"Warm start took {time.monotonic() - started:.2f}s ({sizes})")
+    
+    def save_warm_start_snapshot(self):
+        """Write the pools to the snapshot file for the next start."""
+        if not config.SNAPSHOT_PATH:
+            return
+        pools = {pool.name: pool.snapshot() for pool in (self.joke_pool, self.meme_pool)}
+        if save_snapshot(config.SNAPSHOT_PATH, {"pools": pools}):
+            logger.info(f"Saved warm-start snapshot to {config.SNAPSHOT_PATH}")
+    
+    async def on_shutdown(self, application: Application):
+        """Release shared resources when the application shuts down."""
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        self.profiler.stop()
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            self._stats_task = None
+        await self.overload.stop()
+        await self.pool_refiller.stop()
+        self.save_warm_start_snapshot()
+        await self.upstream.aclose()
+        if self.image_pipeline is not None:
+            self.image_pipeline.close()
+        await self.file_id_cache.close()
+        if self.content_store is not None:
+            await self.content_store.close()
     
     def run(self):
         """Start the bot."""
@@ -531,8 +1746,14 @@ class TelegramEntertainmentBot:
         print("📚 All content is filtered for appropriate material!")
         print("🔄 Press Ctrl+C to stop the bot")
         
+        allowed_updates = self.allowed_update_types()
+        logger.info(f"Requesting update types: {allowed_updates}")
+        
         try:
-            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+            if config.BOT_MODE == "webhook":
+                self.run_webhook(allowed_updates)
+            else:
+                self.application.run_polling(allowed_updates=allowed_updates)
         except KeyboardInterrupt:
             logger.info("Bot stopped by user")
             print("\n🛑 Bot stopped by user")
@@ -540,6 +1761,41 @@ class TelegramEntertainmentBot:
             logger.error(f"Error running bot: {e}")
             print(f"\n❌ Error running bot: {e}")
 
+    def run_webhook(self, allowed_updates: List[str]):
+        """Serve updates through a webhook instead of long polling."""
+        settings = self.webhook_settings()
+        print(f"🌐 Listening for webhook updates on {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}/{settings['url_path']}")
+        self.application.run_webhook(allowed_updates=allowed_updates, **settings)
+    
+    def webhook_settings(self) -> Dict[str, Any]:
+        """Listener and registration arguments for webhook mode."""
+        # check_serving_mode() made sure WEBHOOK_URL is set
+        url_path = config.WEBHOOK_PATH.strip("/")
+        webhook_url = f"{config.WEBHOOK_URL.rstrip('/')}/{url_path}"
+        
+        # Telegram echoes this in X-Telegram-Bot-Api-Secret-Token on every call
+        secret_token = config.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+        
+        return {
+            "listen": config.WEBHOOK_LISTEN,
+            "port": config.WEBHOOK_PORT,
+            "url_path": url_path,
+            "webhook_url": webhook_url,
+            "secret_token": secret_token,
+        }
+
+def check_serving_mode():
+    """
+    Reject serving mode settings the bot cannot run with.
+    
+    Raises:
+        ValueError: If BOT_MODE is unknown, or webhook mode has no WEBHOOK_URL
+    """
+    if config.BOT_MODE not in ("polling", "webhook"):
+        raise ValueError(f"BOT_MODE must be 'polling' or 'webhook', not {config.BOT_MODE!r}")
+    if config.BOT_MODE == "webhook" and not config.WEBHOOK_URL:
+        raise ValueError("BOT_MODE=webhook needs WEBHOOK_URL, the public base URL Telegram sends updates to")
+
 def main():
     """Main function to start the bot."""
     # Get bot token from environment variable or prompt user
@@ -559,6 +1815,19 @@ def main():
         print('export BOT_TOKEN="your_bot_token_here"')
         return
     
+    try:
+        check_serving_mode()
+    except ValueError as e:
+        # Exit non-zero rather than silently serving in another mode
+        raise SystemExit(f"❌ Configuration error: {e}")
+    
+    if config.WORKERS > 1:
+        # Imported here because supervisor builds on this module
+        from supervisor import Supervisor
+        print(f"🤖 Entertainment Bot is starting with {config.WORKERS} worker processes...")
+        Supervisor(bot_token, config.WORKERS).run()
+        return
+    
     # Create and run the bot
     bot = TelegramEntertainmentBot(bot_token)
     bot.run()
@@ -0,0 +1,273 @@
+"""
+Prometheus metrics for the bot, served as plain text from the bot process.
+
+A deliberately small, dependency-free take on the Prometheus client:
+counters and histograms are updated inline (a dict lookup and, for
+histograms, a bisect per observation), and gauges are callbacks evaluated
+only when /metrics is scraped. Every metric the bot exports is declared at
+the bottom of this module so the full set can be read in one place.
+"""
+import asyncio
+import bisect
+import logging
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[str, ...]
+GaugeValues = Union[float, Dict[Labels, float]]
+
+# Seconds; suits both sub-millisecond cache hits and multi-second upstream fetches
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonically increasing count, per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        """Add amount to the count for the given label values."""
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Histogram:
+    """Bucketed distribution of observed values, per label combination."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        """Record one observation for the given label values."""
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Current value read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], GaugeValues]] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def set_function(self, callback: Callable[[], GaugeValues]):
+        """Read the gauge from callback; it returns a number, or label values -> number."""
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        if self.callback is None:
+            return []
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error(f"Error reading gauge {self.name}: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+Metric = Union[Counter, Histogram, Gauge]
+
+
+class Registry:
+    """Ordered collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            samples = metric.render()
+            if not samples and metric.kind == "gauge":
+                continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Minimal HTTP server answering GET /metrics from a registry."""
+
+    def __init__(self, registry: Registry, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """Start listening."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        """Stop listening and wait for the server to close."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            # Drain the headers; nothing in them matters here
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = self.registry.render().encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b"Not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "bot_handler_seconds", "End-to-end handling time per update kind", ["kind"]
+))
+UPSTREAM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "bot_upstream_request_seconds", "Upstream HTTP request latency", ["host"]
+))
+UPSTREAM_RESPONSES = REGISTRY.register(Counter(
+    "bot_upstream_responses_total", "Upstream HTTP outcomes by status code (or error)", ["host", "status"]
+))
+FETCH_ATTEMPTS = REGISTRY.register(Histogram(
+    "bot_fetch_attempts", "Batches needed per successful live fetch", ["kind"], buckets=(1, 2, 3, 4, 5, 7, 10)
+))
+FETCH_FAILURES = REGISTRY.register(Counter(
+    "bot_fetch_failures_total", "Live fetches that ended without content, by reason", ["kind", "reason"]
+))
+FILTER_CHECKED = REGISTRY.register(Counter(
+    "bot_filter_checked_total", "Fetched items run through the content filters", ["kind"]
+))
+FILTER_REJECTIONS = REGISTRY.register(Counter(
+    "bot_filter_rejections_total", "Fetched items rejected, by the flag or check that rejected them", ["kind", "reason"]
+))
+BOT_API_SECONDS = REGISTRY.register(Histogram(
+    "bot_api_request_seconds", "Bot API call latency, excluding time queued for a send slot", ["endpoint"]
+))
+BOT_API_ERRORS = REGISTRY.register(Counter(
+    "bot_api_errors_total", "Failed Bot API calls by error type", ["endpoint", "error"]
+))
+POOL_SIZE = REGISTRY.register(Gauge("bot_pool_size", "Items ready in each content pool", ["kind"]))
+UPDATES_IN_FLIGHT = REGISTRY.register(Gauge(
+    "bot_updates_in_flight", "Updates being processed, by state", ["state"]
+))
+SEND_QUEUE_LENGTH = REGISTRY.register(Gauge(
+    "bot_send_queue_length", "Bot API calls waiting for a send slot, by priority", ["priority"]
+))
+CIRCUIT_OPEN = REGISTRY.register(Gauge("bot_circuit_open", "1 while an upstream circuit is open", ["host"]))
+UPDATE_API_CALLS = REGISTRY.register(Counter(
+    "bot_update_api_calls_total", "Bot API calls made while handling updates, by update kind", ["kind"]
+))
+BATCH_ITEMS = REGISTRY.register(Counter(
+    "bot_batch_items_total", "Jokes and memes delivered by /joke N and /meme N", ["kind"]
+))
+OVERLOAD_LEVEL = REGISTRY.register(Gauge(
+    "bot_overload_level", "Degradation level: 0 normal, 1 cached only, 2 jokes only, 3 shedding"
+))
+EVENT_LOOP_LAG = REGISTRY.register(Gauge("bot_event_loop_lag_seconds", "Smoothed event loop lag"))
+OVERLOAD_SHED = REGISTRY.register(Counter(
+    "bot_overload_shed_total", "Work skipped or downgraded under overload, by action", ["action"]
+))
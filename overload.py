@@ -0,0 +1,182 @@
+"""
+Overload detection and graceful degradation.
+
+A background task measures event loop lag (how late a short sleep wakes up)
+and samples the number of updates being handled or waiting for a worker,
+both averaged over the last few checks, and whether any upstream circuit is
+open. The worse of the two load signals,
+relative to its threshold, picks a degradation level:
+
+- cached_only (load at its threshold, or a circuit open): content comes from
+  the pools and the local store only, no live upstream fetches
+- jokes_only (1.5x): meme requests are answered with a joke
+- shedding (2x): content requests get a short "busy" reply, button presses
+  from a chat that already has an update pending are dropped, and error
+  replies are not sent
+
+Levels go up as soon as the load calls for it and come down one step at a
+time, once the load has stayed below the current level for the recovery
+time, so the bot does not flap between levels at the edge of a threshold.
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+from metrics import OVERLOAD_SHED
+
+logger = logging.getLogger(__name__)
+
+NORMAL = 0
+CACHED_ONLY = 1
+JOKES_ONLY = 2
+SHEDDING = 3
+LEVEL_NAMES = ("normal", "cached_only", "jokes_only", "shedding")
+
+# Load relative to its threshold at which each level starts
+LEVEL_PRESSURE = ((SHEDDING, 2.0), (JOKES_ONLY, 1.5), (CACHED_ONLY, 1.0))
+
+
+class OverloadController:
+    """Tracks load and the degradation level the handlers should apply."""
+
+    def __init__(
+        self,
+        in_flight: Callable[[], int],
+        circuits_open: Callable[[], int],
+        lag_threshold: float,
+        in_flight_threshold: int,
+        interval: float = 0.5,
+        recovery_time: float = 10.0,
+    ):
+        self.in_flight = in_flight
+        self.circuits_open = circuits_open
+        self.lag_threshold = lag_threshold
+        self.in_flight_threshold = in_flight_threshold
+        self.interval = interval
+        self.recovery_time = recovery_time
+
+        self.level = NORMAL
+        # Smoothed event loop lag in seconds and updates in flight
+        self.lag = 0.0
+        self.load = 0.0
+        self._calm_since: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.entered: Counter = Counter()
+        self.shed: Counter = Counter()
+
+    @property
+    def level_name(self) -> str:
+        return LEVEL_NAMES[self.level]
+
+    @property
+    def allows_live_fetch(self) -> bool:
+        return self.level < CACHED_ONLY
+
+    @property
+    def memes_as_jokes(self) -> bool:
+        return self.level >= JOKES_ONLY
+
+    @property
+    def shedding(self) -> bool:
+        return self.level >= SHEDDING
+
+    def record_shed(self, action: str):
+        """Count work skipped because of the current level."""
+        self.shed[action] += 1
+        OVERLOAD_SHED.inc(action)
+
+    def start(self):
+        """Start watching the load on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="overload-controller")
+
+    async def stop(self):
+        """Cancel the watch loop and wait for it to finish."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            lag = max(0.0, now - started - self.interval)
+            try:
+                # Halve the weight of older samples each check, so a single
+                # busy moment does not decide the level on its own
+                self.lag = (self.lag + lag) / 2
+                self.load = (self.load + self.in_flight()) / 2
+                self.update(self.target_level(), now)
+            except Exception as e:
+                logger.error(f"Error checking load: {e}")
+
+    def pressure(self) -> float:
+        """Return the worse load signal relative to its threshold."""
+        pressure = 0.0
+        if self.lag_threshold > 0:
+            pressure = self.lag / self.lag_threshold
+        if self.in_flight_threshold > 0:
+            pressure = max(pressure, self.load / self.in_flight_threshold)
+        return pressure
+
+    def target_level(self) -> int:
+        """Return the level the current load calls for."""
+        pressure = self.pressure()
+        for level, threshold in LEVEL_PRESSURE:
+            if pressure >= threshold:
+                return level
+        return CACHED_ONLY if self.circuits_open() else NORMAL
+
+    def update(self, target: int, now: float):
+        """
+        Move towards the target level: up at once, down one level per recovery time.
+
+        Args:
+            target: Level the current load calls for
+            now: Current loop time
+        """
+        if target > self.level:
+            self._calm_since = None
+            self._set_level(target)
+        elif target < self.level:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.recovery_time:
+                self._calm_since = now
+                self._set_level(self.level - 1)
+        else:
+            self._calm_since = None
+
+    def _set_level(self, level: int):
+        previous = self.level_name
+        self.level = level
+        self.entered[self.level_name] += 1
+        message = (
+            f"Overload level {previous} -> {self.level_name} (loop lag {self.lag * 1000:.0f}ms, "
+            f"{self.load:.1f} updates in flight, {self.circuits_open()} circuits open)"
+        )
+        if level > NORMAL:
+            logger.warning(message)
+        else:
+            logger.info(message)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current level, its inputs and what was shed."""
+        return {
+            "level": self.level_name,
+            "loop_lag_ms": round(self.lag * 1000, 1),
+            "in_flight": self.in_flight(),
+            "in_flight_avg": round(self.load, 1),
+            "pressure": round(self.pressure(), 2),
+            "entered": dict(self.entered),
+            "shed": dict(self.shed),
+        }
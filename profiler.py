@@ -0,0 +1,135 @@
+"""
+Opt-in sampling profiler for the event loop thread.
+
+A background thread samples the event loop thread's Python stack at a fixed
+interval and counts identical stacks. The result is written in the
+"collapsed stack" format (one "frame;frame;frame count" line per stack)
+that flamegraph.pl, speedscope and inferno read directly.
+
+Only stacks that pass through the focus file (main.py, i.e. the bot's own
+handlers) are kept, trimmed to start at the first bot frame so the event
+loop machinery above it does not dominate the graph. Everything else
+(mostly the loop idling in select) is counted under a single "(other)"
+frame, so the graph still shows how busy the bot was.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+OTHER_FRAME = "(other)"
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    # ";" separates frames and " " the count in the collapsed format
+    return f"{module}:{name}".replace(";", ":").replace(" ", "_")
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread."""
+
+    def __init__(self, interval: float = 0.01, focus: Optional[str] = None, max_depth: int = 64):
+        self.interval = interval
+        self.focus = os.path.abspath(focus) if focus else None
+        self.max_depth = max_depth
+
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+        self.started_at: Optional[float] = None
+        self.samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id: Optional[int] = None):
+        """
+        Start sampling a thread, the calling one by default.
+
+        Previous samples are discarded.
+        """
+        if self.running:
+            return
+        self._target = thread_id if thread_id is not None else threading.get_ident()
+        self._stacks = Counter()
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"Profiler started, sampling every {self.interval * 1000:.0f}ms")
+
+    def stop(self) -> int:
+        """
+        Stop sampling.
+
+        Returns:
+            Number of samples taken
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            logger.info(f"Profiler stopped after {self.samples} samples")
+        return self.samples
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                # Target thread exited
+                break
+            self._stacks[self._collapse(frame)] += 1
+            self.samples += 1
+
+    def _collapse(self, frame: Optional[FrameType]) -> str:
+        frames: List[FrameType] = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+
+        if self.focus is not None:
+            for index, candidate in enumerate(frames):
+                if candidate.f_code.co_filename == self.focus:
+                    frames = frames[index:]
+                    break
+            else:
+                return OTHER_FRAME
+        return ";".join(_frame_label(item) for item in frames[:self.max_depth])
+
+    def dump(self, path: str) -> int:
+        """
+        Write the samples taken so far as collapsed stacks, busiest first.
+
+        Returns:
+            Number of distinct stacks written
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        stacks = self._stacks.most_common()
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks:
+                f.write(f"{stack} {count}\n")
+        return len(stacks)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return whether the profiler runs and how much it has sampled."""
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "stacks": len(self._stacks),
+            "in_focus": self.samples - self._stacks.get(OTHER_FRAME, 0),
+        }
@@ -0,0 +1,147 @@
+"""
+Adaptive token-bucket rate limiting for upstream APIs.
+
+Each upstream host gets one TokenBucket shared by every handler, so the
+aggregate request rate stays under the upstream quota no matter how many
+users are active. When an upstream answers 429, the bucket honours its
+Retry-After header and halves its rate, then creeps back to the configured
+rate as requests succeed again.
+"""
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header.
+
+    Args:
+        value: Header value, either delta-seconds or an HTTP date
+
+    Returns:
+        Seconds to wait, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """Token bucket whose refill rate backs off on 429 responses (AIMD)."""
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        min_rate_fraction: float = 0.1,
+        recovery_step: float = 0.05,
+    ):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+
+        self.name = name
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = float(burst)
+        self.min_rate = rate * min_rate_fraction
+        self.recovery_step = rate * recovery_step
+
+        self.tokens = float(burst)
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        # Waiters are served in arrival order
+        self._lock = asyncio.Lock()
+
+        self.acquired = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a request may be sent, then consume one token."""
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+        waited = time.monotonic() - start
+        self.acquired += 1
+        if waited > 0.001:
+            self.delayed += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def on_success(self):
+        """Let the rate recover towards the configured rate."""
+        if self.rate < self.base_rate:
+            self._refill()
+            self.rate = min(self.base_rate, self.rate + self.recovery_step)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        """
+        React to a 429 response from the upstream.
+
+        Args:
+            retry_after: Seconds the upstream asked us to wait, if it said
+        """
+        self._refill()
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+        self.throttled += 1
+        logger.warning(
+            f"{self.name} rate limited us, pausing {pause:.1f}s and "
+            f"lowering rate to {self.rate:.2f}/s"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current limiter state."""
+        self._refill()
+        return {
+            "rate": round(self.rate, 3),
+            "base_rate": self.base_rate,
+            "tokens": round(self.tokens, 2),
+            "capacity": self.capacity,
+            "utilization": round(1 - self.tokens / self.capacity, 3),
+            "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+            "acquired": self.acquired,
+            "delayed": self.delayed,
+            "avg_wait": round(self.total_wait / self.delayed, 3) if self.delayed else 0.0,
+            "max_wait": round(self.max_wait, 3),
+            "throttled": self.throttled,
+        }
@@ -0,0 +1,148 @@
+"""
+In-memory keyword search over filtered content.
+
+Inline queries have to be answered within a tight deadline, so they are
+served from an inverted index instead of the upstream APIs. Content is added
+as it arrives from the pool fetchers; once the index is full the oldest
+documents are dropped. Every query word must match, and the last word also
+matches as a prefix, so results keep up while the user is still typing.
+"""
+import bisect
+import itertools
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Shorter trailing words only match exactly; expanding them would touch most of the index
+MIN_PREFIX_LENGTH = 3
+
+# (kind, key, item)
+SearchResult = Tuple[str, str, Dict[str, Any]]
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase alphanumeric words."""
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """Bounded inverted index from words to content items, newest first."""
+
+    def __init__(self, max_items: int = 50000):
+        self.max_items = max_items
+
+        # doc ID -> (kind, key, item, words); insertion order is age order
+        self._docs: "OrderedDict[int, Tuple[str, str, Dict[str, Any], Tuple[str, ...]]]" = OrderedDict()
+        self._ids: Dict[Tuple[str, str], int] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        # Sorted copy of the posting keys, for prefix lookups
+        self._vocabulary: List[str] = []
+        self._next_id = itertools.count()
+
+        self.searches = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, kind: str, key: str, item: Dict[str, Any], text: str) -> bool:
+        """
+        Index a content item.
+
+        Args:
+            kind: "joke" or "meme"
+            key: Stable identifier of the item within its kind
+            item: The content item returned by searches
+            text: Searchable text for the item
+
+        Returns:
+            True if the item was added, False if it is already indexed
+        """
+        if (kind, key) in self._ids:
+            return False
+
+        doc_id = next(self._next_id)
+        words = tuple(set(tokenize(text)))
+        self._docs[doc_id] = (kind, key, item, words)
+        self._ids[(kind, key)] = doc_id
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = set()
+                bisect.insort(self._vocabulary, word)
+            postings.add(doc_id)
+
+        while len(self._docs) > self.max_items:
+            self._remove_oldest()
+        return True
+
+    def _remove_oldest(self):
+        doc_id, (kind, key, _, words) = self._docs.popitem(last=False)
+        del self._ids[(kind, key)]
+        for word in words:
+            postings = self._postings[word]
+            postings.discard(doc_id)
+            if not postings:
+                del self._postings[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+        self.evicted += 1
+
+    def _prefix_matches(self, prefix: str) -> Set[int]:
+        matches: Set[int] = set()
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        for word in itertools.islice(self._vocabulary, start, None):
+            if not word.startswith(prefix):
+                break
+            matches |= self._postings[word]
+        return matches
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> Tuple[List[SearchResult], Optional[int]]:
+        """
+        Find items matching every word of the query, newest first.
+
+        Args:
+            query: Free-text query; an empty query lists the newest items
+            offset: Number of results to skip, for pagination
+            limit: Maximum number of results to return
+
+        Returns:
+            The page of results, and the offset of the next page or None if
+            this is the last one
+        """
+        self.searches += 1
+        offset = max(0, offset)
+        words = tokenize(query)
+
+        if not words:
+            newest = itertools.islice(reversed(self._docs), offset, offset + limit + 1)
+            doc_ids = list(newest)
+        else:
+            *exact, last = words
+            candidates = [self._postings.get(word, set()) for word in exact]
+            if len(last) >= MIN_PREFIX_LENGTH:
+                candidates.append(self._prefix_matches(last))
+            else:
+                candidates.append(self._postings.get(last, set()))
+
+            # Intersect from the rarest word up
+            candidates.sort(key=len)
+            matches = set(candidates[0])
+            for postings in candidates[1:]:
+                if not matches:
+                    break
+                matches &= postings
+            doc_ids = sorted(matches, reverse=True)[offset:offset + limit + 1]
+
+        next_offset = offset + limit if len(doc_ids) > limit else None
+        results = [self._docs[doc_id][:3] for doc_id in doc_ids[:limit]]
+        return results, next_offset
+
+    def stats(self) -> Dict[str, int]:
+        """Return index size and counters."""
+        return {
+            "documents": len(self._docs),
+            "words": len(self._postings),
+            "searches": self.searches,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,340 @@
+"""
+Outbound Bot API scheduling with flood-control awareness.
+
+SendScheduler plugs into python-telegram-bot as its rate limiter, so every
+Bot API call the bot makes goes through it. It keeps the bot under
+Telegram's global and per-chat limits, pauses everything when Telegram
+answers with RetryAfter, and when requests have to wait it lets
+user-visible results go before cosmetic ones such as "Searching..." texts.
+
+Handlers pick a priority for the calls they make with the send_priority()
+context manager; calls made outside it get a priority based on the endpoint.
+Calls are also counted per update (see start_call_count and ApiCallStats).
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine, Dict, Iterator, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from latency import LatencyStats
+from metrics import BOT_API_ERRORS, BOT_API_SECONDS
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Lower values are sent first
+PRIORITY_INTERACTIVE = 0  # answers Telegram expects quickly (callback/inline answers)
+PRIORITY_RESULT = 1  # the joke or meme the user asked for
+PRIORITY_COSMETIC = 2  # loading texts, clean-up deletes, chat actions
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_RESULT: "result",
+    PRIORITY_COSMETIC: "cosmetic",
+}
+
+# Endpoints that do not count towards a chat's message limit
+CHAT_LIMIT_EXEMPT = {"deleteMessage", "sendChatAction"}
+INTERACTIVE_ENDPOINTS = {"answerCallbackQuery", "answerInlineQuery"}
+COSMETIC_ENDPOINTS = {"deleteMessage", "sendChatAction"}
+
+_send_priority: ContextVar[Optional[int]] = ContextVar("send_priority", default=None)
+# Bot API calls made while handling the current update
+_call_count: ContextVar[Optional[List[int]]] = ContextVar("call_count", default=None)
+
+JSONResult = Union[bool, Dict[str, Any], List[Dict[str, Any]]]
+
+
+@contextlib.contextmanager
+def send_priority(priority: int) -> Iterator[None]:
+    """Send every Bot API call made inside the block at the given priority."""
+    token = _send_priority.set(priority)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
+
+def start_call_count() -> List[int]:
+    """
+    Start counting Bot API calls made from the current task.
+
+    Returns:
+        A one-element list holding the running count
+    """
+    counter = [0]
+    _call_count.set(counter)
+    return counter
+
+
+class ApiCallStats:
+    """Distribution of Bot API calls per update, split by update kind."""
+
+    def __init__(self):
+        self.updates: Counter = Counter()
+        self.calls: Counter = Counter()
+        self.histograms: Dict[str, Counter] = {}
+
+    def record(self, kind: str, calls: int):
+        """Record the number of calls one update of the given kind needed."""
+        self.updates[kind] += 1
+        self.calls[kind] += calls
+        self.histograms.setdefault(kind, Counter())[calls] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return average calls per update and the histogram for each kind."""
+        return {
+            kind: {
+                "updates": self.updates[kind],
+                "avg_calls": round(self.calls[kind] / self.updates[kind], 2),
+                "histogram": dict(sorted(self.histograms[kind].items())),
+            }
+            for kind in sorted(self.updates)
+        }
+
+
+def _request_priority(endpoint: str, rate_limit_args: Optional[int]) -> int:
+    if isinstance(rate_limit_args, int):
+        return min(max(rate_limit_args, PRIORITY_INTERACTIVE), PRIORITY_COSMETIC)
+    if endpoint in INTERACTIVE_ENDPOINTS:
+        return PRIORITY_INTERACTIVE
+    explicit = _send_priority.get()
+    if explicit is not None:
+        return explicit
+    if endpoint in COSMETIC_ENDPOINTS:
+        return PRIORITY_COSMETIC
+    return PRIORITY_RESULT
+
+
+class _Bucket:
+    """Plain token bucket, refilled on demand."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_in(self, now: float) -> float:
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class SendScheduler(BaseRateLimiter[int]):
+    """Priority scheduler enforcing Telegram's global and per-chat limits."""
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        private_chat_rate: float = 1.0,
+        group_chat_rate: float = 20 / 60,
+        chat_burst: int = 4,
+        max_retries: int = 2,
+    ):
+        self.global_bucket = _Bucket(global_rate, global_rate)
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self._chat_buckets: Dict[Union[int, str], _Bucket] = {}
+        # (priority, sequence, chat key or None, enqueued at, future)
+        self._queue: List[Tuple[int, int, Any, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.blocked_until = 0.0
+
+        self.sent = 0
+        self.retry_after_hits = 0
+        self.wait_times = {
+            priority: LatencyStats(f"send_wait_{name}") for priority, name in PRIORITY_NAMES.items()
+        }
+
+    async def initialize(self) -> None:
+        """Start the dispatcher task."""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="send-scheduler")
+
+    async def shutdown(self) -> None:
+        """Stop the dispatcher and release anyone still queued."""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        # Let pending requests through rather than leaving them hanging
+        while self._queue:
+            *_, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, JSONResult]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> JSONResult:
+        """Wait for a send slot, make the request and retry on RetryAfter."""
+        priority = _request_priority(endpoint, rate_limit_args)
+        chat_key = None if endpoint in CHAT_LIMIT_EXEMPT else data.get("chat_id")
+        # Retries keep their place in line, so a chat's sends stay in order
+        sequence = next(self._sequence)
+
+        requested = time.perf_counter()
+        # Includes the wait for a send slot, unlike BOT_API_SECONDS
+        with span(f"bot_api:{endpoint}", priority=PRIORITY_NAMES[priority]) as request_span:
+            attempt = 0
+            while True:
+                await self._acquire(priority, sequence, chat_key)
+                if request_span is not None:
+                    queued = time.perf_counter() - requested
+                    request_span.set(attempts=attempt + 1, queued_ms=round(queued * 1000, 3))
+                counter = _call_count.get()
+                if counter is not None:
+                    counter[0] += 1
+                started = time.perf_counter()
+                try:
+                    result = await callback(*args, **kwargs)
+                except Exception as exc:
+                    BOT_API_SECONDS.observe(time.perf_counter() - started, endpoint)
+                    BOT_API_ERRORS.inc(endpoint, type(exc).__name__)
+                    if not isinstance(exc, RetryAfter):
+                        raise
+
+                    self.retry_after_hits += 1
+                    # Flood control applies bot-wide, so hold every request
+                    self.blocked_until = max(
+                        self.blocked_until, time.monotonic() + float(exc.retry_after) + 0.1
+                    )
+                    if self._wakeup is not None:
+                        self._wakeup.set()
+                    if attempt >= self.max_retries:
+                        logger.error(f"{endpoint} still flood-limited after {attempt + 1} attempts")
+                        raise
+                    logger.warning(f"Flood control on {endpoint}, holding all sends for {exc.retry_after}s")
+                    attempt += 1
+                    continue
+                BOT_API_SECONDS.observe(time.perf_counter() - started, endpoint)
+                self.sent += 1
+                return result
+
+    async def _acquire(self, priority: int, sequence: int, chat_key: Any):
+        if self._dispatcher is None:
+            # Not initialized (e.g. used without an Application): do not throttle
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._queue, (priority, sequence, chat_key, time.monotonic(), future)
+        )
+        self._wakeup.set()
+        await future
+
+    def _chat_bucket(self, chat_key: Any) -> _Bucket:
+        bucket = self._chat_buckets.get(chat_key)
+        if bucket is None:
+            is_group = isinstance(chat_key, str) or (isinstance(chat_key, int) and chat_key < 0)
+            rate = self.group_chat_rate if is_group else self.private_chat_rate
+            bucket = self._chat_buckets[chat_key] = _Bucket(rate, self.chat_burst)
+        return bucket
+
+    def _prune_idle_chats(self, now: float):
+        for chat_key, bucket in list(self._chat_buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._chat_buckets[chat_key]
+
+    async def _sleep(self, delay: float):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch(self):
+        while True:
+            # Drop requests whose callers went away
+            if any(entry[4].done() for entry in self._queue):
+                self._queue = [entry for entry in self._queue if not entry[4].done()]
+                heapq.heapify(self._queue)
+
+            if not self._queue:
+                if len(self._chat_buckets) > 1000:
+                    self._prune_idle_chats(time.monotonic())
+                await self._sleep(None)
+                continue
+
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await self._sleep(self.blocked_until - now)
+                continue
+
+            global_wait = self.global_bucket.ready_in(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            # Highest priority request whose chat has budget left
+            chosen = None
+            soonest = None
+            for entry in sorted(self._queue):
+                chat_key = entry[2]
+                if chat_key is None:
+                    chosen = entry
+                    break
+                chat_wait = self._chat_bucket(chat_key).ready_in(now)
+                if chat_wait == 0:
+                    chosen = entry
+                    break
+                soonest = chat_wait if soonest is None else min(soonest, chat_wait)
+
+            if chosen is None:
+                await self._sleep(soonest)
+                continue
+
+            self._queue.remove(chosen)
+            heapq.heapify(self._queue)
+            priority, _, chat_key, enqueued_at, future = chosen
+            self.global_bucket.tokens -= 1
+            if chat_key is not None:
+                self._chat_bucket(chat_key).tokens -= 1
+            self.wait_times[priority].record(now - enqueued_at)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue length, wait times and flood-control counters."""
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, *_ in self._queue:
+            queued[PRIORITY_NAMES[priority]] += 1
+        return {
+            "queue_length": len(self._queue),
+            "queued": queued,
+            "sent": self.sent,
+            "retry_after_hits": self.retry_after_hits,
+            "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+            "wait": {
+                PRIORITY_NAMES[priority]: stats.stats()
+                for priority, stats in self.wait_times.items()
+            },
+        }
@@ -0,0 +1,93 @@
+"""
+Warm-start snapshots of in-memory content.
+
+On shutdown the bot writes the contents of its pools to a small gzipped JSON
+file; on startup it loads that file back so the first users after a restart
+are answered from memory instead of all hitting the upstream APIs at once.
+A missing, corrupt or outdated snapshot is logged and ignored.
+"""
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bump when the snapshot layout changes; other versions are ignored
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(path: str, sections: Dict[str, Any]) -> bool:
+    """
+    Write a snapshot to disk atomically.
+
+    Args:
+        path: Snapshot file path
+        sections: JSON-serializable data, keyed by section name
+
+    Returns:
+        True if the snapshot was written
+    """
+    data = {"version": SNAPSHOT_VERSION, "saved_at": time.time(), "sections": sections}
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot.")
+    except OSError as e:
+        logger.error(f"Could not save snapshot to {path}: {e}")
+        return False
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(gzip.compress(json.dumps(data, separators=(",", ":")).encode("utf-8")))
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        logger.error(f"Could not save snapshot to {path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def load_snapshot(path: str, max_age: float) -> Optional[Dict[str, Any]]:
+    """
+    Load a snapshot written by save_snapshot.
+
+    Args:
+        path: Snapshot file path
+        max_age: Snapshots older than this many seconds are ignored
+
+    Returns:
+        The snapshot's sections plus its age in seconds under "age", or None
+        if there is no usable snapshot
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "rb") as f:
+            data = json.loads(gzip.decompress(f.read()).decode("utf-8"))
+    except (OSError, EOFError, ValueError) as e:
+        logger.error(f"Ignoring unreadable snapshot at {path}: {e}")
+        return None
+
+    if not isinstance(data, dict) or data.get("version") != SNAPSHOT_VERSION:
+        logger.warning(f"Ignoring snapshot at {path} with unknown layout")
+        return None
+    sections = data.get("sections")
+    saved_at = data.get("saved_at")
+    if not isinstance(sections, dict) or not isinstance(saved_at, (int, float)):
+        logger.warning(f"Ignoring malformed snapshot at {path}")
+        return None
+
+    # A clock that went backwards makes the snapshot look new, not negative-aged
+    age = max(0.0, time.time() - saved_at)
+    if age > max_age:
+        logger.info(f"Ignoring snapshot at {path}: {age:.0f}s old")
+        return None
+    return dict(sections, age=age)
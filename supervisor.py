@@ -0,0 +1,435 @@
+"""
+Multi-process mode: one receiving process and N chat-sharded workers.
+
+The supervisor process receives updates (long polling or webhook, as in
+single-process mode) and routes each one to a worker chosen by its chat ID,
+so all updates of a chat are handled by the same worker, in order. Each
+worker is a full TelegramEntertainmentBot running in its own process and
+event loop, minus the Updater.
+
+Upstream content is fetched, filtered and pooled only in the supervisor.
+Workers keep small local pools that they top up from it over the IPC
+channel, so N workers do not multiply the load on JokeAPI and meme-api.
+File IDs the supervisor already has for a meme travel with it. Every batch
+also carries retry_in, the seconds the supervisor's circuit for that upstream
+stays open (0 while it is closed), which workers use in place of their own
+idle circuit breakers.
+
+Supervisor and workers talk over a local TCP connection per worker, carrying
+length-prefixed JSON messages:
+
+    supervisor -> worker  {"op": "update", "update": {...}}
+                          {"op": "items", "id": n, "items": [...], "retry_in": s}
+                          {"op": "stop"}
+    worker -> supervisor  {"op": "hello", "worker": i, "secret": "..."}
+                          {"op": "take", "id": n, "kind": "joke", "count": k}
+
+Workers that exit are restarted, with exponential backoff if they keep
+crashing. Updates routed to a worker while it is down are buffered and
+delivered once it is back.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import struct
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from telegram import Update
+
+import config
+from main import UPSTREAM_URLS, TelegramEntertainmentBot, meme_key
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("!I")
+# Longest a restarted worker waits before starting again
+MAX_RESTART_DELAY = 30.0
+# A worker that stayed up this long is considered healthy again
+STABLE_AFTER = 60.0
+
+
+async def write_message(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+    """Send one length-prefixed JSON message."""
+    payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+    await writer.drain()
+
+
+async def read_message(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """Read one length-prefixed JSON message, or None once the connection is closed."""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        payload = await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return json.loads(payload)
+
+
+def shard_for(update: Update, workers: int) -> int:
+    """Worker index for an update: by chat, else by user (inline queries), else by update ID."""
+    if update.effective_chat is not None:
+        key = update.effective_chat.id
+    elif update.effective_user is not None:
+        key = update.effective_user.id
+    else:
+        key = update.update_id
+    return key % workers
+
+
+def worker_path(path: str, index: int) -> str:
+    """Per-worker variant of a file path, e.g. data/cache.json -> data/cache.worker1.json."""
+    if not path:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.worker{index}{extension}"
+
+
+def configure_worker(index: int, workers: int):
+    """Adjust the settings of a worker process before its bot is built."""
+    # The supervisor owns the shared pools and their snapshot
+    config.SNAPSHOT_PATH = ""
+    config.JOKE_POOL_LOW_WATERMARK = config.MEME_POOL_LOW_WATERMARK = config.WORKER_POOL_SIZE // 2
+    config.JOKE_POOL_HIGH_WATERMARK = config.MEME_POOL_HIGH_WATERMARK = config.WORKER_POOL_SIZE
+    # Files a single process appends to or rewrites
+    config.FILE_ID_CACHE_PATH = worker_path(config.FILE_ID_CACHE_PATH, index)
+    config.TRACE_PATH = worker_path(config.TRACE_PATH, index)
+    config.PROFILE_DIR = os.path.join(config.PROFILE_DIR, f"worker{index}")
+    if config.METRICS_PORT:
+        config.METRICS_PORT += 1 + index
+    # Telegram's global send limit is per bot, not per process
+    config.SEND_GLOBAL_RATE /= workers
+
+
+class SupplyClient:
+    """Worker side of the IPC channel: requests content, receives updates."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._request_ids = itertools.count()
+        self._requests: Dict[int, asyncio.Future] = {}
+
+    async def take(self, kind: str) -> Tuple[List[Dict[str, Any]], float]:
+        """
+        Ask the supervisor for up to WORKER_POOL_SIZE filtered items of a kind.
+
+        Returns:
+            The items, and the seconds the supervisor's circuit for the kind
+            stays open (0 while it is closed)
+        """
+        request_id = next(self._request_ids)
+        future = self._requests[request_id] = asyncio.get_running_loop().create_future()
+        try:
+            await write_message(
+                self.writer, {"op": "take", "id": request_id, "kind": kind, "count": config.WORKER_POOL_SIZE}
+            )
+            return await future
+        finally:
+            self._requests.pop(request_id, None)
+
+    async def listen(self, on_update: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        """Dispatch messages from the supervisor until it says stop or disconnects."""
+        while True:
+            message = await read_message(self.reader)
+            if message is None or message["op"] == "stop":
+                break
+            if message["op"] == "update":
+                await on_update(message["update"])
+            elif message["op"] == "items":
+                future = self._requests.get(message["id"])
+                if future is not None and not future.done():
+                    future.set_result((message["items"], message.get("retry_in", 0.0)))
+
+        # Nobody will answer outstanding requests any more
+        for future in self._requests.values():
+            if not future.done():
+                future.set_result(([], 0.0))
+
+
+async def _run_worker(token: str, index: int, port: int, secret: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await write_message(writer, {"op": "hello", "worker": index, "secret": secret})
+    client = SupplyClient(reader, writer)
+
+    bot = TelegramEntertainmentBot(token, supply=client.take)
+    application = bot.application
+
+    async def enqueue(data: Dict[str, Any]):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    # Listen first: warm start already takes content from the supervisor
+    listener = asyncio.create_task(client.listen(enqueue))
+    await application.initialize()
+    try:
+        await bot.on_startup(application)
+        await application.start()
+        logger.info(f"Worker {index} ready (pid {os.getpid()})")
+        await listener
+        await application.stop()
+    finally:
+        listener.cancel()
+        await bot.on_shutdown(application)
+        await application.shutdown()
+        writer.close()
+
+
+def run_worker(token: str, index: int, workers: int, port: int, secret: str):
+    """Entry point of a worker process."""
+    logging.basicConfig(
+        format=f'%(asctime)s - worker {index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+        force=True,
+    )
+    # The supervisor decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_worker(index, workers)
+    asyncio.run(_run_worker(token, index, port, secret))
+
+
+class WorkerHandle:
+    """Supervisor-side state of one worker process."""
+
+    def __init__(self, index: int, buffer_size: int):
+        self.index = index
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        # Updates routed here while the worker is down
+        self.buffer: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+        self.started_at = 0.0
+        self.restart_delay = 0.0
+        self.restarts = 0
+        self.routed = 0
+        self.dropped = 0
+
+
+class Supervisor:
+    """Receives updates, routes them to chat-sharded workers and supplies their content."""
+
+    def __init__(self, token: str, workers: int):
+        self.token = token
+        # Receives updates and owns the upstream fetching, filtering and pools
+        self.bot = TelegramEntertainmentBot(token)
+        self.workers = [WorkerHandle(index, config.WORKER_BUFFER_SIZE) for index in range(workers)]
+        # Reported in the supervisor's "Stats:" log line
+        self.bot.worker_stats = self.stats
+        self.secret = secrets.token_hex(16)
+        self._context = multiprocessing.get_context("spawn")
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._port = 0
+        self._stopping = asyncio.Event()
+
+    def run(self):
+        """Start the supervisor and its workers; returns once stopped."""
+        logger.info(f"Starting supervisor with {len(self.workers)} workers")
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logger.info("Supervisor stopped by user")
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self._stopping.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows: Ctrl+C raises KeyboardInterrupt instead
+                pass
+
+        self._server = await asyncio.start_server(self.handle_worker, "127.0.0.1", 0)
+        self._port = self._server.sockets[0].getsockname()[1]
+        for worker in self.workers:
+            self.start_worker(worker)
+
+        application = self.bot.application
+        await application.initialize()
+        monitor = router = None
+        try:
+            await self.bot.on_startup(application)
+            allowed_updates = self.bot.allowed_update_types()
+            if config.BOT_MODE == "webhook":
+                await application.updater.start_webhook(allowed_updates=allowed_updates, **self.bot.webhook_settings())
+            else:
+                await application.updater.start_polling(allowed_updates=allowed_updates)
+            monitor = asyncio.create_task(self.monitor_workers())
+            router = asyncio.create_task(self.route_updates())
+            await self._stopping.wait()
+        finally:
+            logger.info("Stopping supervisor")
+            for task in (monitor, router):
+                if task is not None:
+                    task.cancel()
+            if application.updater.running:
+                await application.updater.stop()
+            await self.stop_workers()
+            self._server.close()
+            await self.bot.on_shutdown(application)
+            await application.shutdown()
+
+    def start_worker(self, worker: WorkerHandle):
+        worker.process = self._context.Process(
+            target=run_worker,
+            args=(self.token, worker.index, len(self.workers), self._port, self.secret),
+            name=f"bot-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        logger.info(f"Started worker {worker.index} (pid {worker.process.pid})")
+
+    async def monitor_workers(self):
+        """Restart workers that exit, backing off while they keep crashing."""
+        while True:
+            await asyncio.sleep(1.0)
+            for worker in self.workers:
+                if worker.process is None or worker.process.exitcode is None:
+                    continue
+                uptime = time.monotonic() - worker.started_at
+                worker.restart_delay = (
+                    config.WORKER_RESTART_DELAY if uptime >= STABLE_AFTER
+                    else min(MAX_RESTART_DELAY, max(config.WORKER_RESTART_DELAY, worker.restart_delay * 2))
+                )
+                logger.error(
+                    f"Worker {worker.index} exited with code {worker.process.exitcode} after {uptime:.0f}s, "
+                    f"restarting in {worker.restart_delay:.0f}s"
+                )
+                worker.process = None
+                worker.writer = None
+                worker.restarts += 1
+                asyncio.create_task(self._restart_later(worker))
+
+    async def _restart_later(self, worker: WorkerHandle):
+        await asyncio.sleep(worker.restart_delay)
+        if not self._stopping.is_set():
+            self.start_worker(worker)
+
+    async def stop_workers(self):
+        for worker in self.workers:
+            if worker.writer is not None:
+                try:
+                    await write_message(worker.writer, {"op": "stop"})
+                except ConnectionError:
+                    pass
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            process = worker.process
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, config.WORKER_STOP_TIMEOUT)
+            if process.exitcode is None:
+                logger.warning(f"Worker {worker.index} did not stop in time, terminating it")
+                process.terminate()
+                await loop.run_in_executor(None, process.join, 5.0)
+        for worker in self.workers:
+            worker.process = None
+
+    async def route_updates(self):
+        """Move received updates to the worker owning their chat."""
+        queue = self.bot.application.update_queue
+        while True:
+            update = await queue.get()
+            if not isinstance(update, Update):
+                continue
+            worker = self.workers[shard_for(update, len(self.workers))]
+            worker.routed += 1
+            await self.deliver(worker, update.to_dict())
+
+    async def deliver(self, worker: WorkerHandle, data: Dict[str, Any]):
+        # A writer that is closing accepts writes without raising but never
+        # sends them, so treat it like a dead connection
+        if worker.writer is not None and worker.writer.is_closing():
+            worker.writer = None
+        if worker.writer is not None:
+            try:
+                await write_message(worker.writer, {"op": "update", "update": data})
+                return
+            except ConnectionError:
+                worker.writer = None
+        if len(worker.buffer) == worker.buffer.maxlen:
+            worker.dropped += 1
+            logger.warning(f"Worker {worker.index} is down and its buffer is full, dropping an update")
+        worker.buffer.append(data)
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve one worker connection: flush buffered updates, then answer content requests."""
+        hello = await read_message(reader)
+        if (
+            not hello or hello.get("op") != "hello" or hello.get("secret") != self.secret
+            or not 0 <= hello.get("worker", -1) < len(self.workers)
+        ):
+            logger.warning("Rejected an IPC connection without a valid hello")
+            writer.close()
+            return
+
+        worker = self.workers[hello["worker"]]
+        # Updates routed meanwhile join the buffer, so the chat order holds
+        while worker.buffer:
+            # Removed only once written, so a failed flush keeps the update
+            await write_message(writer, {"op": "update", "update": worker.buffer[0]})
+            worker.buffer.popleft()
+        worker.writer = writer
+        logger.info(f"Worker {worker.index} connected")
+
+        while True:
+            message = await read_message(reader)
+            if message is None:
+                break
+            if message.get("op") == "take":
+                asyncio.create_task(self.answer_take(writer, message))
+        if worker.writer is writer:
+            worker.writer = None
+        writer.close()
+
+    async def answer_take(self, writer: asyncio.StreamWriter, request: Dict[str, Any]):
+        kind = request["kind"]
+        items = await self.take(kind, request["count"])
+        retry_in = self.bot.upstream.circuit_retry_in(UPSTREAM_URLS[kind])
+        try:
+            await write_message(
+                writer, {"op": "items", "id": request["id"], "items": items, "retry_in": round(retry_in, 2)}
+            )
+        except ConnectionError:
+            pass
+
+    async def take(self, kind: str, count: int) -> List[Dict[str, Any]]:
+        """Hand out pooled items, fetching live (shared with other callers) if the pool is empty."""
+        bot = self.bot
+        pool = bot.joke_pool if kind == "joke" else bot.meme_pool
+        items = []
+        while len(items) < count:
+            item = pool.pop()
+            if item is None:
+                break
+            items.append(item)
+        if not items:
+            item = await (bot.fetch_clean_joke() if kind == "joke" else bot.fetch_safe_meme())
+            if item is not None:
+                items.append(item)
+
+        if kind == "meme":
+            for index, item in enumerate(items):
+                file_id = bot.file_id_cache.get(meme_key(item))
+                if file_id:
+                    items[index] = {**item, "file_id": file_id}
+        return items
+
+    def stats(self) -> Dict[str, Any]:
+        """Return per-worker routing and restart counters."""
+        return {
+            worker.index: {
+                "alive": worker.process is not None and worker.process.is_alive(),
+                "connected": worker.writer is not None,
+                "routed": worker.routed,
+                "buffered": len(worker.buffer),
+                "dropped": worker.dropped,
+                "restarts": worker.restarts,
+            }
+            for worker in self.workers
+        }
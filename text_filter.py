@@ -0,0 +1,244 @@
+"""
+Rule-based text filter layered on the upstream content flags.
+
+Upstream flags miss offensive wording in meme titles and jokes, so every
+fetched batch is also checked against a rule file. Each line of the file is
+either a blocked word or phrase, or a regular expression prefixed with "re:";
+blank lines and lines starting with "#" are ignored. Matching is
+case-insensitive, and words only match whole words.
+
+The blocked words are compiled into a single pattern: one prefix-sharing
+trie, so the regex engine walks the text once for all of them, Aho-Corasick
+style, instead of once per word. Regex rules are compiled one by one, since
+joining them into one alternation breaks inline flags such as "(?i)" and
+renumbers backreferences; invalid ones are skipped. Batches are checked in
+one call, which also looks for rule file changes at most once per
+check_interval; the patterns are rebuilt only when the file changed, and a
+rule file that fails to compile leaves the previous rules in place.
+(Joining a batch into one string and scanning that was measured to be no
+faster than one search per item with the compiled pattern.)
+"""
+import logging
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+REGEX_PREFIX = "re:"
+
+T = TypeVar("T")
+
+
+def parse_rules(lines: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Split rule file lines into blocked words and regular expressions.
+
+    Returns:
+        (words, regexes), words lowercased and deduplicated
+    """
+    words: Dict[str, None] = {}
+    regexes: List[str] = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith(REGEX_PREFIX):
+            regexes.append(line[len(REGEX_PREFIX):].strip())
+        else:
+            words[" ".join(line.lower().split())] = None
+    return list(words), regexes
+
+
+def trie_pattern(words: List[str]) -> str:
+    """
+    Build a regex alternation matching any of the words, with shared prefixes factored out.
+
+    ["cat", "car", "cart"] becomes "ca(?:r(?:t)?|t)", which the regex engine
+    matches in a single walk rather than trying every word in turn. The
+    space between the words of a phrase matches any run of whitespace.
+    """
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, Any]) -> str:
+        is_end = "" in node
+        branches = [
+            (r"\s+" if char == " " else re.escape(char)) + build(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not is_end:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if is_end else "")
+
+    return build(trie)
+
+
+class TextFilter:
+    """Compiled blocklist and regex matcher with per-rule hit counts."""
+
+    def __init__(self, path: Optional[str], check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+
+        self._words_pattern: Optional[Pattern[str]] = None
+        # (rule text, compiled pattern) for regex rules, in file order
+        self._regex_rules: List[Tuple[str, Pattern[str]]] = []
+        self._file_version: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+
+        self.words = 0
+        self.regexes = 0
+        self.reloads = 0
+        self.checked = 0
+        self.rejected = 0
+        self.hits: Counter = Counter()
+
+        self.reload_if_changed(force=True)
+
+    def compile(self, lines: List[str]):
+        """
+        Replace the current rules with the given rule file lines.
+
+        Raises:
+            re.error: If the blocked words cannot be compiled; the current
+                rules are kept
+        """
+        words, regexes = parse_rules(lines)
+
+        words_pattern = None
+        if words:
+            words_pattern = re.compile(r"(?<!\w)(?:" + trie_pattern(words) + r")(?!\w)", re.IGNORECASE)
+        regex_rules = []
+        for regex in regexes:
+            try:
+                regex_rules.append((f"{REGEX_PREFIX}{regex}", re.compile(regex, re.IGNORECASE)))
+            except re.error as e:
+                logger.error(f"Skipping invalid filter regex {regex!r}: {e}")
+
+        self._words_pattern = words_pattern
+        self._regex_rules = regex_rules
+        self.words = len(words)
+        self.regexes = len(regex_rules)
+
+    def reload_if_changed(self, force: bool = False) -> bool:
+        """
+        Recompile the rules if the rule file changed since it was last read.
+
+        Args:
+            force: Check the file even if check_interval has not elapsed
+
+        Returns:
+            True if the rules were recompiled
+        """
+        now = time.monotonic()
+        if not self.path or (not force and now - self._checked_at < self.check_interval):
+            return False
+        self._checked_at = now
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._file_version is not None or force:
+                logger.info(f"No filter rules at {self.path}, text filtering disabled")
+                self.compile([])
+                self._file_version = None
+            return False
+        except OSError as e:
+            logger.error(f"Could not check filter rules at {self.path}: {e}")
+            return False
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self._file_version:
+            return False
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except (OSError, UnicodeDecodeError) as e:
+            # Keep filtering with the rules we already have
+            logger.error(f"Could not read filter rules from {self.path}: {e}")
+            return False
+
+        # Recorded even on failure, so a broken file is only reported once
+        self._file_version = version
+        try:
+            self.compile(lines)
+        except Exception as e:
+            logger.error(f"Could not compile filter rules from {self.path}, keeping the previous rules: {e}")
+            return False
+        self.reloads += 1
+        logger.info(f"Loaded {self.words} blocked words and {self.regexes} regexes from {self.path}")
+        return True
+
+    def match(self, text: str) -> Optional[str]:
+        """Return the first rule the text matches (blocked words first), or None if it is clean."""
+        if self._words_pattern is not None:
+            found = self._words_pattern.search(text)
+            if found:
+                return " ".join(found.group().lower().split())
+        for rule, pattern in self._regex_rules:
+            if pattern.search(text):
+                return rule
+        return None
+
+    def check_batch(self, texts: List[str]) -> List[Optional[str]]:
+        """
+        Check a batch of texts against the compiled rules.
+
+        Args:
+            texts: Texts to check
+
+        Returns:
+            For each text, the first rule it matched, or None if it is clean
+        """
+        self.reload_if_changed()
+        self.checked += len(texts)
+        results: List[Optional[str]] = [None] * len(texts)
+        if (self._words_pattern is None and not self._regex_rules) or not texts:
+            return results
+
+        match = self.match
+        for index, text in enumerate(texts):
+            rule = match(text)
+            if rule is not None:
+                results[index] = rule
+                self.hits[rule] += 1
+                self.rejected += 1
+        return results
+
+    def filter_items(self, items: List[T], text_func: Callable[[T], str]) -> List[T]:
+        """
+        Drop items whose text matches a rule.
+
+        Args:
+            items: Items that already passed the upstream flag checks
+            text_func: Returns the text to check for an item
+
+        Returns:
+            The items that matched no rule, in their original order
+        """
+        results = self.check_batch([text_func(item) for item in items])
+        for item, rule in zip(items, results):
+            if rule is not None:
+                logger.debug(f"Text filter rejected {text_func(item)!r} (rule {rule!r})")
+        return [item for item, rule in zip(items, results) if rule is None]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return rule counts, totals and per-rule hit counts."""
+        return {
+            "words": self.words,
+            "regexes": self.regexes,
+            "reloads": self.reloads,
+            "checked": self.checked,
+            "rejected": self.rejected,
+            "hits": dict(self.hits.most_common()),
+        }
@@ -0,0 +1,200 @@
+"""
+Sampled per-update tracing.
+
+A sampled update gets a root span when it starts processing; code on its
+path opens child spans with span(), and the finished tree is written as one
+JSON line to a size-rotated file. The current span travels in a context
+variable, so it follows the update into the tasks it starts (coalesced
+fetches, gathered sends) without being passed around. For updates that are
+not sampled span() only reads that variable, which keeps tracing cheap
+enough to leave compiled in everywhere.
+
+Spans still open when their update finishes (e.g. a shared fetch that
+outlives the update that started it) are written as unfinished, and
+anything they record afterwards is dropped.
+"""
+import contextlib
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Trace:
+    """Spans recorded for one update."""
+
+    __slots__ = ("trace_id", "spans", "started", "wall_time", "finished", "_span_ids")
+
+    def __init__(self):
+        self.trace_id = os.urandom(8).hex()
+        self.spans: List["Span"] = []
+        self.started = time.perf_counter()
+        self.wall_time = time.time()
+        self.finished = False
+        self._span_ids = itertools.count()
+
+    def new_span(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]) -> "Span":
+        span = Span(self, next(self._span_ids), parent.span_id if parent else None, name, attrs)
+        self.spans.append(span)
+        return span
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "start", "end", "error")
+
+    def __init__(self, trace: Trace, span_id: int, parent_id: Optional[int], name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any):
+        """Attach attributes to the span."""
+        if not self.trace.finished:
+            self.attrs.update(attrs)
+
+    def to_dict(self, children: Dict[Optional[int], List["Span"]]) -> Dict[str, Any]:
+        started = self.trace.started
+        record: Dict[str, Any] = {
+            "name": self.name,
+            "start_ms": round((self.start - started) * 1000, 3),
+            "duration_ms": round((self.end - self.start) * 1000, 3) if self.end is not None else None,
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if self.error:
+            record["error"] = self.error
+        if self.end is None:
+            record["unfinished"] = True
+        nested = children.get(self.span_id)
+        if nested:
+            record["children"] = [child.to_dict(children) for child in nested]
+        return record
+
+
+def current_span() -> Optional[Span]:
+    """Return the innermost open span of the current task, if it is being traced."""
+    span = _current_span.get()
+    if span is None or span.trace.finished:
+        return None
+    return span
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """
+    Time the block as a child of the current span.
+
+    Yields the new span, or None when the current update is not traced.
+    Exceptions leaving the block are recorded on the span and re-raised.
+    """
+    parent = current_span()
+    if parent is None:
+        yield None
+        return
+
+    child = parent.trace.new_span(name, parent, attrs)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+class Tracer:
+    """Samples updates and writes their span trees to a rotating JSONL file."""
+
+    def __init__(self, path: str, sample_rate: float, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3):
+        self.path = path
+        self.sample_rate = sample_rate if path else 0.0
+
+        self.started = 0
+        self.sampled = 0
+        self.written = 0
+
+        self._writer: Optional[logging.Logger] = None
+        if self.sample_rate > 0:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+                )
+            except OSError as e:
+                logger.error(f"Could not open trace file {path}, tracing disabled: {e}")
+                self.sample_rate = 0.0
+            else:
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._writer = logging.getLogger(f"{__name__}.spans")
+                self._writer.handlers = [handler]
+                self._writer.setLevel(logging.INFO)
+                self._writer.propagate = False
+                logger.info(f"Tracing {self.sample_rate:.1%} of updates to {path}")
+
+    def start_trace(self, name: str, **attrs: Any) -> Optional[Span]:
+        """
+        Decide whether to trace the current task and open its root span if so.
+
+        Returns:
+            The root span, or None if this update is not sampled
+        """
+        self.started += 1
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            _current_span.set(None)
+            return None
+        self.sampled += 1
+        root = Trace().new_span(name, None, attrs)
+        _current_span.set(root)
+        return root
+
+    def finish_trace(self, root: Optional[Span]):
+        """Close the root span and write the trace."""
+        if root is None or root.trace.finished:
+            return
+        root.end = time.perf_counter()
+        trace = root.trace
+        trace.finished = True
+        _current_span.set(None)
+
+        children: Dict[Optional[int], List[Span]] = {}
+        for item in trace.spans[1:]:
+            children.setdefault(item.parent_id, []).append(item)
+        record = {
+            "trace_id": trace.trace_id,
+            "time": round(trace.wall_time, 3),
+            **root.to_dict(children),
+        }
+        try:
+            self._writer.info(json.dumps(record, default=str, ensure_ascii=False))
+            self.written += 1
+        except Exception as e:
+            logger.error(f"Could not write trace {trace.trace_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the sample rate and trace counters."""
+        return {
+            "sample_rate": self.sample_rate,
+            "updates": self.started,
+            "sampled": self.sampled,
+            "written": self.written,
+        }
@@ -0,0 +1,298 @@
+"""
+Async HTTP client for the upstream content APIs (JokeAPI and meme-api).
+
+A single UpstreamClient is shared by every handler. It keeps one keep-alive
+connection pool per upstream host, so a slow host can only tie up its own
+connections and never starves requests to the other API. File downloads
+(meme images, which may live on any host) share one separate pool.
+"""
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+import config
+from circuit import CircuitBreaker
+from metrics import UPSTREAM_REQUEST_SECONDS, UPSTREAM_RESPONSES
+from ratelimit import TokenBucket, parse_retry_after
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadTooLarge(Exception):
+    """Raised when a download is larger than the size limit it was given."""
+
+
+class UpstreamClient:
+    """Pooled, non-blocking HTTP client for the joke and meme APIs."""
+
+    def __init__(
+        self,
+        connect_timeout: float = config.HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = config.HTTP_READ_TIMEOUT,
+        max_connections_per_host: int = config.HTTP_MAX_CONNECTIONS_PER_HOST,
+        keepalive_connections_per_host: int = config.HTTP_KEEPALIVE_CONNECTIONS_PER_HOST,
+        keepalive_expiry: float = config.HTTP_KEEPALIVE_EXPIRY,
+    ):
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=read_timeout,
+            pool=connect_timeout,
+        )
+        self.limits = httpx.Limits(
+            max_connections=max_connections_per_host,
+            max_keepalive_connections=keepalive_connections_per_host,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # One pool per host, created lazily on first use
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        # Shared by all downloads, whatever their host
+        self._download_client: Optional[httpx.AsyncClient] = None
+        # Optional request-rate limiter per host
+        self.limiters: Dict[str, TokenBucket] = {}
+        # Optional circuit breaker per host
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._closed = False
+
+    def set_rate_limit(self, url: str, rate: float, burst: int):
+        """
+        Limit the request rate to the host of the given URL.
+
+        Args:
+            url: Any URL on the upstream host
+            rate: Sustained requests per second
+            burst: Maximum number of back-to-back requests
+        """
+        host = httpx.URL(url).host
+        self.limiters[host] = TokenBucket(host, rate, burst)
+
+    def set_circuit_breaker(self, url: str, failure_threshold: int, reset_timeout: float):
+        """
+        Guard the host of the given URL with a circuit breaker.
+
+        Args:
+            url: Any URL on the upstream host
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds the circuit stays open before probing
+        """
+        host = httpx.URL(url).host
+        self.breakers[host] = CircuitBreaker(host, failure_threshold, reset_timeout)
+
+    def _new_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=self.limits,
+            headers={"User-Agent": "Entertainment-TG-BOT"},
+            follow_redirects=True,
+        )
+
+    def _client_for(self, url: str) -> httpx.AsyncClient:
+        """Return the pooled client for the host of the given URL."""
+        if self._closed:
+            raise RuntimeError("UpstreamClient is closed")
+
+        host = httpx.URL(url).host
+        client = self._clients.get(host)
+        if client is None:
+            client = self._clients[host] = self._new_client()
+        return client
+
+    def _metric_host(self, host: str) -> str:
+        """Host label for metrics: configured upstreams by name, any other host as "other"."""
+        return host if host in self.limiters or host in self.breakers else "other"
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        """
+        Perform a GET request through the pool for the URL's host.
+
+        Args:
+            url: Absolute URL to request
+            params: Optional query string parameters
+
+        Returns:
+            The response, after raising for 4xx/5xx status codes
+
+        Raises:
+            CircuitOpenError: If the host's circuit breaker is open
+        """
+        client = self._client_for(url)
+        host = httpx.URL(url).host
+        limiter = self.limiters.get(host)
+        breaker = self.breakers.get(host)
+
+        metric_host = self._metric_host(host)
+
+        requested = time.perf_counter()
+        # Covers the breaker check and rate limiter wait, not just the request
+        with span("upstream", host=host, path=httpx.URL(url).path) as request_span:
+            if breaker is not None:
+                breaker.before_call()
+            try:
+                if limiter is not None:
+                    await limiter.acquire()
+                started = time.perf_counter()
+                if request_span is not None:
+                    request_span.set(queued_ms=round((started - requested) * 1000, 3))
+                response = await client.get(url, params=params)
+            except httpx.TransportError:
+                UPSTREAM_RESPONSES.inc(metric_host, "error")
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            except BaseException:
+                if breaker is not None:
+                    breaker.release_call()
+                raise
+            UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started, metric_host)
+            UPSTREAM_RESPONSES.inc(metric_host, str(response.status_code))
+            if request_span is not None:
+                request_span.set(status=response.status_code)
+
+            if breaker is not None:
+                # Any non-5xx answer means the upstream is alive
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if limiter is not None:
+                if response.status_code == 429:
+                    limiter.on_rate_limited(parse_retry_after(response.headers.get("Retry-After")))
+                elif response.is_success:
+                    limiter.on_success()
+            response.raise_for_status()
+            return response
+
+    async def get_json(self, url: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Perform a GET request and decode the JSON body.
+
+        Args:
+            url: Absolute URL to request
+            params: Optional query string parameters
+
+        Returns:
+            The decoded JSON payload
+        """
+        response = await self.get(url, params=params)
+        return response.json()
+
+    async def download(self, url: str, max_bytes: int) -> Tuple[httpx.Headers, bytes]:
+        """
+        Download a file through the shared download pool, up to a size limit.
+
+        Args:
+            url: Absolute URL to download
+            max_bytes: Largest body accepted; the transfer stops once exceeded
+
+        Returns:
+            The response headers and body
+
+        Raises:
+            httpx.HTTPStatusError: For 4xx/5xx responses
+            DownloadTooLarge: If the body is larger than max_bytes
+        """
+        if self._closed:
+            raise RuntimeError("UpstreamClient is closed")
+        if self._download_client is None:
+            self._download_client = self._new_client()
+        client = self._download_client
+        host = httpx.URL(url).host
+        metric_host = self._metric_host(host)
+        with span("download", host=host) as download_span:
+            started = time.perf_counter()
+            try:
+                async with client.stream("GET", url) as response:
+                    UPSTREAM_RESPONSES.inc(metric_host, str(response.status_code))
+                    response.raise_for_status()
+                    declared = response.headers.get("Content-Length", "")
+                    if declared.isdigit() and int(declared) > max_bytes:
+                        raise DownloadTooLarge(f"{url} is {declared} bytes, over the {max_bytes} byte limit")
+
+                    chunks = []
+                    size = 0
+                    async for chunk in response.aiter_bytes():
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise DownloadTooLarge(f"{url} is over the {max_bytes} byte limit")
+                        chunks.append(chunk)
+            except httpx.TransportError:
+                UPSTREAM_RESPONSES.inc(metric_host, "error")
+                raise
+            UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started, metric_host)
+            if download_span is not None:
+                download_span.set(status=response.status_code, bytes=size)
+            return response.headers, b"".join(chunks)
+
+    async def aclose(self):
+        """Close every pooled connection. Safe to call more than once."""
+        self._closed = True
+        clients, self._clients = self._clients, {}
+        if self._download_client is not None:
+            clients["downloads"], self._download_client = self._download_client, None
+        for host, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"Error closing HTTP pool for {host}: {e}")
+        logger.info("Upstream HTTP pools closed")
+
+    def limiter_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return the state of every per-host rate limiter."""
+        return {host: limiter.stats() for host, limiter in self.limiters.items()}
+
+    def breaker_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return the state of every per-host circuit breaker."""
+        return {host: breaker.stats() for host, breaker in self.breakers.items()}
+
+    def is_available(self, url: str) -> bool:
+        """Return False while the circuit for the URL's host is open."""
+        breaker = self.breakers.get(httpx.URL(url).host)
+        return breaker is None or not breaker.is_open
+
+    def circuit_retry_in(self, url: str) -> float:
+        """Return the seconds the circuit for the URL's host stays open, 0 while it is not open."""
+        breaker = self.breakers.get(httpx.URL(url).host)
+        if breaker is None or not breaker.is_open:
+            return 0.0
+        return breaker.retry_in
+
+
+class BatchStats:
+    """Counters describing how many items each upstream batch yields."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.batches = 0
+        self.items_received = 0
+        self.items_kept = 0
+        self.last_received = 0
+        self.last_kept = 0
+
+    def record(self, received: int, kept: int):
+        """Record the outcome of one batch."""
+        self.batches += 1
+        self.items_received += received
+        self.items_kept += kept
+        self.last_received = received
+        self.last_kept = kept
+
+    @property
+    def yield_ratio(self) -> float:
+        """Fraction of received items that survived filtering."""
+        if self.items_received == 0:
+            return 0.0
+        return self.items_kept / self.items_received
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the counters as a dictionary."""
+        return {
+            "batches": self.batches,
+            "items_received": self.items_received,
+            "items_kept": self.items_kept,
+            "items_per_batch": self.items_kept / self.batches if self.batches else 0.0,
+            "yield_ratio": round(self.yield_ratio, 3),
+            "last_batch": f"{self.last_kept}/{self.last_received}",
+        }